@@ -0,0 +1,163 @@
+"""
+Copyright (c) 2016 Jet Propulsion Laboratory,
+California Institute of Technology.  All rights reserved
+"""
+import pickle
+import unittest
+
+import numpy as np
+
+from webservice.accumulators import Covariance, LinearTrend, Moments
+
+
+def masked_values(random, shape):
+    """
+    Random values around 300 with about a fifth of them masked and a tenth NaN.
+    """
+    values = random.rand(*shape) * 30 + 300
+    values[random.rand(*shape) < 0.1] = np.nan
+    return np.ma.array(values, mask=random.rand(*shape) < 0.2)
+
+
+def valid(values):
+    return np.ma.masked_invalid(values)
+
+
+class TestMoments(unittest.TestCase):
+    def setUp(self):
+        random = np.random.RandomState(0)
+        # 20 times of a 6 by 5 grid
+        self.values = masked_values(random, (20, 6, 5))
+        self.expected = valid(self.values)
+
+    def assert_moments(self, moments, expected, axis=0):
+        np.testing.assert_array_equal(expected.count(axis=axis), moments.count)
+        np.testing.assert_allclose(expected.mean(axis=axis).filled(0), moments.mean, rtol=1e-12)
+        np.testing.assert_allclose(expected.std(axis=axis).filled(0), moments.std().filled(0), rtol=1e-9)
+        np.testing.assert_allclose(expected.min(axis=axis).filled(0), moments.masked_min().filled(0))
+        np.testing.assert_allclose(expected.max(axis=axis).filled(0), moments.masked_max().filled(0))
+
+    def test_update(self):
+        moments = Moments(self.values.shape[1:])
+        for values in self.values:
+            moments.update(values)
+
+        self.assert_moments(moments, self.expected)
+
+    def test_of(self):
+        self.assert_moments(Moments.of(self.values, axis=0), self.expected)
+
+        moments = Moments.of(self.values)
+        self.assertEquals(self.expected.count(), moments.count)
+        self.assertAlmostEquals(self.expected.mean(), moments.mean, places=9)
+        self.assertAlmostEquals(self.expected.std(), moments.std(), places=9)
+
+    def test_merge_halves(self):
+        first = Moments.of(self.values[:7], axis=0)
+        second = Moments.of(self.values[7:], axis=0)
+
+        self.assert_moments(first.merge(second), self.expected)
+
+    def test_merge_index(self):
+        # Scalar Moments of each tile merged into the days it covers, as in TimeSeries
+        moments = Moments((4,))
+        moments.merge(Moments.of(self.values[0]), slice(0, 2))
+        moments.merge(Moments.of(self.values[1]), slice(1, 3))
+
+        first, second, both = valid(self.values[0]), valid(self.values[1]), valid(self.values[0:2])
+        self.assertEquals([first.count(), both.count(), second.count(), 0], moments.count.tolist())
+        self.assertAlmostEquals(first.mean(), moments.mean[0], places=9)
+        self.assertAlmostEquals(both.mean(), moments.mean[1], places=9)
+        self.assertAlmostEquals(both.std(), moments.std()[1], places=9)
+        self.assertAlmostEquals(second.std(), moments.std()[2], places=9)
+        self.assertIs(np.ma.masked, moments.masked_mean()[3])
+
+    def test_empty(self):
+        moments = Moments((2,))
+        moments.update(np.ma.array([np.nan, 1.0], mask=[False, True]))
+
+        self.assertEquals([0, 0], moments.count.tolist())
+        self.assertTrue(moments.masked_mean().mask.all())
+        self.assertTrue(moments.std().mask.all())
+
+    def test_of_groups(self):
+        values = self.values.reshape(-1)
+        groups = np.random.RandomState(1).randint(0, 7, values.size)
+        groups[groups == 3] = 4
+
+        moments = Moments.of_groups(values, groups, 7)
+
+        for group in xrange(0, 7):
+            expected = valid(values[groups == group])
+            self.assertEquals(expected.count(), moments.count[group])
+            if expected.count() == 0:
+                self.assertIs(np.ma.masked, moments.masked_max()[group])
+                continue
+            self.assertAlmostEquals(expected.mean(), moments.mean[group], places=9)
+            self.assertAlmostEquals(expected.std(), moments.std()[group], places=9)
+            self.assertEquals(expected.min(), moments.min[group])
+            self.assertEquals(expected.max(), moments.max[group])
+
+    def test_pickle(self):
+        moments = pickle.loads(pickle.dumps(Moments.of(self.values, axis=0), pickle.HIGHEST_PROTOCOL))
+
+        self.assert_moments(moments, self.expected)
+
+
+class TestCovariance(unittest.TestCase):
+    def setUp(self):
+        random = np.random.RandomState(2)
+        self.x = masked_values(random, (30, 4, 3))
+        self.y = self.x * 0.5 + masked_values(random, (30, 4, 3))
+
+    def expected(self, row, column):
+        x, y = valid(self.x[:, row, column]), valid(self.y[:, row, column])
+        both = ~np.ma.getmaskarray(x) & ~np.ma.getmaskarray(y)
+        return x.data[both], y.data[both]
+
+    def assert_covariance(self, covariance):
+        for row in xrange(0, 4):
+            for column in xrange(0, 3):
+                x, y = self.expected(row, column)
+                self.assertEquals(len(x), covariance.count[row, column])
+                self.assertAlmostEquals(np.cov(x, y, bias=True)[0, 1], covariance.covariance()[row, column],
+                                        places=7)
+                self.assertAlmostEquals(np.corrcoef(x, y)[0, 1], covariance.correlation()[row, column], places=9)
+
+    def test_update(self):
+        covariance = Covariance((4, 3))
+        for x, y in zip(self.x, self.y):
+            covariance.update(x, y)
+
+        self.assert_covariance(covariance)
+
+    def test_merge_halves(self):
+        first = Covariance.of(self.x[:11], self.y[:11], axis=0)
+        second = Covariance.of(self.x[11:], self.y[11:], axis=0)
+
+        self.assert_covariance(first.merge(second))
+        self.assert_covariance(Covariance.of(self.x, self.y, axis=0))
+
+    def test_no_variance(self):
+        covariance = Covariance.of(np.ones(5), np.arange(5.0))
+
+        self.assertIs(np.ma.masked, covariance.correlation()[()])
+
+
+class TestLinearTrend(unittest.TestCase):
+    def test_polyfit(self):
+        random = np.random.RandomState(3)
+        times = np.arange(40.0) * 86400
+        values = masked_values(random, (40,)) + times * 1e-5
+
+        first = LinearTrend.of(times[:15], values[:15])
+        trend = first.merge(LinearTrend.of(times[15:], values[15:]))
+
+        fitted = valid(values)
+        slope, intercept = np.polyfit(times[~fitted.mask], fitted.compressed(), 1)
+        self.assertAlmostEquals(slope, trend.slope()[()], places=12)
+        self.assertAlmostEquals(intercept, trend.intercept()[()], places=6)
+
+
+if __name__ == '__main__':
+    unittest.main()
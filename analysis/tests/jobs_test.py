@@ -0,0 +1,98 @@
+"""
+Copyright (c) 2016 Jet Propulsion Laboratory,
+California Institute of Technology.  All rights reserved
+"""
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+
+from webservice.jobs import Job, JobManager
+from webservice.webmodel import NexusProcessingException
+
+
+class InlineExecutor(object):
+    def submit(self, fn, *args):
+        fn(*args)
+        return True
+
+
+class Executors(object):
+    def get(self, path):
+        return InlineExecutor()
+
+
+class Handler(object):
+    def __init__(self, results):
+        self.results = results
+
+    def calc(self, request):
+        if isinstance(self.results, Exception):
+            raise self.results
+        return self.results
+
+
+class Wrapper(object):
+    def __init__(self, results):
+        self.results = results
+
+    def path(self):
+        return '/test'
+
+    def instance(self, algorithm_config):
+        return Handler(self.results)
+
+
+class TestJobManager(unittest.TestCase):
+    def setUp(self):
+        self.result_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.result_dir)
+
+    def test_in_memory(self):
+        jobs = JobManager(Executors())
+        job = jobs.submit(Wrapper({'mean': 1.0}), None, None)
+
+        self.assertEquals(Job.SUCCEEDED, jobs.get(job.id).status)
+        self.assertEquals({'mean': 1.0}, jobs.get_results(job.id))
+
+    def test_failed(self):
+        jobs = JobManager(Executors())
+        job = jobs.submit(Wrapper(NexusProcessingException(reason="Bad box", code=400)), None, None)
+
+        self.assertEquals(Job.FAILED, jobs.get(job.id).status)
+        self.assertEquals(400, jobs.get(job.id).code)
+        self.assertIsNone(jobs.get_results(job.id))
+
+    def test_saved(self):
+        job = JobManager(Executors(), result_dir=self.result_dir).submit(Wrapper({'mean': 1.0}), None, None)
+
+        jobs = JobManager(Executors(), result_dir=self.result_dir)
+        self.assertEquals(Job.SUCCEEDED, jobs.get(job.id).status)
+        # The status of a saved job is read without its results
+        self.assertIsNone(jobs._jobs[job.id][1])
+        self.assertEquals({'mean': 1.0}, jobs.get_results(job.id))
+
+    def test_results_that_can_not_be_saved(self):
+        lock = threading.Lock()
+        jobs = JobManager(Executors(), result_dir=self.result_dir)
+        job = jobs.submit(Wrapper(lock), None, None)
+
+        self.assertIs(lock, jobs.get_results(job.id))
+        self.assertEquals([], os.listdir(self.result_dir))
+
+    def test_expired(self):
+        jobs = JobManager(Executors(), result_dir=self.result_dir, ttl_seconds=-1)
+        job = jobs.submit(Wrapper({'mean': 1.0}), None, None)
+
+        self.assertIsNone(jobs.get(job.id))
+        self.assertEquals({}, jobs._jobs)
+
+        jobs.remove_expired()
+        self.assertEquals([], os.listdir(self.result_dir))
+
+
+if __name__ == '__main__':
+    unittest.main()
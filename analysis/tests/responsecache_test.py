@@ -0,0 +1,110 @@
+"""
+Copyright (c) 2016 Jet Propulsion Laboratory,
+California Institute of Technology.  All rights reserved
+"""
+import shutil
+import tempfile
+import time
+import unittest
+
+from webservice.responsecache import ResponseCache, cache_key
+
+
+class FakeTileService(object):
+    def __init__(self, query_cache_ttl=300):
+        self.query_cache_ttl = query_cache_ttl
+        self.insert_times = {'MUR': '2016-01-01T00:00:00Z', 'SMAP': '2016-01-01T00:00:00Z'}
+        self.invalidated = []
+
+    def get_last_insert_times(self):
+        return dict(self.insert_times)
+
+    def get_query_cache_ttl(self):
+        return self.query_cache_ttl
+
+    def invalidate_query_caches(self, dataset):
+        self.invalidated.append(dataset)
+
+
+class TestResponseCache(unittest.TestCase):
+    def setUp(self):
+        self.tile_service = FakeTileService()
+        self.disk_dir = tempfile.mkdtemp()
+        self.cache = ResponseCache(self.tile_service, 1024, disk_dir=self.disk_dir, disk_bytes=4096, check_seconds=0)
+        self.arguments = {'ds': ['MUR'], 'minLat': ['0']}
+        self.key = cache_key('/stats', self.arguments, 'JSON')
+
+    def tearDown(self):
+        shutil.rmtree(self.disk_dir)
+
+    def ingest(self, dataset):
+        self.tile_service.insert_times[dataset] = '2016-01-02T00:00:00Z'
+
+    def test_cache_key(self):
+        self.assertEquals(self.key, cache_key('/stats', {'minLat': [' 0'], 'ds': ['MUR'], '_': ['1']}, 'json'))
+        self.assertNotEqual(self.key, cache_key('/stats', self.arguments, 'CSV'))
+
+    def test_hit(self):
+        insert_times = self.cache.insert_times(self.arguments)
+        self.cache.put(self.key, 'application/json', '{}', insert_times)
+
+        self.assertEquals({'MUR': '2016-01-01T00:00:00Z'}, insert_times)
+        self.assertEquals('{}', self.cache.get(self.key, self.cache.insert_times(self.arguments)).body)
+
+    def test_invalidated_by_ingest(self):
+        self.cache.put(self.key, 'application/json', '{}', self.cache.insert_times(self.arguments))
+
+        self.ingest('MUR')
+
+        self.assertIsNone(self.cache.get(self.key, self.cache.insert_times(self.arguments)))
+        self.assertIsNone(self.cache._disk.get(self.key))
+        # The cached searches of the dataset are cleared so the response is calculated from the new tiles
+        self.assertEquals(['MUR'], self.tile_service.invalidated)
+
+    def test_other_dataset_ingested(self):
+        self.cache.put(self.key, 'application/json', '{}', self.cache.insert_times(self.arguments))
+
+        self.ingest('SMAP')
+
+        self.assertEquals('{}', self.cache.get(self.key, self.cache.insert_times(self.arguments)).body)
+        self.assertEquals(['SMAP'], self.tile_service.invalidated)
+
+    def test_expires_within_query_cache_ttl(self):
+        self.cache.insert_times(self.arguments)
+        self.ingest('MUR')
+        insert_times = self.cache.insert_times(self.arguments)
+
+        # Calculated while other processes may still use searches cached before the ingest
+        started = time.time()
+        self.cache.put(self.key, 'application/json', '{}', insert_times, started=started)
+        response = self.cache.get(self.key, insert_times)
+        self.assertAlmostEquals(started + 300, response.expires, delta=5)
+
+        # Calculated after the cached searches expired
+        self.cache.put(self.key, 'application/json', '{}', insert_times, started=started + 301)
+        self.assertIsNone(self.cache.get(self.key, insert_times).expires)
+
+    def test_expired(self):
+        self.tile_service.query_cache_ttl = 0.01
+        self.cache.insert_times(self.arguments)
+        self.ingest('MUR')
+        insert_times = self.cache.insert_times(self.arguments)
+        self.cache.put(self.key, 'application/json', '{}', insert_times)
+
+        time.sleep(0.02)
+
+        self.assertIsNone(self.cache.get(self.key, insert_times))
+
+    def test_no_query_cache_ttl(self):
+        self.tile_service.query_cache_ttl = None
+        self.cache.insert_times(self.arguments)
+        self.ingest('MUR')
+        insert_times = self.cache.insert_times(self.arguments)
+
+        self.cache.put(self.key, 'application/json', '{}', insert_times)
+
+        self.assertIsNone(self.cache.get(self.key, insert_times).expires)
+
+
+if __name__ == '__main__':
+    unittest.main()
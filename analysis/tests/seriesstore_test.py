@@ -0,0 +1,138 @@
+"""
+Copyright (c) 2016 Jet Propulsion Laboratory,
+California Institute of Technology.  All rights reserved
+"""
+import ConfigParser
+import os
+import shutil
+import tempfile
+import unittest
+
+import numpy as np
+
+from webservice.seriesstore import SeriesStore, get_series_store, region_key
+
+DAY = 86400
+
+
+class FakeSeries(object):
+    """
+    calc_days and find_reingested_days of a dataset whose value on each day is values[day]
+    """
+
+    def __init__(self):
+        self.values = {}
+        self.reingested = set()
+        self.calls = []
+
+    def set_days(self, days, offset=0.0):
+        for i, day in enumerate(days):
+            # Every fourth day has no data in the region
+            self.values[day] = None if i % 4 == 3 else 280.0 + i + offset
+
+    def calc_days(self, days):
+        self.calls.append(list(days))
+        stats = []
+        for day in days:
+            value = self.values[day]
+            if value is None:
+                stats.append({'time': day, 'min': np.ma.masked, 'max': np.ma.masked, 'mean': 0.0,
+                              'std': np.ma.masked, 'cnt': 0})
+            else:
+                stats.append({'time': day, 'min': value - 1, 'max': value + 1, 'mean': value, 'std': 0.5,
+                              'cnt': 100})
+        return stats
+
+    def find_reingested_days(self, inserted_after):
+        return set(self.reingested)
+
+
+class TestSeriesStore(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.store = SeriesStore(self.directory)
+        self.series = FakeSeries()
+        self.key = region_key('MUR', 0, 10, 0, 10)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def daily_stats(self, days):
+        return self.store.daily_stats(self.key, days, self.series.calc_days, self.series.find_reingested_days)
+
+    def test_first_request_stores_every_day(self):
+        days = [DAY * i for i in xrange(1, 11)]
+        self.series.set_days(days)
+
+        stats = self.daily_stats(days)
+
+        self.assertEquals([days], self.series.calls)
+        self.assertEquals(days, [stat['time'] for stat in stats])
+        self.assertEquals(sorted(days), sorted(self.store.load(self.key)[0].keys()))
+
+    def test_only_new_and_reingested_days(self):
+        days = [DAY * i for i in xrange(1, 11)]
+        self.series.set_days(days)
+        self.daily_stats(days[:8])
+
+        self.series.reingested = {days[2], days[3]}
+        self.series.calls = []
+        self.daily_stats(days)
+
+        # The re-ingested days and the new days, each run of consecutive days in one call
+        self.assertEquals([days[2:4], days[8:10]], self.series.calls)
+
+    def test_days_without_data(self):
+        days = [DAY * i for i in xrange(1, 5)]
+        self.series.set_days(days)
+        self.daily_stats(days)
+
+        stats = SeriesStore(self.directory).daily_stats(self.key, days, self.series.calc_days,
+                                                        self.series.find_reingested_days)
+
+        self.assertEquals(1, len(self.series.calls))
+        for name in ('min', 'max', 'std'):
+            self.assertIs(np.ma.masked, stats[3][name])
+        self.assertEquals(0, stats[3]['cnt'])
+        self.assertEquals(281.0, stats[1]['mean'])
+
+    def test_matches_full_recompute(self):
+        days = [DAY * i for i in xrange(1, 21)]
+        self.series.set_days(days)
+        self.daily_stats(days[:12])
+
+        # Days 4 to 6 change when they are ingested again
+        for day in days[4:7]:
+            self.series.values[day] += 0.25
+        self.series.reingested = set(days[4:7])
+        merged = self.daily_stats(days[3:18])
+
+        self.assertEquals(self.series.calc_days(days[3:18]), merged)
+
+    def test_corrupt_file(self):
+        days = [DAY * i for i in xrange(1, 5)]
+        self.series.set_days(days)
+        with open(os.path.join(self.directory, '%s.npz' % self.key), 'wb') as store_file:
+            store_file.write('not a store')
+
+        stats = self.daily_stats(days)
+
+        self.assertEquals([days], self.series.calls)
+        self.assertEquals(days, [stat['time'] for stat in stats])
+        self.assertIsNotNone(self.store.load(self.key))
+
+    def test_region_key(self):
+        self.assertEquals(self.key, region_key(' MUR', 0.0, 10.0000000001, 0, 10))
+        self.assertNotEqual(self.key, region_key('MUR', 0, 10, 0, 11))
+
+    def test_get_series_store(self):
+        config = ConfigParser.RawConfigParser()
+        self.assertIsNone(get_series_store(config))
+
+        config.add_section('seriesstore')
+        config.set('seriesstore', 'directory', self.directory)
+        self.assertIs(get_series_store(config), get_series_store(config))
+
+
+if __name__ == '__main__':
+    unittest.main()
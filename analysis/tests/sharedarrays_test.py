@@ -0,0 +1,125 @@
+"""
+Copyright (c) 2016 Jet Propulsion Laboratory,
+California Institute of Technology.  All rights reserved
+"""
+import logging
+import os
+import unittest
+
+import numpy as np
+
+import webservice.sharedarrays as sharedarrays
+from webservice.sharedarrays import SharedArena, detach_arenas, get_array, get_masked_array, open_arenas, \
+    remove_stale_arenas
+
+
+class LogRecords(logging.Handler):
+    def __init__(self):
+        logging.Handler.__init__(self)
+        self.messages = []
+
+    def emit(self, record):
+        self.messages.append(record.getMessage())
+
+
+class TestSharedArena(unittest.TestCase):
+    def setUp(self):
+        self.records = LogRecords()
+        logging.getLogger('nexus').addHandler(self.records)
+
+    def tearDown(self):
+        logging.getLogger('nexus').removeHandler(self.records)
+        detach_arenas()
+
+    def test_put_and_get(self):
+        data = np.ma.array(np.arange(12.0).reshape((3, 4)), mask=np.arange(12).reshape((3, 4)) % 5 == 0)
+
+        with SharedArena(1024) as arena:
+            handle = arena.put_masked(data)
+            shared = get_masked_array(handle)
+
+            self.assertEquals(data.tolist(), shared.tolist())
+            self.assertEquals(0, handle.data.offset % sharedarrays.ALIGNMENT)
+            self.assertEquals(0, handle.mask.offset % sharedarrays.ALIGNMENT)
+
+    def test_full(self):
+        with SharedArena(16) as arena:
+            with self.assertRaises(ValueError):
+                arena.put(np.arange(4.0))
+
+    def test_close(self):
+        arena = SharedArena(1024)
+        self.assertIn(arena.name, open_arenas())
+
+        arena.close()
+        arena.close()
+
+        self.assertNotIn(arena.name, open_arenas())
+        self.assertFalse(os.path.exists(arena.name))
+        self.assertEquals([], self.records.messages)
+
+    def test_collected_without_close(self):
+        arena = SharedArena(1024)
+        name = arena.name
+
+        del arena
+
+        self.assertFalse(os.path.exists(name))
+        self.assertNotIn(name, open_arenas())
+        self.assertEquals(1, len(self.records.messages))
+        self.assertIn("collected without being closed", self.records.messages[0])
+
+    def test_open_at_exit(self):
+        arena = SharedArena(1024)
+
+        sharedarrays._close_open_arenas()
+
+        self.assertFalse(os.path.exists(arena.name))
+        self.assertIn("was never closed", self.records.messages[0])
+
+    def test_detach_closed_arenas(self):
+        with SharedArena(1024) as first:
+            get_array(first.put(np.arange(4.0)))
+        self.assertIn(first.name, sharedarrays._attached)
+
+        # Attaching to another arena drops the mapping of the closed one
+        with SharedArena(1024) as second:
+            get_array(second.put(np.arange(4.0)))
+
+            self.assertEquals([second.name], sharedarrays._attached.keys())
+
+            detach_arenas()
+            self.assertEquals([], sharedarrays._attached.keys())
+
+
+class TestRemoveStaleArenas(unittest.TestCase):
+    def setUp(self):
+        # The pid of a process that no longer exists
+        pid = os.fork()
+        if pid == 0:
+            os._exit(0)
+        os.waitpid(pid, 0)
+
+        self.stale = os.path.join(sharedarrays.ARENA_DIR, '%s%d-test' % (sharedarrays.ARENA_PREFIX, pid))
+        open(self.stale, 'wb').close()
+
+        self.records = LogRecords()
+        logging.getLogger('nexus').addHandler(self.records)
+
+    def tearDown(self):
+        logging.getLogger('nexus').removeHandler(self.records)
+        if os.path.exists(self.stale):
+            os.remove(self.stale)
+
+    def test_removes_arenas_of_exited_processes(self):
+        with SharedArena(1024) as arena:
+            removed = remove_stale_arenas()
+
+            self.assertIn(self.stale, removed)
+            self.assertFalse(os.path.exists(self.stale))
+            self.assertTrue(os.path.exists(arena.name))
+            self.assertIn("Removing arena %s" % self.stale, self.records.messages[0])
+
+
+if __name__ == '__main__':
+    unittest.main()
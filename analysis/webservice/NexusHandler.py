@@ -6,7 +6,7 @@ import logging
 import types
 from datetime import datetime
 import time
-from nexustiles.nexustiles import NexusTileService
+from nexustiles.nexustiles import get_tile_service
 
 AVAILABLE_HANDLERS = []
 AVAILABLE_INITIALIZERS = []
@@ -146,6 +146,9 @@ class AlgorithmModuleWrapper:
     def params(self):
         return self.__clazz.params
 
+    def cacheable(self):
+        return getattr(self.__clazz, "cacheable", False) is True
+
     def instance(self, algorithm_config):
         if "singleton" in self.__clazz.__dict__ and self.__clazz.__dict__["singleton"] is True:
             if self.__instance is None:
@@ -181,7 +184,7 @@ class NexusHandler(CalcHandler):
         CalcHandler.__init__(self)
 
         self.algorithm_config = None
-        self._tile_service = NexusTileService(skipCassandra, skipSolr)
+        self._tile_service = get_tile_service(skipCassandra, skipSolr)
 
     def set_config(self, algorithm_config):
         self.algorithm_config = algorithm_config
@@ -0,0 +1,216 @@
+"""
+Copyright (c) 2016 Jet Propulsion Laboratory,
+California Institute of Technology.  All rights reserved
+"""
+import numpy as np
+
+
+def _valid_data(values):
+    """
+    The data of values as float64 and where it is valid, that is neither masked nor NaN.
+    """
+    data = np.asarray(np.ma.getdata(values), dtype=np.float64)
+    return data, ~np.ma.getmaskarray(values) & ~np.isnan(data)
+
+
+def _reduce_mean(data, valid, axis):
+    """
+    Mean of the valid data along axis, with keepdims so it broadcasts against data, and 0 where nothing is valid.
+    """
+    count = np.maximum(np.sum(valid, axis=axis, keepdims=True), 1)
+    return np.sum(np.where(valid, data, 0.0), axis=axis, keepdims=True) / count
+
+
+def _weight(count, other_count):
+    """
+    Share of other_count in count + other_count, 0 where both are 0.
+    """
+    merged = (count + other_count).astype(np.float64)
+    return np.where(merged > 0, other_count / np.maximum(merged, 1.0), 0.0)
+
+
+class Moments(object):
+    """
+    Element-wise count, mean, sum of squared deviations from the mean (M2), min and max of the values added to it, held
+    in arrays of shape.
+
+    Values are added with update, one value per element (Welford's update), or as Moments of many values made with of
+    or of_groups and merged with merge (the pairwise formulas of Chan et al.). Merging is exact whatever the order, so
+    Moments computed by threads, worker processes or Spark partitions over parts of the data can be combined into the
+    Moments of all of it. Moments are picklable.
+
+    Elements nothing was added to have a count of 0 and are masked in the results.
+    """
+
+    def __init__(self, shape=()):
+        self.count = np.zeros(shape, dtype=np.int64)
+        self.mean = np.zeros(shape)
+        self.m2 = np.zeros(shape)
+        self.min = np.full(shape, np.inf)
+        self.max = np.full(shape, -np.inf)
+
+    @classmethod
+    def of(cls, values, axis=None):
+        """
+        Moments of the valid values, neither masked nor NaN, reduced along axis, or over all of values if axis is
+        None.
+        """
+        data, valid = _valid_data(values)
+        count = np.sum(valid, axis=axis)
+        mean = _reduce_mean(data, valid, axis)
+
+        moments = cls(np.shape(count))
+        moments.count[...] = count
+        moments.mean[...] = mean.reshape(np.shape(count))
+        moments.m2[...] = np.sum(np.where(valid, data - mean, 0.0) ** 2, axis=axis)
+        moments.min[...] = np.min(np.where(valid, data, np.inf), axis=axis)
+        moments.max[...] = np.max(np.where(valid, data, -np.inf), axis=axis)
+        return moments
+
+    @classmethod
+    def of_groups(cls, values, groups, size):
+        """
+        Moments of shape (size,) of the valid values of the 1-d values grouped by groups, the index in the result of
+        each value.
+        """
+        data, valid = _valid_data(values)
+        data = data[valid]
+        groups = np.asarray(groups)[valid]
+
+        moments = cls((size,))
+        moments.count[:] = np.bincount(groups, minlength=size)
+        moments.mean[:] = np.bincount(groups, weights=data, minlength=size) / np.maximum(moments.count, 1)
+        moments.m2[:] = np.bincount(groups, weights=(data - moments.mean[groups]) ** 2, minlength=size)
+        np.minimum.at(moments.min, groups, data)
+        np.maximum.at(moments.max, groups, data)
+        return moments
+
+    def update(self, values):
+        """
+        Add values, an array of the shape of these Moments, one value to each element. Masked and NaN values are
+        skipped.
+        """
+        return self.merge(self.of(np.ma.expand_dims(values, 0), axis=0))
+
+    def merge(self, other, index=Ellipsis):
+        """
+        Merge other into these Moments, or into the elements at index of them. other is broadcast against those
+        elements, so scalar Moments can be merged into a range of elements.
+
+        :return: These Moments
+        """
+        weight = _weight(self.count[index], other.count)
+        delta = other.mean - self.mean[index]
+
+        self.m2[index] += other.m2 + delta ** 2 * self.count[index] * weight
+        self.mean[index] += delta * weight
+        self.count[index] += other.count
+        self.min[index] = np.minimum(self.min[index], other.min)
+        self.max[index] = np.maximum(self.max[index], other.max)
+        return self
+
+    def masked_mean(self):
+        return np.ma.array(self.mean, mask=self.count == 0)
+
+    def masked_min(self):
+        return np.ma.array(self.min, mask=self.count == 0)
+
+    def masked_max(self):
+        return np.ma.array(self.max, mask=self.count == 0)
+
+    def variance(self, ddof=0):
+        with np.errstate(divide='ignore', invalid='ignore'):
+            return np.ma.array(self.m2 / (self.count - ddof), mask=self.count <= ddof)
+
+    def std(self, ddof=0):
+        return np.ma.sqrt(self.variance(ddof))
+
+
+class Covariance(object):
+    """
+    Element-wise count, means, sums of squared deviations and sum of co-deviations of pairs of values x and y added
+    to it, held in arrays of shape. Only pairs where both values are valid are added. Covariance merges the same way as
+    Moments.
+    """
+
+    def __init__(self, shape=()):
+        self.count = np.zeros(shape, dtype=np.int64)
+        self.mean_x = np.zeros(shape)
+        self.mean_y = np.zeros(shape)
+        self.m2_x = np.zeros(shape)
+        self.m2_y = np.zeros(shape)
+        self.c_xy = np.zeros(shape)
+
+    @classmethod
+    def of(cls, x, y, axis=None):
+        """
+        Covariance of the pairs of valid x and y reduced along axis, or over all of them if axis is None.
+        """
+        data_x, valid_x = _valid_data(x)
+        data_y, valid_y = _valid_data(y)
+        valid = valid_x & valid_y
+        count = np.sum(valid, axis=axis)
+        mean_x = _reduce_mean(data_x, valid, axis)
+        mean_y = _reduce_mean(data_y, valid, axis)
+        deviation_x = np.where(valid, data_x - mean_x, 0.0)
+        deviation_y = np.where(valid, data_y - mean_y, 0.0)
+
+        covariance = cls(np.shape(count))
+        covariance.count[...] = count
+        covariance.mean_x[...] = mean_x.reshape(np.shape(count))
+        covariance.mean_y[...] = mean_y.reshape(np.shape(count))
+        covariance.m2_x[...] = np.sum(deviation_x ** 2, axis=axis)
+        covariance.m2_y[...] = np.sum(deviation_y ** 2, axis=axis)
+        covariance.c_xy[...] = np.sum(deviation_x * deviation_y, axis=axis)
+        return covariance
+
+    def update(self, x, y):
+        """
+        Add the pairs of x and y, arrays of the shape of this Covariance, one pair to each element.
+        """
+        return self.merge(self.of(np.ma.expand_dims(x, 0), np.ma.expand_dims(y, 0), axis=0))
+
+    def merge(self, other, index=Ellipsis):
+        """
+        Merge other into this Covariance, or into the elements at index of it.
+
+        :return: This Covariance
+        """
+        weight = _weight(self.count[index], other.count)
+        delta_x = other.mean_x - self.mean_x[index]
+        delta_y = other.mean_y - self.mean_y[index]
+        pair_weight = self.count[index] * weight
+
+        self.m2_x[index] += other.m2_x + delta_x ** 2 * pair_weight
+        self.m2_y[index] += other.m2_y + delta_y ** 2 * pair_weight
+        self.c_xy[index] += other.c_xy + delta_x * delta_y * pair_weight
+        self.mean_x[index] += delta_x * weight
+        self.mean_y[index] += delta_y * weight
+        self.count[index] += other.count
+        return self
+
+    def covariance(self, ddof=0):
+        with np.errstate(divide='ignore', invalid='ignore'):
+            return np.ma.array(self.c_xy / (self.count - ddof), mask=self.count <= ddof)
+
+    def correlation(self):
+        """
+        Pearson correlation coefficient of x and y, masked where either has no variance.
+        """
+        denominator = np.sqrt(self.m2_x * self.m2_y)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            return np.ma.array(self.c_xy / denominator, mask=denominator == 0)
+
+
+class LinearTrend(Covariance):
+    """
+    Element-wise least squares line of y against x, such as a value against time, from the same merged sums as
+    Covariance.
+    """
+
+    def slope(self):
+        with np.errstate(divide='ignore', invalid='ignore'):
+            return np.ma.array(self.c_xy / self.m2_x, mask=self.m2_x == 0)
+
+    def intercept(self):
+        return self.mean_y - self.slope() * self.mean_x
@@ -2,13 +2,12 @@
 Copyright (c) 2016 Jet Propulsion Laboratory,
 California Institute of Technology.  All rights reserved
 """
-import math
 import numpy as np
 from scipy.stats import linregress
 from itertools import groupby
 from webservice.NexusHandler import NexusHandler, nexus_handler, DEFAULT_PARAMETERS_SPEC
 from webservice.webmodel import NexusProcessingException
-from nexustiles.model.nexusmodel import get_approximate_value_for_lat_lon
+from nexustiles.model.nexusmodel import get_approximate_values_for_lat_lons
 
 @nexus_handler
 class LongitudeLatitudeMapHandlerImpl(NexusHandler):
@@ -60,24 +59,24 @@ class LongitudeLatitudeMapHandlerImpl(NexusHandler):
                         'lon': float(lon)
                     } for lon in xrange(minLon, maxLon, resolution)] for lat in xrange(minLat, maxLat, resolution)]
 
-        for stats in results:
-            for stat in stats:
-                values_x = []
-                values_y = []
-                for tile_matches in matches:
-
-                    tile_1_list = tile_matches[0]
-                    value_1 = get_approximate_value_for_lat_lon(tile_1_list, stat["lat"], stat["lon"])
-
-                    tile_2_list = tile_matches[1]
-                    value_2 = get_approximate_value_for_lat_lon(tile_2_list, stat["lat"], stat["lon"])
-
-                    if not (math.isnan(value_1) or math.isnan(value_2)):
-                        values_x.append(value_1)
-                        values_y.append(value_2)
-
-                if len(values_x) > 2 and len(values_y) > 2:
-                    stat["slope"], stat["intercept"], stat["r"], stat["p"], stat["stderr"] = linregress(values_x, values_y)
+        cells = [stat for stats in results for stat in stats]
+        lats = np.array([stat["lat"] for stat in cells])
+        lons = np.array([stat["lon"] for stat in cells])
+
+        # One row per matched time step, one column per cell
+        values_x = np.empty((len(matches), len(cells)))
+        values_y = np.empty((len(matches), len(cells)))
+        valid = np.empty((len(matches), len(cells)), dtype=bool)
+        for row, tile_matches in enumerate(matches):
+            values_x[row], valid_1 = get_approximate_values_for_lat_lons(tile_matches[0], lats, lons)
+            values_y[row], valid_2 = get_approximate_values_for_lat_lons(tile_matches[1], lats, lons)
+            valid[row] = valid_1 & valid_2
+
+        for column, stat in enumerate(cells):
+            cell_valid = valid[:, column]
+            if np.count_nonzero(cell_valid) > 2:
+                stat["slope"], stat["intercept"], stat["r"], stat["p"], stat["stderr"] = linregress(
+                    values_x[cell_valid, column], values_y[cell_valid, column])
 
         return results, None, None
 
@@ -3,18 +3,15 @@ Copyright (c) 2016 Jet Propulsion Laboratory,
 California Institute of Technology.  All rights reserved
 """
 import sys
-import traceback
 from datetime import datetime, timedelta
-from multiprocessing import Pool, Manager
 
 import numpy as np
 import pytz
-from nexustiles.nexustiles import NexusTileService
+from nexustiles.nexustiles import get_tile_service
 
 from webservice.NexusHandler import NexusHandler, nexus_handler
 from webservice.webmodel import NexusResults, NexusProcessingException
-
-SENTINEL = 'STOP'
+from webservice.workerpool import get_worker_pool, WorkerError
 
 
 @nexus_handler
@@ -132,47 +129,27 @@ class DailyDifferenceAverageImpl(NexusHandler):
         daysinrange = self._tile_service.find_days_in_range_asc(min_lat, max_lat, min_lon, max_lon, dataset1,
                                                                 start_time, end_time)
 
-        maxprocesses = int(self.algorithm_config.get("multiprocessing", "maxprocesses"))
-
-        if maxprocesses == 1:
+        pool = get_worker_pool()
+        if pool is None:
             calculator = DailyDifferenceAverageCalculator()
-            averagebyday = []
-            for dayinseconds in daysinrange:
-                result = calculator.calc_average_diff_on_day(min_lat, max_lat, min_lon, max_lon, dataset1, dataset2, dayinseconds)
-                averagebyday.append((result[0], result[1]))
+            averagebyday = [calculator.calc_average_diff_on_day(min_lat, max_lat, min_lon, max_lon, dataset1, dataset2,
+                                                                dayinseconds) for dayinseconds in daysinrange]
         else:
-            # Create a task to calc average difference for each day
-            manager = Manager()
-            work_queue = manager.Queue()
-            done_queue = manager.Queue()
-            for dayinseconds in daysinrange:
-                work_queue.put(('calc_average_diff_on_day', min_lat, max_lat, min_lon, max_lon, dataset1, dataset2, dayinseconds))
-            [work_queue.put(SENTINEL) for _ in xrange(0, maxprocesses)]
-
-            # Start new processes to handle the work
-            pool = Pool(maxprocesses)
-            [pool.apply_async(pool_worker, (work_queue, done_queue)) for _ in xrange(0, maxprocesses)]
-            pool.close()
-
-            # Collect the results as [(day (in ms), average difference for that day)]
-            averagebyday = []
-            for i in xrange(0, len(daysinrange)):
-                result = done_queue.get()
-                if result[0] == 'error':
-                    print >> sys.stderr, result[1]
-                    raise NexusProcessingException(reason="Error calculating average by day.")
-                rdata = result
-                averagebyday.append((rdata[0], rdata[1]))
-
-            pool.terminate()
-            manager.shutdown()
+            # Calculate the average difference of each day on the worker pool, as [(day (in s), average difference)]
+            tasks = [(min_lat, max_lat, min_lon, max_lon, dataset1, dataset2, dayinseconds) for dayinseconds in
+                     daysinrange]
+            try:
+                averagebyday = pool.map(calc_average_diff_on_day, tasks, unit='days')
+            except WorkerError as e:
+                print >> sys.stderr, str(e)
+                raise NexusProcessingException(reason="Error calculating average by day.")
 
         return averagebyday
 
 
 class DailyDifferenceAverageCalculator(object):
     def __init__(self):
-        self.__tile_service = NexusTileService()
+        self.__tile_service = get_tile_service()
 
     def calc_average_diff_on_day(self, min_lat, max_lat, min_lon, max_lon, dataset1, dataset2, timeinseconds):
 
@@ -214,15 +191,6 @@ class DailyDifferenceAverageCalculator(object):
         return int(timeinseconds), diffaverage
 
 
-def pool_worker(work_queue, done_queue):
-    try:
-        calculator = DailyDifferenceAverageCalculator()
-
-        for work in iter(work_queue.get, SENTINEL):
-            scifunction = work[0]
-            args = work[1:]
-            result = calculator.__getattribute__(scifunction)(*args)
-            done_queue.put(result)
-    except Exception as e:
-        e_str = traceback.format_exc(e)
-        done_queue.put(('error', e_str))
+def calc_average_diff_on_day(min_lat, max_lat, min_lon, max_lon, dataset1, dataset2, timeinseconds):
+    return DailyDifferenceAverageCalculator().calc_average_diff_on_day(min_lat, max_lat, min_lon, max_lon, dataset1,
+                                                                       dataset2, timeinseconds)
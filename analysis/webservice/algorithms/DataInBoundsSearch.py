@@ -3,12 +3,20 @@ Copyright (c) 2016 Jet Propulsion Laboratory,
 California Institute of Technology.  All rights reserved
 """
 # distutils: include_dirs = /usr/local/lib/python2.7/site-packages/cassandra
+import itertools
+
 import pyximport
 
 pyximport.install()
 
+from nexustiles.model.nexusmodel import get_nexus_points
 from webservice.NexusHandler import NexusHandler, nexus_handler, DEFAULT_PARAMETERS_SPEC
-from webservice.webmodel import NexusResults
+from webservice.webmodel import StreamingResults
+
+
+def csv_row(record):
+    return [record['latitude'], record['longitude'], record['time'], record['data'][0]['id'],
+            record['data'][0]['value']]
 
 
 @nexus_handler
@@ -32,34 +40,47 @@ class DataInBoundsSearchHandlerImpl(NexusHandler):
         end_time = compute_options.get_end_time()
         includemeta = compute_options.get_include_meta()
 
-        tiles = self._tile_service.get_tiles_bounded_by_box(min_lat, max_lat, min_lon, max_lon, ds, start_time,
-                                                            end_time)
-
-        data = []
-        for tile in tiles:
-            for nexus_point in tile.nexus_point_generator():
-                data.append({
-                    'latitude': nexus_point.latitude,
-                    'longitude': nexus_point.longitude,
-                    'time': nexus_point.time,
-                    'data': [
-                        {
-                            'id': tile.tile_id,
-                            'value': nexus_point.data_val
-                        }
-                    ]
-                })
-
-        if includemeta and len(tiles) > 0:
-            meta = [tile.get_summary() for tile in tiles]
-        else:
-            meta = None
-
-        result = NexusResults(
-            results=data,
+        meta = {}
+        result = StreamingResults(
+            self._records(min_lat, max_lat, min_lon, max_lon, ds, start_time, end_time, meta if includemeta else None),
+            csv_fields=['latitude', 'longitude', 'time', 'id', 'value'],
+            csv_row=csv_row,
             stats={},
             meta=meta)
 
         result.extendMeta(min_lat, max_lat, min_lon, max_lon, "", start_time, end_time)
 
         return result
+
+    def _records(self, min_lat, max_lat, min_lon, max_lon, ds, start_time, end_time, meta):
+        """
+        Generator of the points of the tiles in the box, one batch of tiles at a time. If meta is given, it is updated
+        with the summary of the first tile.
+        """
+        summarized = meta is None
+        for tiles in self._tile_service.get_tile_batches_bounded_by_box_generator(min_lat, max_lat, min_lon, max_lon,
+                                                                                  ds, start_time, end_time, crop=True):
+            points, tile_positions = get_nexus_points(tiles)
+            tile_ids = [tile.tile_id for tile in tiles]
+
+            for latitude, longitude, time, data_val, tile_position in itertools.izip(
+                    points.latitude.tolist(), points.longitude.tolist(), points.time.tolist(),
+                    points.data_val.tolist(), tile_positions.tolist()):
+                yield {
+                    'latitude': latitude,
+                    'longitude': longitude,
+                    'time': time,
+                    'data': [
+                        {
+                            'id': tile_ids[tile_position],
+                            'value': data_val
+                        }
+                    ]
+                }
+
+            if not summarized and len(tiles) > 0:
+                # get_summary replaces the arrays of the tile with their shapes, so it is read after the points
+                summary = tiles[0].get_summary()
+                summary.update(meta)
+                meta.update(summary)
+                summarized = True
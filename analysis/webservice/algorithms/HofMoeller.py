@@ -2,7 +2,7 @@
 Copyright (c) 2016 Jet Propulsion Laboratory,
 California Institute of Technology.  All rights reserved
 """
-import itertools
+import logging
 from cStringIO import StringIO
 from datetime import datetime
 from multiprocessing.pool import ThreadPool
@@ -13,59 +13,63 @@ import numpy as np
 from matplotlib import cm
 from matplotlib.ticker import FuncFormatter
 
+from webservice.accumulators import Moments
 from webservice.NexusHandler import NexusHandler, nexus_handler, DEFAULT_PARAMETERS_SPEC
+from webservice.sharedarrays import SharedArena, detach_arenas, get_tile, tile_nbytes
 from webservice.webmodel import NexusProcessingException, NexusResults
+from webservice.workerpool import get_worker_pool, WorkerError
 
 
 def longitude_time_hofmoeller_stats(tile, index):
-    stat = {
+    points = tile.nexus_points()
+
+    return {
         'sequence': index,
         'time': np.ma.min(tile.times),
-        'lons': []
+        'lons': coordinate_stats(np.ma.getdata(points.longitude), np.ma.getdata(points.data_val), 'longitude')
     }
 
-    points = list(tile.nexus_point_generator())
-    data = sorted(points, key=lambda p: p.longitude)
-    points_by_lon = itertools.groupby(data, key=lambda p: p.longitude)
-
-    for lon, points_at_lon in points_by_lon:
-        values_at_lon = np.array([point.data_val for point in points_at_lon])
-        stat['lons'].append({
-            'longitude': float(lon),
-            'cnt': len(values_at_lon),
-            'avg': np.mean(values_at_lon).item(),
-            'max': np.max(values_at_lon).item(),
-            'min': np.min(values_at_lon).item(),
-            'std': np.std(values_at_lon).item()
-        })
-
-    return stat
-
 
 def latitude_time_hofmoeller_stats(tile, index):
-    stat = {
+    points = tile.nexus_points()
+
+    return {
         'sequence': index,
         'time': np.ma.min(tile.times),
-        'lats': []
+        'lats': coordinate_stats(np.ma.getdata(points.latitude), np.ma.getdata(points.data_val), 'latitude')
     }
 
-    points = list(tile.nexus_point_generator())
-    data = sorted(points, key=lambda p: p.latitude)
-    points_by_lat = itertools.groupby(data, key=lambda p: p.latitude)
 
-    for lat, points_at_lat in points_by_lat:
-        values_at_lat = np.array([point.data_val for point in points_at_lat])
-
-        stat['lats'].append({
-            'latitude': float(lat),
-            'cnt': len(values_at_lat),
-            'avg': np.mean(values_at_lat).item(),
-            'max': np.max(values_at_lat).item(),
-            'min': np.min(values_at_lat).item(),
-            'std': np.std(values_at_lat).item()
+def shared_tile_stats(stats_function, shared_tile, index):
+    try:
+        return stats_function(get_tile(shared_tile), index)
+    finally:
+        detach_arenas()
+
+
+def coordinate_stats(coordinates, values, coordinate_name):
+    """
+    Stats of the values at each distinct coordinate, in ascending order of coordinate.
+    """
+    if len(coordinates) == 0:
+        return []
+
+    unique_coordinates, groups = np.unique(coordinates, return_inverse=True)
+    moments = Moments.of_groups(values, groups, len(unique_coordinates))
+    std = moments.std()
+
+    stats = []
+    for i, coordinate in enumerate(unique_coordinates):
+        stats.append({
+            coordinate_name: float(coordinate),
+            'cnt': moments.count[i].item(),
+            'avg': moments.mean[i].item(),
+            'max': moments.max[i].item(),
+            'min': moments.min[i].item(),
+            'std': std.data[i].item()
         })
 
-    return stat
+    return stats
 
 
 class BaseHoffMoellerHandlerImpl(NexusHandler):
@@ -88,6 +92,28 @@ class BaseHoffMoellerHandlerImpl(NexusHandler):
 
         return results
 
+    def calculate_tile_stats(self, tiles, stats_function):
+        """
+        stats_function(tile, index) of each tile. On the worker pool, when there is one, the tiles are passed to the
+        workers through a SharedArena.
+        """
+        pool = get_worker_pool()
+        if pool is None:
+            maxprocesses = int(self.algorithm_config.get("multiprocessing", "maxprocesses"))
+            thread_pool = ThreadPool(processes=maxprocesses)
+            results = [thread_pool.apply_async(stats_function, args=(tile, x)) for x, tile in enumerate(tiles)]
+            thread_pool.close()
+            thread_pool.join()
+            return [result.get() for result in results]
+
+        with SharedArena(sum(tile_nbytes(tile) for tile in tiles)) as arena:
+            tasks = [(stats_function, arena.put_tile(tile), x) for x, tile in enumerate(tiles)]
+            try:
+                return pool.map(shared_tile_stats, tasks, unit='tiles')
+            except WorkerError as e:
+                logging.getLogger(__name__).error(str(e))
+                raise NexusProcessingException(reason="Error calculating HofMoeller stats.")
+
     def applyDeseasonToHofMoeller(self, results, pivot="lats", append=True):
         results = self.applyDeseasonToHofMoellerByField(results, pivot, field="avg", append=append)
         results = self.applyDeseasonToHofMoellerByField(results, pivot, field="min", append=append)
@@ -102,6 +128,7 @@ class LatitudeTimeHoffMoellerHandlerImpl(BaseHoffMoellerHandlerImpl):
     description = "Computes a latitude/time HofMoeller plot given an arbitrary geographical area and time range"
     params = DEFAULT_PARAMETERS_SPEC
     singleton = True
+    cacheable = True
 
     def __init__(self):
         BaseHoffMoellerHandlerImpl.__init__(self)
@@ -111,18 +138,12 @@ class LatitudeTimeHoffMoellerHandlerImpl(BaseHoffMoellerHandlerImpl):
                                                             computeOptions.get_min_lon(), computeOptions.get_max_lon(),
                                                             computeOptions.get_dataset()[0],
                                                             computeOptions.get_start_time(),
-                                                            computeOptions.get_end_time())
+                                                            computeOptions.get_end_time(), crop=True)
 
         if len(tiles) == 0:
             raise NexusProcessingException.NoDataException(reason="No data found for selected timeframe")
 
-        maxprocesses = int(self.algorithm_config.get("multiprocessing", "maxprocesses"))
-        pool = ThreadPool(processes=maxprocesses)
-        results = [pool.apply_async(latitude_time_hofmoeller_stats, args=(tile, x)) for x, tile in enumerate(tiles)]
-        pool.close()
-        pool.join()
-
-        results = [p.get() for p in results]
+        results = self.calculate_tile_stats(tiles, latitude_time_hofmoeller_stats)
         results = sorted(results, key=lambda entry: entry["time"])
 
         results = self.applyDeseasonToHofMoeller(results)
@@ -138,6 +159,7 @@ class LongitudeTimeHoffMoellerHandlerImpl(BaseHoffMoellerHandlerImpl):
     description = "Computes a longitude/time HofMoeller plot given an arbitrary geographical area and time range"
     params = DEFAULT_PARAMETERS_SPEC
     singleton = True
+    cacheable = True
 
     def __init__(self):
         BaseHoffMoellerHandlerImpl.__init__(self)
@@ -147,18 +169,12 @@ class LongitudeTimeHoffMoellerHandlerImpl(BaseHoffMoellerHandlerImpl):
                                                             computeOptions.get_min_lon(), computeOptions.get_max_lon(),
                                                             computeOptions.get_dataset()[0],
                                                             computeOptions.get_start_time(),
-                                                            computeOptions.get_end_time())
+                                                            computeOptions.get_end_time(), crop=True)
 
         if len(tiles) == 0:
             raise NexusProcessingException.NoDataException(reason="No data found for selected timeframe")
 
-        maxprocesses = int(self.algorithm_config.get("multiprocessing", "maxprocesses"))
-        pool = ThreadPool(processes=maxprocesses)
-        results = [pool.apply_async(longitude_time_hofmoeller_stats, args=(tile, x)) for x, tile in enumerate(tiles)]
-        pool.close()
-        pool.join()
-
-        results = [p.get() for p in results]
+        results = self.calculate_tile_stats(tiles, longitude_time_hofmoeller_stats)
         results = sorted(results, key=lambda entry: entry["time"])
 
         results = self.applyDeseasonToHofMoeller(results, pivot="lons")
@@ -11,6 +11,8 @@ import sys
 import numpy as np
 from time import time
 from webservice.NexusHandler import NexusHandler, nexus_handler, DEFAULT_PARAMETERS_SPEC
+from webservice.accumulators import Moments
+from webservice.jobs import report_progress
 from webservice.webmodel import NexusResults, NoDataException
 from netCDF4 import Dataset
 
@@ -25,6 +27,7 @@ class TimeAvgMapHandlerImpl(NexusHandler):
     description = "Computes a Latitude/Longitude Time Average plot given an arbitrary geographical area and time range"
     params = DEFAULT_PARAMETERS_SPEC
     singleton = True
+    cacheable = True
 
     def __init__(self):
         NexusHandler.__init__(self, skipCassandra=False)
@@ -100,41 +103,30 @@ class TimeAvgMapHandlerImpl(NexusHandler):
             min_x = np.min(good_inds_lon)
             max_x = np.max(good_inds_lon)
             tile_inbounds_shape = (max_y-min_y+1, max_x-min_x+1)
-            days_at_a_time = 90
-            t_incr = 86400 * days_at_a_time
-            avg_tile = np.ma.array(np.zeros(tile_inbounds_shape,
-                                            dtype=np.float64))
-            cnt_tile = np.ma.array(np.zeros(tile_inbounds_shape,
-                                            dtype=np.uint32))
-            t_start = self._startTime
-            while t_start <= self._endTime:
-                t_end = min(t_start+t_incr,self._endTime)
-                t1 = time()
-                print 'nexus call start at time %f' % t1
-                sys.stdout.flush()
-                nexus_tiles = self._tile_service.get_tiles_bounded_by_box(min_lat-self._latRes/2, max_lat+self._latRes/2, min_lon-self._lonRes/2, max_lon+self._lonRes/2, ds=self._ds, start_time=t_start, end_time=t_end)
-                t2 = time()
-                print 'nexus call end at time %f' % t2
-                print 'secs in nexus call: ', t2-t1
-                sys.stdout.flush()
-                self._prune_tiles(nexus_tiles)
-                print 't %d to %d - Got %d tiles' % (t_start, t_end, 
-                                                     len(nexus_tiles))
-                sys.stdout.flush()
-                for tile in nexus_tiles:
-                    tile.data.data[:,:] = np.nan_to_num(tile.data.data)
-                    avg_tile.data[:,:] += tile.data[0,
-                                                    min_y:max_y+1,
-                                                    min_x:max_x+1]
-                    cnt_tile.data[:,:] += (~tile.data.mask[0,
-                                                           min_y:max_y+1,
-                                                           min_x:max_x+1]).astype(np.uint8)
-                t_start = t_end + 1
+            moments = Moments(tile_inbounds_shape)
+            t1 = time()
+            print 'nexus call start at time %f' % t1
+            sys.stdout.flush()
+            # Tiles are streamed in time order with the next batches
+            # prefetched in the background, so memory does not grow with
+            # the length of the time range.
+            ntiles = 0
+            for tile in self._tile_service.get_tiles_bounded_by_box_generator(min_lat-self._latRes/2, max_lat+self._latRes/2, min_lon-self._lonRes/2, max_lon+self._lonRes/2, ds=self._ds, start_time=self._startTime, end_time=self._endTime):
+                if np.all(tile.data.mask):
+                    continue
+                ntiles += 1
+                moments.update(tile.data[0,
+                                         min_y:max_y+1,
+                                         min_x:max_x+1])
+            t2 = time()
+            print 'nexus call end at time %f' % t2
+            print 'secs in nexus call: ', t2-t1
+            print 't %d to %d - Got %d tiles' % (self._startTime, self._endTime,
+                                                 ntiles)
+            sys.stdout.flush()
 
-            print 'cnt_tile = ', cnt_tile
-            cnt_tile.mask = ~(cnt_tile.data.astype(bool))
-            avg_tile.mask = cnt_tile.mask
-            avg_tile /= cnt_tile
+            print 'cnt_tile = ', moments.count
+            avg_tile = moments.masked_mean()
             print 'Finished tile %s' % tile_in.section_spec
             print 'Tile avg = ', avg_tile
             sys.stdout.flush()
@@ -226,7 +218,10 @@ class TimeAvgMapHandlerImpl(NexusHandler):
         #    print 'lats: ', tile.latitudes.compressed()
         #    print 'lons: ', tile.longitudes.compressed()
 
-        avg_tiles = map(self._map, nexus_tiles)
+        avg_tiles = []
+        for tile in nexus_tiles:
+            avg_tiles.append(self._map(tile))
+            report_progress(len(avg_tiles), len(nexus_tiles), 'tiles')
         print 'shape a = ', a.shape
         sys.stdout.flush()
         # The tiles below are NOT Nexus objects.  They are tuples
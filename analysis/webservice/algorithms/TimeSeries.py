@@ -3,23 +3,26 @@ Copyright (c) 2016 Jet Propulsion Laboratory,
 California Institute of Technology.  All rights reserved
 """
 import sys
-import traceback
 import logging
+import math
+from bisect import bisect_left, bisect_right
 from cStringIO import StringIO
 from datetime import datetime
-from multiprocessing import Pool, Manager
 
 import matplotlib.dates as mdates
 import matplotlib.pyplot as plt
 import numpy as np
 from webservice.NexusHandler import NexusHandler, nexus_handler, DEFAULT_PARAMETERS_SPEC
-from nexustiles.nexustiles import NexusTileService
+from nexustiles.catalog import to_seconds
+from nexustiles.nexustiles import get_tile_service
 from scipy import stats
 
 from webservice import Filtering as filt
+from webservice.accumulators import Moments
+from webservice.jobs import report_progress
+from webservice.seriesstore import get_series_store, region_key
 from webservice.webmodel import NexusResults, NexusProcessingException, NoDataException
-
-SENTINEL = 'STOP'
+from webservice.workerpool import get_worker_pool, WorkerError
 
 
 @nexus_handler
@@ -29,6 +32,7 @@ class TimeSeriesHandlerImpl(NexusHandler):
     description = "Computes a time series plot between one or more datasets given an arbitrary geographical area and time range"
     params = DEFAULT_PARAMETERS_SPEC
     singleton = True
+    cacheable = True
 
     def __init__(self):
         NexusHandler.__init__(self, skipCassandra=True)
@@ -93,43 +97,14 @@ class TimeSeriesHandlerImpl(NexusHandler):
         if len(daysinrange) == 0:
             raise NoDataException(reason="No data found for selected timeframe")
 
-        maxprocesses = int(self.algorithm_config.get("multiprocessing", "maxprocesses"))
-
-        results = []
-        if maxprocesses == 1:
-            calculator = TimeSeriesCalculator()
-            for dayinseconds in daysinrange:
-                result = calculator.calc_average_on_day(min_lat, max_lat, min_lon, max_lon, ds, dayinseconds)
-                results.append(result)
+        store = get_series_store(self.algorithm_config)
+        if store is None:
+            results = self.calc_stats_by_day(min_lat, max_lat, min_lon, max_lon, ds, daysinrange)
         else:
-            # Create a task to calc average difference for each day
-            manager = Manager()
-            work_queue = manager.Queue()
-            done_queue = manager.Queue()
-            for dayinseconds in daysinrange:
-                work_queue.put(
-                    ('calc_average_on_day', min_lat, max_lat, min_lon, max_lon, ds, dayinseconds))
-            [work_queue.put(SENTINEL) for _ in xrange(0, maxprocesses)]
-
-            # Start new processes to handle the work
-            pool = Pool(maxprocesses)
-            [pool.apply_async(pool_worker, (work_queue, done_queue)) for _ in xrange(0, maxprocesses)]
-            pool.close()
-
-            # Collect the results as [(day (in ms), average difference for that day)]
-            for i in xrange(0, len(daysinrange)):
-                result = done_queue.get()
-                try:
-                    error_str = result['error']
-                    self.log.error(error_str)
-                    raise NexusProcessingException(reason="Error calculating average by day.")
-                except KeyError:
-                    pass
-
-                results.append(result)
-
-            pool.terminate()
-            manager.shutdown()
+            results = store.daily_stats(
+                region_key(ds, min_lat, max_lat, min_lon, max_lon), daysinrange,
+                lambda days: self.calc_stats_by_day(min_lat, max_lat, min_lon, max_lon, ds, days),
+                lambda since: self.find_reingested_days(min_lat, max_lat, min_lon, max_lon, ds, daysinrange, since))
 
         results = sorted(results, key=lambda entry: entry["time"])
 
@@ -139,6 +114,36 @@ class TimeSeriesHandlerImpl(NexusHandler):
 
         return results, {}
 
+    def calc_stats_by_day(self, min_lat, max_lat, min_lon, max_lon, ds, days):
+        pool = get_worker_pool()
+        if pool is None:
+            return TimeSeriesCalculator().calc_stats_by_day(min_lat, max_lat, min_lon, max_lon, ds, days)
+
+        # Calculate the stats of consecutive ranges of days on the worker pool, a couple of ranges per worker
+        days_per_task = int(math.ceil(len(days) / (pool.processes * 2.0)))
+        tasks = [(min_lat, max_lat, min_lon, max_lon, ds, days[i:i + days_per_task])
+                 for i in xrange(0, len(days), days_per_task)]
+        try:
+            return [stat for task_results in pool.map(calc_stats_by_day, tasks, chunksize=1, unit='day ranges')
+                    for stat in task_results]
+        except WorkerError as e:
+            self.log.error(str(e))
+            raise NexusProcessingException(reason="Error calculating average by day.")
+
+    def find_reingested_days(self, min_lat, max_lat, min_lon, max_lon, ds, days, since):
+        """
+        :return: Set of the days, of the sorted list days, spanned by tiles in the box inserted after the datetime since
+        """
+        solr_docs = self._tile_service.find_tiles_in_box(
+            min_lat, max_lat, min_lon, max_lon, ds, days[0], days[-1], fetch_data=False,
+            fq=["insert_timestamp:[%s TO *]" % since.strftime('%Y-%m-%dT%H:%M:%SZ')])
+
+        reingested = set()
+        for solr_doc in solr_docs:
+            reingested.update(days[bisect_left(days, to_seconds(solr_doc['tile_min_time_dt'])):
+                                   bisect_right(days, to_seconds(solr_doc['tile_max_time_dt']))])
+        return reingested
+
     def calculateComparisonStats(self, results, suffix=""):
 
         xy = [[], []]
@@ -283,41 +288,45 @@ class TimeSeriesResults(NexusResults):
 
 class TimeSeriesCalculator(object):
     def __init__(self):
-        self.__tile_service = NexusTileService()
-
-    def calc_average_on_day(self, min_lat, max_lat, min_lon, max_lon, dataset, timeinseconds):
-        ds1_nexus_tiles = self.__tile_service.get_tiles_bounded_by_box_at_time(min_lat, max_lat, min_lon, max_lon,
-                                                                               dataset,
-                                                                               timeinseconds)
-
-        tile_data_agg = np.ma.array([tile.data for tile in ds1_nexus_tiles])
-        data_min = np.ma.min(tile_data_agg)
-        data_max = np.ma.max(tile_data_agg)
-        daily_mean = np.ma.mean(tile_data_agg).item()
-        data_count = np.ma.count(tile_data_agg).item()
-        data_std = np.ma.std(tile_data_agg)
-
-        # Return Stats by day
-        stat = {
-            'min': data_min,
-            'max': data_max,
-            'mean': daily_mean,
-            'cnt': data_count,
-            'std': data_std,
-            'time': int(timeinseconds)
-        }
-        return stat
+        self.__tile_service = get_tile_service()
 
+    def calc_stats_by_day(self, min_lat, max_lat, min_lon, max_lon, dataset, days):
+        """
+        Stats of the data in the box of every tile at each of the sorted days, in seconds since the epoch.
 
-def pool_worker(work_queue, done_queue):
-    try:
-        calculator = TimeSeriesCalculator()
+        The tiles of the whole range of days are read in batches in time order and each is reduced once to its
+        Moments, which are then merged into every day the tile spans, so the stats of a day are those of all the data
+        of its tiles together.
 
-        for work in iter(work_queue.get, SENTINEL):
-            scifunction = work[0]
-            args = work[1:]
-            result = calculator.__getattribute__(scifunction)(*args)
-            done_queue.put(result)
-    except Exception as e:
-        e_str = traceback.format_exc(e)
-        done_queue.put({'error': e_str})
+        :return: List of the stats of each day, in the order of days
+        """
+        moments = Moments((len(days),))
+
+        for tiles in self.__tile_service.get_tile_batches_bounded_by_box_generator(min_lat, max_lat, min_lon, max_lon,
+                                                                                   dataset, days[0], days[-1],
+                                                                                   crop=True):
+            for tile in tiles:
+                first = bisect_left(days, to_seconds(tile.min_time))
+                last = bisect_right(days, to_seconds(tile.max_time))
+                if first < last:
+                    moments.merge(Moments.of(tile.data), slice(first, last))
+
+            report_progress(bisect_right(days, to_seconds(tiles[-1].min_time)), len(days), 'days')
+
+        data_min, data_max, std = moments.masked_min(), moments.masked_max(), moments.std()
+
+        stats = []
+        for i, timeinseconds in enumerate(days):
+            stats.append({
+                'min': data_min[i],
+                'max': data_max[i],
+                'mean': moments.mean[i].item(),
+                'cnt': moments.count[i].item(),
+                'std': std[i],
+                'time': int(timeinseconds)
+            })
+        return stats
+
+
+def calc_stats_by_day(min_lat, max_lat, min_lon, max_lon, dataset, days):
+    return TimeSeriesCalculator().calc_stats_by_day(min_lat, max_lat, min_lon, max_lon, dataset, days)
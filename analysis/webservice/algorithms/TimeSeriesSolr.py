@@ -3,23 +3,20 @@ Copyright (c) 2016 Jet Propulsion Laboratory,
 California Institute of Technology.  All rights reserved
 """
 import sys
-import traceback
 import logging
 from cStringIO import StringIO
 from datetime import datetime
-from multiprocessing import Pool, Manager
 
 import matplotlib.dates as mdates
 import matplotlib.pyplot as plt
 import numpy as np
 from webservice.NexusHandler import NexusHandler, nexus_handler, DEFAULT_PARAMETERS_SPEC
-from nexustiles.nexustiles import NexusTileService
+from nexustiles.nexustiles import get_tile_service
 from scipy import stats
 
 from webservice import Filtering as filt
 from webservice.webmodel import NexusResults, NexusProcessingException, NoDataException
-
-SENTINEL = 'STOP'
+from webservice.workerpool import get_worker_pool, WorkerError
 
 
 @nexus_handler
@@ -93,43 +90,25 @@ class TimeSeriesHandlerImpl(NexusHandler):
         if len(daysinrange) == 0:
             raise NoDataException(reason="No data found for selected timeframe")
 
-        maxprocesses = int(self.algorithm_config.get("multiprocessing", "maxprocesses"))
+        # Sum the tiles within the box of every day in one request, so the days only read their boundary tiles
+        within_stats = self._tile_service.get_daily_stats_within_box(min_lat, max_lat, min_lon, max_lon, ds,
+                                                                     daysinrange)
 
-        results = []
-        if maxprocesses == 1:
+        pool = get_worker_pool()
+        if pool is None:
             calculator = TimeSeriesCalculator()
-            for dayinseconds in daysinrange:
-                result = calculator.calc_average_on_day(min_lat, max_lat, min_lon, max_lon, ds, dayinseconds)
-                results.append(result)
+            results = [calculator.calc_average_on_day(min_lat, max_lat, min_lon, max_lon, ds, dayinseconds,
+                                                      within_stats.get(int(dayinseconds)))
+                       for dayinseconds in daysinrange]
         else:
-            # Create a task to calc average difference for each day
-            manager = Manager()
-            work_queue = manager.Queue()
-            done_queue = manager.Queue()
-            for dayinseconds in daysinrange:
-                work_queue.put(
-                    ('calc_average_on_day', min_lat, max_lat, min_lon, max_lon, ds, dayinseconds))
-            [work_queue.put(SENTINEL) for _ in xrange(0, maxprocesses)]
-
-            # Start new processes to handle the work
-            pool = Pool(maxprocesses)
-            [pool.apply_async(pool_worker, (work_queue, done_queue)) for _ in xrange(0, maxprocesses)]
-            pool.close()
-
-            # Collect the results as [(day (in ms), average difference for that day)]
-            for i in xrange(0, len(daysinrange)):
-                result = done_queue.get()
-                try:
-                    error_str = result['error']
-                    self.log.error(error_str)
-                    raise NexusProcessingException(reason="Error calculating average by day.")
-                except KeyError:
-                    pass
-
-                results.append(result)
-
-            pool.terminate()
-            manager.shutdown()
+            # Calculate the stats of each day on the worker pool
+            tasks = [(min_lat, max_lat, min_lon, max_lon, ds, dayinseconds, within_stats.get(int(dayinseconds)))
+                     for dayinseconds in daysinrange]
+            try:
+                results = pool.map(calc_average_on_day, tasks, unit='days')
+            except WorkerError as e:
+                self.log.error(str(e))
+                raise NexusProcessingException(reason="Error calculating average by day.")
 
         results = sorted(results, key=lambda entry: entry["time"])
 
@@ -283,60 +262,83 @@ class TimeSeriesResults(NexusResults):
 
 class TimeSeriesCalculator(object):
     def __init__(self):
-        self.__tile_service = NexusTileService()
-
-    def calc_average_on_day(self, min_lat, max_lat, min_lon, max_lon, dataset, timeinseconds):
-        # Get stats using solr only
-        ds1_nexus_tiles_stats = self.__tile_service.get_stats_within_box_at_time(min_lat, max_lat, min_lon, max_lon,
-                                                                               dataset,
-                                                                               timeinseconds)
-
-        data_min_within = min([tile["tile_min_val_d"] for tile in ds1_nexus_tiles_stats])
-        data_max_within = max([tile["tile_max_val_d"] for tile in ds1_nexus_tiles_stats])
-        data_sum_within = sum([tile["product(tile_avg_val_d, tile_count_i)"] for tile in ds1_nexus_tiles_stats])
-        data_count_within = sum([tile["tile_count_i"] for tile in ds1_nexus_tiles_stats])
-
-        # Get boundary tiles and calculate stats
-        ds1_nexus_tiles = self.__tile_service.get_boundary_tiles_at_time(min_lat, max_lat, min_lon, max_lon,
-                                                                               dataset,
-                                                                               timeinseconds)
-
-        tile_data_agg = np.ma.array([tile.data for tile in ds1_nexus_tiles])
-        data_min_boundary = np.ma.min(tile_data_agg)
-        data_max_boundary = np.ma.max(tile_data_agg)
-        #daily_mean = np.ma.mean(tile_data_agg).item()
-        data_sum_boundary = np.ma.sum(tile_data_agg)
-        data_count_boundary = np.ma.count(tile_data_agg).item()
-        #data_std = np.ma.std(tile_data_agg)
-
-        # Combine stats
-        data_min = min(data_min_within, data_min_boundary)
-        data_max = max(data_max_within, data_max_boundary)
-        data_count = data_count_within + data_count_boundary
-        daily_mean = (data_sum_within + data_sum_boundary) / data_count
-        data_std = 0
+        self.__tile_service = get_tile_service()
+
+    def calc_average_on_day(self, min_lat, max_lat, min_lon, max_lon, dataset, timeinseconds, within_stats=None):
+        """
+        Stats of the box on a day from within_stats, the stats Solr summed for the tiles within the box (see
+        NexusTileService.get_daily_stats_within_box), and the data of the tiles on the boundary of the box. The std is
+        exact since both parts add up their count, sum and sum of squares.
+        """
+        if within_stats is not None and within_stats['without_sums'] > 0:
+            # Tiles summarized before summaries had sums, so the std can only come from the data of every tile
+            tiles = self.__tile_service.get_tiles_bounded_by_box_at_time(min_lat, max_lat, min_lon, max_lon, dataset,
+                                                                         timeinseconds)
+            within_stats = None
+            box_stats = []
+        else:
+            boundary_tiles = self.__tile_service._solr_docs_to_tiles(
+                *self.__tile_service.find_all_boundary_tiles_at_time(min_lat, max_lat, min_lon, max_lon, dataset,
+                                                                     timeinseconds, fetch_data=False))
+
+            # Boundary tiles whose values are within the min and max of the interior tiles can not change them, so
+            # only their sums are needed and tiles ingested with summed-area tables do not have to be decoded
+            if within_stats is not None:
+                summed = [within_stats['min'] <= tile.tile_stats.min and tile.tile_stats.max <= within_stats['max']
+                          for tile in boundary_tiles]
+            else:
+                summed = [False] * len(boundary_tiles)
+
+            box_stats = self.__tile_service.get_stats_in_box_for_tiles(
+                min_lat, max_lat, min_lon, max_lon,
+                [tile for tile, is_summed in zip(boundary_tiles, summed) if is_summed])
+
+            tiles = [tile for tile, is_summed in zip(boundary_tiles, summed) if not is_summed]
+            if len(tiles) > 0:
+                self.__tile_service.fetch_data_for_tiles(*tiles)
+                self.__tile_service.mask_tiles_to_bbox(min_lat, max_lat, min_lon, max_lon, tiles)
+
+        values = [tile.data.compressed().astype(np.float64) for tile in tiles]
+        values = np.concatenate(values) if len(values) > 0 else np.empty(0, dtype=np.float64)
+
+        data_count = values.size + sum(stats.count for stats in box_stats)
+        data_sum = np.sum(values) + sum(stats.sum for stats in box_stats)
+        data_sum_sq = np.sum(np.square(values)) + sum(stats.sum_of_squares for stats in box_stats)
+        data_min = np.min(values) if values.size > 0 else np.inf
+        data_max = np.max(values) if values.size > 0 else -np.inf
+
+        if within_stats is not None:
+            data_count += within_stats['count']
+            data_sum += within_stats['sum']
+            data_sum_sq += within_stats['sum_sq']
+            data_min = min(data_min, within_stats['min'])
+            data_max = max(data_max, within_stats['max'])
+
+        if data_count == 0:
+            return {
+                'min': np.ma.masked,
+                'max': np.ma.masked,
+                'mean': 0.0,
+                'cnt': 0,
+                'std': np.ma.masked,
+                'time': int(timeinseconds)
+            }
+
+        daily_mean = data_sum / data_count
+        data_std = np.sqrt(max(data_sum_sq / data_count - daily_mean * daily_mean, 0.0))
 
         # Return Stats by day
         stat = {
-            'min': data_min,
-            'max': data_max,
-            'mean': daily_mean,
-            'cnt': data_count,
-            'std': data_std,
+            'min': float(data_min),
+            'max': float(data_max),
+            'mean': float(daily_mean),
+            'cnt': int(data_count),
+            'std': float(data_std),
             'time': int(timeinseconds)
         }
         return stat
 
 
-def pool_worker(work_queue, done_queue):
-    try:
-        calculator = TimeSeriesCalculator()
-
-        for work in iter(work_queue.get, SENTINEL):
-            scifunction = work[0]
-            args = work[1:]
-            result = calculator.__getattribute__(scifunction)(*args)
-            done_queue.put(result)
-    except Exception as e:
-        e_str = traceback.format_exc(e)
-        done_queue.put({'error': e_str})
+def calc_average_on_day(min_lat, max_lat, min_lon, max_lon, dataset, timeinseconds, within_stats=None):
+    return TimeSeriesCalculator().calc_average_on_day(min_lat, max_lat, min_lon, max_lon, dataset, timeinseconds,
+                                                      within_stats)
@@ -3,6 +3,7 @@ from webservice.webmodel import StatsComputeOptions
 from webservice.NexusHandler import nexus_handler
 from webservice.NexusHandler import DEFAULT_PARAMETERS_SPEC
 from webservice.webmodel import NexusResults, NexusProcessingException
+from webservice.jobs import report_progress
 from nexustiles.model.nexusmodel import get_approximate_value_for_lat_lon
 import BaseDomsHandler
 from datetime import datetime
@@ -106,6 +107,7 @@ class CombinedDomsMatchupQueryHandler(BaseDomsHandler.BaseDomsQueryHandler):
 
                 tilesByDay = {}
                 for dayTimestamp in daysinrange:
+                    report_progress(len(tilesByDay), len(daysinrange), 'days of %s' % matchupId)
                     ds1_nexus_tiles = self._tile_service.get_tiles_bounded_by_box_at_time(bounds.south, bounds.north, bounds.west, bounds.east, matchupId, dayTimestamp)
 
                     #print "***", type(ds1_nexus_tiles)
@@ -233,6 +235,33 @@ class MatchupContext:
         latlons = []
         utms = []
         indexes = []
+        for _lat, _lon, index in self.__chunkPoints(chunk):
+            u = utm.from_latlon(_lat, _lon)
+            v = (u[0], u[1], 0.0)
+            latlons.append((_lat, _lon))
+            utms.append(v)
+            indexes.append(index)
+
+        tree = None
+        if len(latlons) > 0:
+            tree = spatial.KDTree(utms)
+
+        chunk.swathIndexing = {
+            "tree": tree,
+            "latlons": latlons,
+            "indexes": indexes
+        }
+
+
+    def __chunkPoints(self, chunk):
+        if chunk.is_swath():
+            # Swath chunks hold a latitude and longitude per point so only the valid points need to be indexed
+            invalid = np.ma.getmaskarray(chunk.latitudes) | np.ma.getmaskarray(chunk.longitudes) \
+                      | np.ma.getmaskarray(chunk.data) | np.isnan(np.ma.getdata(chunk.data))
+            for k in np.nonzero(~invalid)[0]:
+                yield chunk.latitudes[k], chunk.longitudes[k], (k,)
+            return
+
         for i in range(0, len(chunk.latitudes)):
             _lat = chunk.latitudes[i]
             if isinstance(_lat, np.ma.core.MaskedConstant):
@@ -246,21 +275,7 @@ class MatchupContext:
                 if isinstance(value, float) and (math.isnan(value) or value == np.nan):
                     continue
 
-                u = utm.from_latlon(_lat, _lon)
-                v = (u[0], u[1], 0.0)
-                latlons.append((_lat, _lon))
-                utms.append(v)
-                indexes.append((i, j))
-
-        tree = None
-        if len(latlons) > 0:
-            tree = spatial.KDTree(utms)
-
-        chunk.swathIndexing = {
-            "tree": tree,
-            "latlons": latlons,
-            "indexes": indexes
-        }
+                yield _lat, _lon, (i, j)
 
 
     def __getChunkIndexesForLatLon(self, chunk, lat, lon, xyTolerance):
@@ -285,7 +300,13 @@ class MatchupContext:
 
     def __getChunkValueAtIndex(self, chunk, index, arrayName=None):
 
-        if arrayName is None or arrayName == "data":
+        if chunk.is_swath():
+            # Swath chunks are indexed by point
+            if arrayName is None or arrayName == "data":
+                data_val = chunk.data[index[0]]
+            else:
+                data_val = chunk.meta_data[arrayName][index[0]]
+        elif arrayName is None or arrayName == "data":
             data_val = chunk.data[0][index[0]][index[1]]
         else:
             data_val = chunk.meta_data[arrayName][0][index[0]][index[1]]
@@ -8,8 +8,10 @@ import math
 import numpy as np
 from time import time
 from webservice.SparkAlg import SparkAlg
+from webservice.accumulators import Covariance
 from webservice.NexusHandler import NexusHandler, nexus_handler, DEFAULT_PARAMETERS_SPEC
-from nexustiles.nexustiles import NexusTileService
+from nexustiles.nexustiles import get_tile_service
+from webservice.jobs import report_progress
 from webservice.webmodel import NexusProcessingException
 from pyspark import SparkContext,SparkConf
 
@@ -31,119 +33,76 @@ class CorrMapSparkHandlerImpl(SparkAlg):
         (min_lat, max_lat, min_lon, max_lon, 
          min_y, max_y, min_x, max_x) = tile_bounds
 
-        # Create masked arrays to hold intermediate results during
-        # correlation coefficient calculation.
+        # Covariance of the two datasets at each grid cell of the tile,
+        # accumulated one time at a time.
         tile_inbounds_shape = (max_y-min_y+1, max_x-min_x+1)
-        sumx_tile = np.zeros(tile_inbounds_shape, dtype=np.float64)
-        sumy_tile = np.zeros(tile_inbounds_shape, dtype=np.float64)
-        sumxx_tile = np.zeros(tile_inbounds_shape, dtype=np.float64)
-        sumyy_tile = np.zeros(tile_inbounds_shape, dtype=np.float64)
-        sumxy_tile = np.zeros(tile_inbounds_shape, dtype=np.float64)
-        n_tile = np.ma.array(np.zeros(tile_inbounds_shape, dtype=np.uint32))
+        covariance = Covariance(tile_inbounds_shape)
 
-        # Can only retrieve some number of days worth of data from Solr
-        # at a time.  Set desired value here.
-        days_at_a_time = 90
-        #days_at_a_time = 30
-        #days_at_a_time = 7
-        #days_at_a_time = 1
-        print 'days_at_a_time = ', days_at_a_time
-        t_incr = 86400 * days_at_a_time
-
-        tile_service = NexusTileService()
+        tile_service = get_tile_service()
 
         # Compute Pearson Correlation Coefficient.  We use an online algorithm
-        # so that not all of the data needs to be kept in memory all at once.
-        t_start = start_time
-        while t_start <= end_time:
-            t_end = min(t_start+t_incr,end_time)
-            t1 = time()
-            print 'nexus call start at time %f' % t1
-            sys.stdout.flush()
-            ds1tiles = tile_service.get_tiles_bounded_by_box(min_lat, 
-                                                             max_lat, 
-                                                             min_lon, 
-                                                             max_lon, 
-                                                             ds[0], 
-                                                             t_start,
-                                                             t_end)
-            ds2tiles = tile_service.get_tiles_bounded_by_box(min_lat, 
-                                                             max_lat, 
-                                                             min_lon, 
-                                                             max_lon, 
-                                                             ds[1], 
-                                                             t_start,
-                                                             t_end)
-            t2 = time()
-            print 'nexus call end at time %f' % t2
-            print 'secs in nexus call: ', t2-t1
-            sys.stdout.flush()
-            CorrMapSparkHandlerImpl._prune_tiles(ds1tiles)
-            CorrMapSparkHandlerImpl._prune_tiles(ds2tiles)
-            
-            len1 = len(ds1tiles)
-            len2 = len(ds2tiles)
-            print 't %d to %d - Got %d and %d tiles' % (t_start, t_end, 
-                                                        len1, len2)
-            sys.stdout.flush()
-            i1 = 0
-            i2 = 0
-            while i1 < len1 and i2 < len2:
-                tile1 = ds1tiles[i1]
-                tile2 = ds2tiles[i2]
-                #print 'tile1.data = ',tile1.data
-                #print 'tile2.data = ',tile2.data
-                time1 = tile1.times[0]
-                time2 = tile2.times[0]
-                if time1 < time2: 
-                    i1 += 1
-                    continue
-                elif time2 < time1:
-                    i2 += 1
-                    continue
-                assert (time1 == time2),\
-                    "Mismatched tile times %d and %d" % (time1, time2)
-                t1_data = tile1.data.data
-                t1_mask = tile1.data.mask
-                t2_data = tile2.data.data
-                t2_mask = tile2.data.mask
-                t1_data = np.nan_to_num(t1_data)
-                t2_data = np.nan_to_num(t2_data)
-                joint_mask = ((~t1_mask).astype(np.uint8) *
-                              (~t2_mask).astype(np.uint8))
-                #print 'joint_mask=',joint_mask
-                sumx_tile += (t1_data[0,min_y:max_y+1,min_x:max_x+1] *
-                              joint_mask[0,min_y:max_y+1,min_x:max_x+1])
-                #print 'sumx_tile=',sumx_tile
-                sumy_tile += (t2_data[0,min_y:max_y+1,min_x:max_x+1] *
-                              joint_mask[0,min_y:max_y+1,min_x:max_x+1])
-                #print 'sumy_tile=',sumy_tile
-                sumxx_tile += (t1_data[0,min_y:max_y+1,min_x:max_x+1] *
-                               t1_data[0,min_y:max_y+1,min_x:max_x+1] *
-                               joint_mask[0,min_y:max_y+1,min_x:max_x+1])
-                #print 'sumxx_tile=',sumxx_tile
-                sumyy_tile += (t2_data[0,min_y:max_y+1,min_x:max_x+1] *
-                               t2_data[0,min_y:max_y+1,min_x:max_x+1] *
-                               joint_mask[0,min_y:max_y+1,min_x:max_x+1])
-                #print 'sumyy_tile=',sumyy_tile
-                sumxy_tile += (t1_data[0,min_y:max_y+1,min_x:max_x+1] *
-                               t2_data[0,min_y:max_y+1,min_x:max_x+1] *
-                               joint_mask[0,min_y:max_y+1,min_x:max_x+1])
-                #print 'sumxy_tile=',sumxy_tile
-                n_tile.data[:,:] += joint_mask[0,min_y:max_y+1,min_x:max_x+1]
-                #print 'n_tile=',n_tile
-                i1 += 1
-                i2 += 1
-            t_start = t_end + 1
+        # (the co-moment updates of Covariance, which unlike raw sums of
+        # squares do not cancel catastrophically) so that not all of the data
+        # needs to be kept in memory all at once.
+        # Both datasets are streamed in time order (with the next batches
+        # prefetched in the background) and merge-joined on tile time.
+        t1 = time()
+        print 'nexus call start at time %f' % t1
+        sys.stdout.flush()
+        ds1tiles = tile_service.get_tiles_bounded_by_box_generator(min_lat,
+                                                                   max_lat,
+                                                                   min_lon,
+                                                                   max_lon,
+                                                                   ds[0],
+                                                                   start_time,
+                                                                   end_time)
+        ds2tiles = tile_service.get_tiles_bounded_by_box_generator(min_lat,
+                                                                   max_lat,
+                                                                   min_lon,
+                                                                   max_lon,
+                                                                   ds[1],
+                                                                   start_time,
+                                                                   end_time)
+        ds1tiles = (tile for tile in ds1tiles if not np.all(tile.data.mask))
+        ds2tiles = (tile for tile in ds2tiles if not np.all(tile.data.mask))
+
+        len1 = 0
+        len2 = 0
+        tile1 = next(ds1tiles, None)
+        tile2 = next(ds2tiles, None)
+        while tile1 is not None and tile2 is not None:
+            #print 'tile1.data = ',tile1.data
+            #print 'tile2.data = ',tile2.data
+            time1 = tile1.times[0]
+            time2 = tile2.times[0]
+            if time1 < time2:
+                tile1 = next(ds1tiles, None)
+                len1 += 1
+                continue
+            elif time2 < time1:
+                tile2 = next(ds2tiles, None)
+                len2 += 1
+                continue
+            assert (time1 == time2),\
+                "Mismatched tile times %d and %d" % (time1, time2)
+            # Only the cells valid in both tiles are added
+            covariance.update(tile1.data[0,min_y:max_y+1,min_x:max_x+1],
+                              tile2.data[0,min_y:max_y+1,min_x:max_x+1])
+            tile1 = next(ds1tiles, None)
+            tile2 = next(ds2tiles, None)
+            len1 += 1
+            len2 += 1
+        t2 = time()
+        print 'nexus call end at time %f' % t2
+        print 'secs in nexus call: ', t2-t1
+        print 't %d to %d - Got %d and %d tiles' % (start_time, end_time,
+                                                    len1, len2)
+        sys.stdout.flush()
 
-        r_tile = np.ma.array((sumxy_tile-sumx_tile*sumy_tile/n_tile) /
-                             np.sqrt((sumxx_tile-sumx_tile*sumx_tile/n_tile)*
-                                     (sumyy_tile - sumy_tile*sumy_tile/n_tile)))
+        r_tile = covariance.correlation()
         #print 'r_tile=',r_tile
-        n_tile.mask = ~(n_tile.data.astype(bool))
-        r_tile.mask = n_tile.mask
-        #print 'r_tile masked=',r_tile
-        stats_tile = [[{'r': r_tile.data[y,x], 'cnt': n_tile.data[y,x]} for x in range(tile_inbounds_shape[1])] for y in range(tile_inbounds_shape[0])]
+        n_tile = covariance.count
+        stats_tile = [[{'r': r_tile.data[y,x], 'cnt': n_tile[y,x]} for x in range(tile_inbounds_shape[1])] for y in range(tile_inbounds_shape[0])]
         #print 'stats_tile = ', stats_tile
         print 'Finished tile', tile_bounds
         sys.stdout.flush()
@@ -228,8 +187,10 @@ class CorrMapSparkHandlerImpl(SparkAlg):
         sc = SparkContext(conf=sp_conf)
         
         # Launch Spark computations
+        report_progress(0, len(nexus_tile_specs), 'tiles')
         rdd = sc.parallelize(nexus_tile_specs,num_parts)
         corr_tiles = rdd.map(self._map).collect()
+        report_progress(len(corr_tiles), len(nexus_tile_specs), 'tiles')
 
         r = np.zeros((nlats, nlons),dtype=np.float64,order='C')
 
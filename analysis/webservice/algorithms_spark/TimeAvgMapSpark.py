@@ -10,8 +10,9 @@ import numpy as np
 from time import time
 import itertools
 from webservice.SparkAlg import SparkAlg
+from webservice.accumulators import Moments
 from webservice.NexusHandler import NexusHandler, nexus_handler, DEFAULT_PARAMETERS_SPEC
-from nexustiles.nexustiles import NexusTileService
+from nexustiles.nexustiles import get_tile_service
 from webservice.webmodel import NexusResults, NexusProcessingException, NoDataException
 from pyspark import SparkContext,SparkConf
 
@@ -37,46 +38,35 @@ class TimeAvgMapSparkHandlerImpl(SparkAlg):
         ds = tile_in_spark[3]
         cwd = tile_in_spark[4]
         os.chdir(cwd)
-        tile_service = NexusTileService()
+        tile_service = get_tile_service()
         print 'Started tile', tile_bounds
         sys.stdout.flush()
         tile_inbounds_shape = (max_y-min_y+1, max_x-min_x+1)
-        days_at_a_time = 90
-        #days_at_a_time = 7
-        #days_at_a_time = 1
-        print 'days_at_a_time = ', days_at_a_time
-        t_incr = 86400 * days_at_a_time
-        sum_tile = np.array(np.zeros(tile_inbounds_shape, dtype=np.float64))
-        cnt_tile = np.array(np.zeros(tile_inbounds_shape, dtype=np.uint32))
-        t_start = startTime
-        while t_start <= endTime:
-            t_end = min(t_start+t_incr,endTime)
-            t1 = time()
-            print 'nexus call start at time %f' % t1
-            sys.stdout.flush()
-            nexus_tiles = \
-                TimeAvgMapSparkHandlerImpl.query_by_parts(tile_service,
-                                                          min_lat, max_lat, 
-                                                          min_lon, max_lon, 
-                                                          ds, 
-                                                          t_start, 
-                                                          t_end,
-                                                          part_dim=2)
-            t2 = time()
-            print 'nexus call end at time %f' % t2
-            print 'secs in nexus call: ', t2-t1
-            sys.stdout.flush()
-            TimeAvgMapSparkHandlerImpl._prune_tiles(nexus_tiles)
-            print 't %d to %d - Got %d tiles' % (t_start, t_end, 
-                                                 len(nexus_tiles))
-            sys.stdout.flush()
-            for tile in nexus_tiles:
-                tile.data.data[:,:] = np.nan_to_num(tile.data.data)
-                sum_tile += tile.data.data[0,min_y:max_y+1,min_x:max_x+1]
-                cnt_tile += (~tile.data.mask[0,
-                                             min_y:max_y+1,
-                                             min_x:max_x+1]).astype(np.uint8)
-            t_start = t_end + 1
+        moments = Moments(tile_inbounds_shape)
+        t1 = time()
+        print 'nexus call start at time %f' % t1
+        sys.stdout.flush()
+        # Tiles are streamed in time order with the next batches prefetched
+        # in the background, so memory does not grow with the time range.
+        ntiles = 0
+        for tile in tile_service.get_tiles_bounded_by_box_generator(min_lat,
+                                                                    max_lat,
+                                                                    min_lon,
+                                                                    max_lon,
+                                                                    ds,
+                                                                    startTime,
+                                                                    endTime):
+            if np.all(tile.data.mask):
+                continue
+            ntiles += 1
+            moments.update(tile.data[0,
+                                     min_y:max_y+1,
+                                     min_x:max_x+1])
+        t2 = time()
+        print 'nexus call end at time %f' % t2
+        print 'secs in nexus call: ', t2-t1
+        print 't %d to %d - Got %d tiles' % (startTime, endTime, ntiles)
+        sys.stdout.flush()
 
         #print 'cnt_tile = ', cnt_tile
         #cnt_tile.mask = ~(cnt_tile.data.astype(bool))
@@ -86,7 +76,17 @@ class TimeAvgMapSparkHandlerImpl(SparkAlg):
         print 'Finished tile', tile_bounds
         #print 'Tile avg = ', avg_tile
         sys.stdout.flush()
-        return ((min_lat,max_lat,min_lon,max_lon),(sum_tile,cnt_tile))
+        return ((min_lat,max_lat,min_lon,max_lon),moments)
+
+    @staticmethod
+    def _stats(bounds_moments):
+        bounds, moments = bounds_moments
+        std = moments.std().filled(0.)
+        return (bounds, [[{'avg': moments.mean[y,x],
+                           'std': std[y,x],
+                           'cnt': moments.count[y,x]}
+                          for x in range(moments.count.shape[1])]
+                         for y in range(moments.count.shape[0])])
 
     def calc(self, computeOptions, **args):
         """
@@ -119,6 +119,7 @@ class TimeAvgMapSparkHandlerImpl(SparkAlg):
                                                self._maxLonCent)
         sys.stdout.flush()
         a = np.zeros((nlats, nlons),dtype=np.float64,order='C')
+        s = np.zeros((nlats, nlons),dtype=np.float64,order='C')
         n = np.zeros((nlats, nlons),dtype=np.float64,order='C')
 
         nexus_tiles = self._find_global_tile_set()
@@ -202,21 +203,14 @@ class TimeAvgMapSparkHandlerImpl(SparkAlg):
         
         # Launch Spark computations
         rdd = sc.parallelize(nexus_tiles_spark,num_parts)
-        sum_count_part = rdd.map(self._map)
-        sum_count = \
-            sum_count_part.combineByKey(lambda val: val,
-                                        lambda x,val: (x[0]+val[0], 
-                                                       x[1]+val[1]),
-                                        lambda x,y: (x[0]+y[0], x[1]+y[1]))
-        avg_tiles = \
-            sum_count.map(lambda (bounds, (sum_tile, cnt_tile)):
-                              (bounds, [[{'avg': (sum_tile[y,x]/cnt_tile[y,x]) 
-                                          if (cnt_tile[y,x] > 0) else 0., 
-                                          'cnt': cnt_tile[y,x]} 
-                                         for x in 
-                                         range(sum_tile.shape[1])] 
-                                        for y in 
-                                        range(sum_tile.shape[0])])).collect()
+        moments_part = rdd.map(self._map)
+        # The Moments of the time parts of a tile merge exactly, std
+        # included
+        moments_by_tile = \
+            moments_part.combineByKey(lambda val: val,
+                                      lambda x,val: x.merge(val),
+                                      lambda x,y: x.merge(y))
+        avg_tiles = moments_by_tile.map(self._stats).collect()
 
         #avg_tiles = map(self._map, nexus_tiles)
 
@@ -229,6 +223,7 @@ class TimeAvgMapSparkHandlerImpl(SparkAlg):
                 ((tile_min_lat, tile_max_lat, tile_min_lon, tile_max_lon),
                  tile_stats) = tile
                 tile_data = np.ma.array([[tile_stats[y][x]['avg'] for x in range(len(tile_stats[0]))] for y in range(len(tile_stats))])
+                tile_std = np.array([[tile_stats[y][x]['std'] for x in range(len(tile_stats[0]))] for y in range(len(tile_stats))])
                 tile_cnt = np.array([[tile_stats[y][x]['cnt'] for x in range(len(tile_stats[0]))] for y in range(len(tile_stats))])
                 tile_data.mask = ~(tile_cnt.astype(bool))
                 y0 = self._lat2ind(tile_min_lat)
@@ -241,6 +236,7 @@ class TimeAvgMapSparkHandlerImpl(SparkAlg):
                          tile_min_lon, tile_max_lon, y0, y1, x0, x1)
                     sys.stdout.flush()
                     a[y0:y1+1,x0:x1+1] = tile_data
+                    s[y0:y1+1,x0:x1+1] = tile_std
                     n[y0:y1+1,x0:x1+1] = tile_cnt
                 else:
                     print 'All pixels masked in tile lat %f-%f, lon %f-%f, map y %d-%d, map x %d-%d' % \
@@ -252,7 +248,7 @@ class TimeAvgMapSparkHandlerImpl(SparkAlg):
         self._create_nc_file(a, 'tam.nc', 'val')
 
         # Create dict for JSON response
-        results = [[{'avg': a[x,y], 'cnt': n[x,y]}
+        results = [[{'avg': a[x,y], 'std': s[x,y], 'cnt': n[x,y]}
                     for x in range(a.shape[0])] for y in range(a.shape[1])]
         return TimeAvgMapSparkResults(results=results, meta={}, computeOptions=computeOptions)
 
@@ -16,7 +16,7 @@ import numpy as np
 import itertools
 from webservice.SparkAlg import SparkAlg
 from webservice.NexusHandler import NexusHandler, nexus_handler, DEFAULT_PARAMETERS_SPEC
-from nexustiles.nexustiles import NexusTileService
+from nexustiles.nexustiles import get_tile_service
 from scipy import stats
 
 from webservice import Filtering as filt
@@ -303,7 +303,7 @@ class TimeSeriesResults(NexusResults):
 
 class TimeSeriesCalculator(SparkAlg):
     def __init__(self):
-        self.__tile_service = NexusTileService()
+        self.__tile_service = get_tile_service()
 
     @staticmethod
     def calc_average_on_day(tile_in_spark):
@@ -312,7 +312,7 @@ class TimeSeriesCalculator(SparkAlg):
         os.chdir(cwd)
         start_time = timestamps[0]
         end_time = timestamps[-1]
-        tile_service = NexusTileService()
+        tile_service = get_tile_service()
         #ds1_nexus_tiles = \
         #    tile_service.get_tiles_bounded_by_box_at_time(min_lat, max_lat, 
         #                                                  min_lon, max_lon, 
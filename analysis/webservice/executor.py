@@ -0,0 +1,136 @@
+"""
+Copyright (c) 2016 Jet Propulsion Laboratory,
+California Institute of Technology.  All rights reserved
+"""
+import logging
+import threading
+import time
+from Queue import Queue
+
+DEFAULT_MAX_WORKERS = 8
+DEFAULT_MAX_QUEUE = 16
+DEFAULT_RETRY_AFTER = 5
+
+
+class RequestExecutor(object):
+    """
+    Runs the requests of one endpoint on at most max_workers threads. Up to max_queue more requests wait for a free
+    thread; submit refuses any request beyond that so the caller can reject it immediately.
+
+    Worker threads are started as they are needed and then kept for the life of the process.
+    """
+
+    def __init__(self, name, max_workers=DEFAULT_MAX_WORKERS, max_queue=DEFAULT_MAX_QUEUE):
+        self.name = name
+        self.max_workers = max_workers
+        self.max_queue = max_queue
+        self.logger = logging.getLogger('nexus')
+
+        self._tasks = Queue()
+        self._lock = threading.Lock()
+        self._threads = []
+
+        self._pending = 0
+        self._running = 0
+        self._completed = 0
+        self._rejected = 0
+        self._total_wait = 0.0
+        self._max_wait = 0.0
+
+    def submit(self, fn, *args, **kwargs):
+        """
+        Queue fn(*args, **kwargs) to run on a worker thread.
+
+        :return: False if the endpoint already has max_workers running and max_queue waiting requests, True otherwise
+        """
+        with self._lock:
+            if self._pending >= self.max_workers + self.max_queue:
+                self._rejected += 1
+                return False
+
+            self._pending += 1
+            if len(self._threads) < min(self._pending, self.max_workers):
+                thread = threading.Thread(target=self._work, name="%s-%d" % (self.name, len(self._threads)))
+                thread.daemon = True
+                thread.start()
+                self._threads.append(thread)
+
+        self._tasks.put((time.time(), fn, args, kwargs))
+        return True
+
+    def _work(self):
+        while True:
+            submitted, fn, args, kwargs = self._tasks.get()
+
+            wait = time.time() - submitted
+            with self._lock:
+                self._running += 1
+                self._total_wait += wait
+                self._max_wait = max(self._max_wait, wait)
+
+            try:
+                fn(*args, **kwargs)
+            except Exception:
+                self.logger.exception("Unhandled error running request for %s" % self.name)
+            finally:
+                with self._lock:
+                    self._running -= 1
+                    self._pending -= 1
+                    self._completed += 1
+
+    def stats(self):
+        """
+        :return: dict of the current number of running and queued requests, the configured limits, and the number of
+        completed and rejected requests and their total and maximum wait in the queue in seconds since startup
+        """
+        with self._lock:
+            started = self._completed + self._running
+            return {
+                "running": self._running,
+                "queued": self._pending - self._running,
+                "max_workers": self.max_workers,
+                "max_queue": self.max_queue,
+                "completed": self._completed,
+                "rejected": self._rejected,
+                "total_wait_seconds": self._total_wait,
+                "mean_wait_seconds": self._total_wait / started if started > 0 else 0.0,
+                "max_wait_seconds": self._max_wait
+            }
+
+
+class ExecutorRegistry(object):
+    """
+    One RequestExecutor per endpoint path, with limits read from the [executor] section of web.ini:
+
+        max_workers, max_queue     defaults for every endpoint
+        retry_after                seconds sent in the Retry-After header of rejected requests
+        <path>.max_workers, <path>.max_queue
+                                   limits of one endpoint, e.g. /timeAvgMapSpark.max_workers=2
+    """
+
+    def __init__(self, config=None):
+        self._config = config
+        self._executors = {}
+        self._lock = threading.Lock()
+
+        self.retry_after = self._getint("retry_after", DEFAULT_RETRY_AFTER)
+
+    def _getint(self, option, default):
+        # ConfigParser lower cases option names
+        if self._config is not None and self._config.has_option("executor", option.lower()):
+            return self._config.getint("executor", option.lower())
+        return default
+
+    def get(self, path):
+        with self._lock:
+            if path not in self._executors:
+                max_workers = self._getint("%s.max_workers" % path,
+                                           self._getint("max_workers", DEFAULT_MAX_WORKERS))
+                max_queue = self._getint("%s.max_queue" % path, self._getint("max_queue", DEFAULT_MAX_QUEUE))
+                self._executors[path] = RequestExecutor(path, max_workers, max_queue)
+            return self._executors[path]
+
+    def stats(self):
+        with self._lock:
+            executors = dict(self._executors)
+        return {path: executor.stats() for path, executor in executors.iteritems()}
@@ -0,0 +1,245 @@
+"""
+Copyright (c) 2016 Jet Propulsion Laboratory,
+California Institute of Technology.  All rights reserved
+"""
+import copy
+import cPickle as pickle
+import logging
+import os
+import tempfile
+import threading
+import time
+import uuid
+
+from webservice.webmodel import NexusProcessingException, StreamingResults
+
+_current = threading.local()
+
+
+def report_progress(done, total=None, unit=None):
+    """
+    Report how much of the job run by the calling thread is done, for example report_progress(10, 365, 'days'). Does
+    nothing when the thread is not running a job, so calc methods can always call it.
+    """
+    job = getattr(_current, 'job', None)
+    if job is not None:
+        job.progress = {"done": done, "total": total, "unit": unit}
+
+
+class Job(object):
+    QUEUED = "queued"
+    RUNNING = "running"
+    SUCCEEDED = "succeeded"
+    FAILED = "failed"
+
+    def __init__(self, path):
+        self.id = uuid.uuid4().hex
+        self.path = path
+        self.status = Job.QUEUED
+        self.progress = None
+        self.error = None
+        self.code = None
+        self.submitted = time.time()
+        self.started = None
+        self.finished = None
+
+    def is_finished(self):
+        return self.status in (Job.SUCCEEDED, Job.FAILED)
+
+    def to_dict(self):
+        return {
+            "jobId": self.id,
+            "path": self.path,
+            "status": self.status,
+            "progress": self.progress,
+            "error": self.error,
+            "submitted": self.submitted,
+            "started": self.started,
+            "finished": self.finished
+        }
+
+
+class JobManager(object):
+    """
+    Runs calc of any registered handler as a job on the RequestExecutor of its endpoint and keeps the results of
+    finished jobs for ttl_seconds. With a result_dir, finished jobs and their results are pickled to separate files so
+    they outlive the process and results are only loaded when they are fetched; results that can not be pickled are
+    only kept in memory.
+
+    :param executors: ExecutorRegistry that runs the jobs
+    :param result_dir: Directory finished jobs are saved in, None to keep them in memory only
+    :param ttl_seconds: Seconds finished jobs are kept
+    """
+
+    def __init__(self, executors, result_dir=None, ttl_seconds=86400):
+        self.executors = executors
+        self.result_dir = result_dir
+        self.ttl_seconds = ttl_seconds
+        self.logger = logging.getLogger('nexus')
+
+        self._lock = threading.Lock()
+        # job id -> (Job, results), results are None when they are saved
+        self._jobs = {}
+
+        if result_dir is not None and not os.path.isdir(result_dir):
+            os.makedirs(result_dir)
+
+    def submit(self, clazz_wrapper, algorithm_config, request):
+        """
+        Queue clazz_wrapper's calc of request.
+
+        :param clazz_wrapper: AlgorithmModuleWrapper of the handler
+        :param request: NexusRequestObject that does not depend on the HTTP request, such as a StoredRequestObject
+        :return: The queued Job, or None if the endpoint's executor is full
+        """
+        self.remove_expired()
+
+        job = Job(clazz_wrapper.path())
+        with self._lock:
+            self._jobs[job.id] = (job, None)
+
+        if not self.executors.get(clazz_wrapper.path()).submit(self._run, job, clazz_wrapper, algorithm_config,
+                                                                request):
+            with self._lock:
+                del self._jobs[job.id]
+            return None
+
+        return job
+
+    def _run(self, job, clazz_wrapper, algorithm_config, request):
+        job.status = Job.RUNNING
+        job.started = time.time()
+        _current.job = job
+
+        # The job is shown as finished only once its results are saved and can be fetched
+        finished = copy.copy(job)
+        results = None
+        try:
+            results = clazz_wrapper.instance(algorithm_config).calc(request)
+            if isinstance(results, StreamingResults):
+                # The result can be fetched any number of times
+                results.materialize()
+            finished.status = Job.SUCCEEDED
+        except NexusProcessingException as e:
+            self.logger.error("Error running job %s" % job.id, exc_info=True)
+            finished.error, finished.code = e.reason, e.code
+            finished.status = Job.FAILED
+        except Exception as e:
+            self.logger.error("Error running job %s" % job.id, exc_info=True)
+            finished.error, finished.code = str(e), 500
+            finished.status = Job.FAILED
+        finally:
+            _current.job = None
+            finished.progress = job.progress
+            finished.finished = time.time()
+
+        # Pickling large results takes a while, so it is done without holding the lock
+        saved = self._save(finished, results)
+        with self._lock:
+            self._jobs[job.id] = (finished, None if saved else results)
+
+    def _path(self, job_id, extension='job'):
+        return os.path.join(self.result_dir, '%s.%s' % (job_id, extension))
+
+    def _dump(self, value, path):
+        fd, temp_path = tempfile.mkstemp(dir=self.result_dir, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as dump_file:
+                pickle.dump(value, dump_file, pickle.HIGHEST_PROTOCOL)
+            os.rename(temp_path, path)
+        except Exception:
+            os.remove(temp_path)
+            raise
+
+    def _save(self, job, results):
+        """
+        Save results and then job, so a saved job always has its results.
+
+        :return: True if both were saved
+        """
+        if self.result_dir is None:
+            return False
+
+        try:
+            if results is not None:
+                self._dump(results, self._path(job.id, 'result'))
+            self._dump(job, self._path(job.id))
+            return True
+        except Exception:
+            self.logger.warn("Could not save the results of job %s, keeping them in memory only" % job.id,
+                             exc_info=True)
+            return False
+
+    def _load(self, job_id, extension):
+        path = self._path(job_id, extension)
+        if not os.path.exists(path):
+            return None
+
+        try:
+            with open(path, 'rb') as job_file:
+                return pickle.load(job_file)
+        except Exception:
+            self.logger.warn("Could not load %s" % path, exc_info=True)
+            return None
+
+    def get(self, job_id):
+        """
+        :return: The Job with job_id, or None if there is no such job or it has expired. Its results are not loaded.
+        """
+        self._remove_expired_jobs()
+
+        with self._lock:
+            entry = self._jobs.get(job_id)
+        if entry is not None:
+            return entry[0]
+
+        if self.result_dir is None:
+            return None
+
+        # A job saved by an earlier process
+        job = self._load(job_id, 'job')
+        if job is None or self._expired(job):
+            return None
+        with self._lock:
+            self._jobs.setdefault(job_id, (job, None))
+        return job
+
+    def get_results(self, job_id):
+        """
+        :return: The results of the job with job_id, or None if there are none, such as for jobs that have not
+                 succeeded
+        """
+        with self._lock:
+            entry = self._jobs.get(job_id)
+        if entry is not None and entry[1] is not None:
+            return entry[1]
+
+        if self.result_dir is None:
+            return None
+        return self._load(job_id, 'result')
+
+    def _expired(self, job):
+        return job.is_finished() and time.time() - job.finished > self.ttl_seconds
+
+    def _remove_expired_jobs(self):
+        with self._lock:
+            expired = [job_id for job_id, (job, _) in self._jobs.iteritems() if self._expired(job)]
+            for job_id in expired:
+                del self._jobs[job_id]
+
+    def remove_expired(self):
+        """
+        Remove the expired jobs from memory and from result_dir.
+        """
+        self._remove_expired_jobs()
+
+        if self.result_dir is None:
+            return
+
+        for file_name in os.listdir(self.result_dir):
+            path = os.path.join(self.result_dir, file_name)
+            try:
+                if file_name.endswith(('.job', '.result')) and time.time() - os.path.getmtime(path) > self.ttl_seconds:
+                    os.remove(path)
+            except OSError:
+                pass
@@ -0,0 +1,254 @@
+"""
+Copyright (c) 2016 Jet Propulsion Laboratory,
+California Institute of Technology.  All rights reserved
+"""
+import cPickle as pickle
+import hashlib
+import logging
+import os
+import tempfile
+import threading
+import time
+from collections import namedtuple, OrderedDict
+
+from nexustiles.cache import LRUCache
+
+# Arguments that do not change the response, such as the cache buster added by jQuery
+IGNORED_ARGUMENTS = ('_',)
+
+CachedResponse = namedtuple('CachedResponse', 'content_type body insert_times expires')
+# Responses cached before expires was added do not expire
+CachedResponse.__new__.__defaults__ = (None,)
+
+
+def cache_key(path, arguments, content_type):
+    """
+    Key of the response to a request for path with the given query arguments (a dict of name to list of values, as in
+    tornado's request.arguments) in content_type. Argument order and surrounding white space do not matter.
+    """
+    normalized = sorted((name, tuple(value.strip() for value in values)) for name, values in arguments.iteritems()
+                        if name not in IGNORED_ARGUMENTS)
+    return hashlib.sha1(repr((path, normalized, content_type.upper()))).hexdigest()
+
+
+class DiskCache(object):
+    """
+    Pickled values in files of directory, removed least recently used first once they add up to more than max_bytes.
+    """
+
+    def __init__(self, directory, max_bytes):
+        self.directory = directory
+        self.max_bytes = max_bytes
+
+        self._lock = threading.Lock()
+        # key -> size of its file, least recently used first
+        self._files = OrderedDict()
+        self._size_bytes = 0
+        self._hits = 0
+        self._misses = 0
+
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+
+        # Pick up the files left by a previous run, oldest first
+        entries = []
+        for file_name in os.listdir(directory):
+            if file_name.endswith('.pickle'):
+                stat = os.stat(os.path.join(directory, file_name))
+                entries.append((stat.st_mtime, file_name[:-len('.pickle')], stat.st_size))
+        for _, key, size in sorted(entries):
+            self._files[key] = size
+            self._size_bytes += size
+        self._evict()
+
+    def _path(self, key):
+        return os.path.join(self.directory, '%s.pickle' % key)
+
+    def get(self, key):
+        with self._lock:
+            if key not in self._files:
+                self._misses += 1
+                return None
+            self._files[key] = self._files.pop(key)
+
+        try:
+            with open(self._path(key), 'rb') as cache_file:
+                value = pickle.load(cache_file)
+            os.utime(self._path(key), None)
+        except (IOError, OSError, EOFError, pickle.UnpicklingError):
+            self.delete(key)
+            with self._lock:
+                self._misses += 1
+            return None
+
+        with self._lock:
+            self._hits += 1
+        return value
+
+    def put(self, key, value):
+        fd, temp_path = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+        with os.fdopen(fd, 'wb') as cache_file:
+            pickle.dump(value, cache_file, pickle.HIGHEST_PROTOCOL)
+        size = os.path.getsize(temp_path)
+
+        if size > self.max_bytes:
+            os.remove(temp_path)
+            return
+
+        os.rename(temp_path, self._path(key))
+        with self._lock:
+            self._size_bytes += size - self._files.pop(key, 0)
+            self._files[key] = size
+            self._evict()
+
+    def delete(self, key):
+        with self._lock:
+            if key not in self._files:
+                return
+            self._size_bytes -= self._files.pop(key)
+            self._remove(key)
+
+    def _evict(self):
+        while self._size_bytes > self.max_bytes:
+            key, size = self._files.popitem(last=False)
+            self._size_bytes -= size
+            self._remove(key)
+
+    def _remove(self, key):
+        try:
+            os.remove(self._path(key))
+        except OSError:
+            pass
+
+    def stats(self):
+        with self._lock:
+            return {
+                "hits": self._hits,
+                "misses": self._misses,
+                "entries": len(self._files),
+                "size_bytes": self._size_bytes,
+                "max_size_bytes": self.max_bytes
+            }
+
+
+class ResponseCache(object):
+    """
+    Cache of rendered responses, held in an in-memory LRU tier and, if disk_dir is given, an on-disk tier that
+    responses evicted from memory are still found in.
+
+    Each response is stored with the insert time of the most recently ingested tile of every dataset named in the
+    request arguments. A cached response is used only while those insert times are unchanged, so responses are
+    invalidated dataset by dataset as new tiles are ingested. The insert times are read from Solr at most every
+    check_seconds.
+
+    When the insert time of a dataset changes, the Solr query caches of the dataset are cleared in this process, so the
+    response is calculated again from the new tiles. Worker processes keep their cached searches until they expire, so
+    responses calculated within the query cache TTL of the tile service after the change also expire at its end.
+
+    :param tile_service: NexusTileService used to read the insert times
+    :param memory_bytes: Size limit of the in-memory tier
+    :param disk_dir: Directory of the on-disk tier, None to disable it
+    :param disk_bytes: Size limit of the on-disk tier
+    :param check_seconds: Seconds between reads of the insert times
+    """
+
+    def __init__(self, tile_service, memory_bytes, disk_dir=None, disk_bytes=0, check_seconds=60):
+        self.check_seconds = check_seconds
+        self.logger = logging.getLogger('nexus')
+
+        self._tile_service = tile_service
+        self._memory = LRUCache(memory_bytes, lambda response: len(response.body))
+        self._disk = DiskCache(disk_dir, disk_bytes) if disk_dir else None
+
+        self._lock = threading.Lock()
+        self._insert_times = {}
+        self._checked = None
+        # dataset -> time a change of its insert time was seen
+        self._changed = {}
+
+    def _last_insert_times(self):
+        with self._lock:
+            if self._checked is not None and time.time() - self._checked < self.check_seconds:
+                return self._insert_times
+            # Other threads keep using the old insert times while this one reads them
+            self._checked = time.time()
+
+        try:
+            insert_times = self._tile_service.get_last_insert_times()
+        except Exception:
+            self.logger.exception("Could not read the last insert times of the datasets")
+            return self._insert_times
+
+        with self._lock:
+            changed = [name for name, insert_time in insert_times.iteritems()
+                       if self._insert_times.get(name) != insert_time] if self._insert_times else []
+            self._insert_times = insert_times
+            for name in changed:
+                self._changed[name] = self._checked
+
+        for name in changed:
+            self.logger.info("Tiles of %s were ingested, clearing its cached searches" % name)
+            self._tile_service.invalidate_query_caches(name)
+        return insert_times
+
+    def insert_times(self, arguments):
+        """
+        :return: dict of each dataset named in the values of arguments to the insert time of its latest tile
+        """
+        last_insert_times = self._last_insert_times()
+        names = set(name.strip() for values in arguments.itervalues() for value in values for name in value.split(','))
+        return {name: last_insert_times[name] for name in names if name in last_insert_times}
+
+    def get(self, key, insert_times):
+        """
+        :return: CachedResponse stored under key with the given insert times, or None
+        """
+        response = self._memory.get(key)
+        if response is None and self._disk is not None:
+            response = self._disk.get(key)
+            if response is not None:
+                self._memory.put(key, response)
+
+        if response is None:
+            return None
+        if response.insert_times != insert_times or (response.expires is not None and time.time() > response.expires):
+            self.delete(key)
+            return None
+        return response
+
+    def _expires(self, insert_times, started):
+        """
+        :return: Time a response with the datasets of insert_times whose calculation started at started expires, or
+                 None if it does not
+        """
+        query_cache_ttl = self._tile_service.get_query_cache_ttl()
+        if not query_cache_ttl:
+            # Without a TTL cached searches are only cleared in this process
+            return None
+
+        with self._lock:
+            fresh_from = [self._changed[name] + query_cache_ttl for name in insert_times if name in self._changed]
+        fresh_from = [fresh for fresh in fresh_from if fresh > started]
+        return max(fresh_from) if fresh_from else None
+
+    def put(self, key, content_type, body, insert_times, started=None):
+        """
+        Store a response calculated with the given insert times. started is the time its calculation started, now if
+        not given.
+        """
+        started = time.time() if started is None else started
+        response = CachedResponse(content_type, body, insert_times, self._expires(insert_times, started))
+        self._memory.put(key, response)
+        if self._disk is not None:
+            self._disk.put(key, response)
+
+    def delete(self, key):
+        self._memory.delete(key)
+        if self._disk is not None:
+            self._disk.delete(key)
+
+    def stats(self):
+        return {
+            "memory": self._memory.stats()._asdict(),
+            "disk": self._disk.stats() if self._disk is not None else None
+        }
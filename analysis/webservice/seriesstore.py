@@ -0,0 +1,170 @@
+"""
+Copyright (c) 2016 Jet Propulsion Laboratory,
+California Institute of Technology.  All rights reserved
+"""
+import ConfigParser
+import hashlib
+import logging
+import os
+import tempfile
+import threading
+import time
+from datetime import datetime
+from itertools import groupby
+
+import numpy as np
+
+# Increase when the stats stored for a day change so stores written by older versions are not used
+STORE_VERSION = 1
+
+# Columns of the stored stats of each day. min, max and std are NaN for days without data in the region.
+COLUMNS = ('time', 'min', 'max', 'mean', 'std', 'cnt')
+
+# Tiles inserted this many seconds before a store was last updated are still treated as re-ingested, to allow for the
+# time a tile takes to become visible in Solr and for clock differences with the ingest hosts
+REINGEST_OVERLAP_SECONDS = 300
+
+# SeriesStores shared by the process by directory, see get_series_store
+_series_stores = {}
+_series_stores_lock = threading.Lock()
+
+
+def get_series_store(config):
+    """
+    Return the SeriesStore of the directory set in the [seriesstore] section of config, shared by every caller in the
+    process, or None if it is not set.
+    """
+    try:
+        directory = config.get("seriesstore", "directory")
+    except (ConfigParser.Error, AttributeError):
+        return None
+    if not directory:
+        return None
+
+    with _series_stores_lock:
+        if directory not in _series_stores:
+            _series_stores[directory] = SeriesStore(directory)
+        return _series_stores[directory]
+
+
+def region_key(dataset, min_lat, max_lat, min_lon, max_lon):
+    """
+    Key of the stats of dataset in a box. Coordinates are rounded to a millionth of a degree so the same box given as
+    1, 1.0 or 1.0000000001 shares its stats.
+    """
+    bounds = tuple(round(float(value), 6) for value in (min_lat, max_lat, min_lon, max_lon))
+    return hashlib.sha1(repr((STORE_VERSION, dataset.strip(), bounds))).hexdigest()
+
+
+class SeriesStore(object):
+    """
+    Per-day stats of regions of datasets, in one compressed file of COLUMNS arrays per region in directory.
+
+    daily_stats calculates only the days of a request that are not stored yet, or whose tiles were ingested again since
+    they were stored, and merges them into the file, so the daily re-request of a long series only calculates the
+    newest day. Files are replaced atomically, so several processes can share the directory.
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+        self.logger = logging.getLogger('nexus')
+
+        self._locks = {}
+        self._locks_lock = threading.Lock()
+
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+
+    def _path(self, key):
+        return os.path.join(self.directory, '%s.npz' % key)
+
+    def _lock_for(self, key):
+        with self._locks_lock:
+            return self._locks.setdefault(key, threading.Lock())
+
+    def load(self, key):
+        """
+        :return: Tuple of the dict of each stored day to its stats and the time the stats were last updated, or None
+                 if nothing is stored for key
+        """
+        try:
+            with np.load(self._path(key)) as stored:
+                columns = {name: stored[name] for name in COLUMNS}
+                updated = stored['updated'].item()
+        except IOError:
+            return None
+        except Exception:
+            self.logger.warn("Ignoring unreadable series store file %s" % self._path(key), exc_info=True)
+            return None
+
+        stats_by_day = {}
+        for i, day in enumerate(columns['time'].tolist()):
+            stats_by_day[day] = {name: columns[name][i].item() for name in COLUMNS}
+        return stats_by_day, updated
+
+    def save(self, key, stats_by_day, updated):
+        days = sorted(stats_by_day.keys())
+        columns = {
+            'time': np.array(days, dtype=np.int64),
+            'cnt': np.array([stats_by_day[day]['cnt'] for day in days], dtype=np.int64)
+        }
+        for name in ('min', 'max', 'mean', 'std'):
+            columns[name] = np.array([stats_by_day[day][name] for day in days], dtype=np.float64)
+
+        fd, temp_path = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as store_file:
+                np.savez_compressed(store_file, updated=np.float64(updated), **columns)
+            os.rename(temp_path, self._path(key))
+        except Exception:
+            os.remove(temp_path)
+            raise
+
+    def daily_stats(self, key, days, calc_days, find_reingested_days):
+        """
+        Stats of each of days, a sorted list of seconds since the epoch, calculated by calc_days or read from the store.
+
+        :param calc_days: Function of a sorted list of days to the list of their stats, dicts of COLUMNS
+        :param find_reingested_days: Function of a datetime to the set of days with tiles inserted after it
+        :return: List of new dicts of the stats of each day, in the order of days. min, max and std are np.ma.masked
+                 for days without data.
+        """
+        with self._lock_for(key):
+            started = time.time()
+
+            stored = self.load(key)
+            if stored is None:
+                stats_by_day, reingested = {}, set()
+            else:
+                stats_by_day, updated = stored
+                reingested = set(int(day) for day in find_reingested_days(
+                    datetime.utcfromtimestamp(updated - REINGEST_OVERLAP_SECONDS)))
+
+            missing = [day for day in days if int(day) not in stats_by_day or int(day) in reingested]
+            self.logger.info("%d of %d days of %s are stored, calculating %d" % (
+                len(days) - len(missing), len(days), key, len(missing)))
+
+            if len(missing) > 0:
+                for run in self._consecutive_runs(days, missing):
+                    for stat in calc_days(run):
+                        stats_by_day[stat['time']] = {name: np.nan if stat[name] is np.ma.masked else stat[name]
+                                                      for name in COLUMNS}
+                self.save(key, stats_by_day, started)
+
+        results = []
+        for day in days:
+            stat = dict(stats_by_day[int(day)])
+            for name in ('min', 'max', 'std'):
+                if np.isnan(stat[name]):
+                    stat[name] = np.ma.masked
+            results.append(stat)
+        return results
+
+    @staticmethod
+    def _consecutive_runs(days, missing):
+        """
+        Split missing, a subset of days, into runs of days that are next to each other in days, so each run is
+        calculated from one range of tiles.
+        """
+        missing = set(missing)
+        return [list(run) for is_missing, run in groupby(days, lambda day: day in missing) if is_missing]
@@ -0,0 +1,252 @@
+"""
+Copyright (c) 2016 Jet Propulsion Laboratory,
+California Institute of Technology.  All rights reserved
+"""
+import atexit
+import errno
+import logging
+import mmap
+import os
+import tempfile
+import threading
+import time
+from collections import namedtuple, OrderedDict
+
+import numpy as np
+from nexustiles.model.nexusmodel import Tile
+
+ARENA_DIR = '/dev/shm' if os.path.isdir('/dev/shm') else tempfile.gettempdir()
+ARENA_PREFIX = 'nexus-arena-'
+ALIGNMENT = 64
+
+# Arenas a worker keeps mapped until detach_arenas, most recently used last
+MAX_ATTACHED_ARENAS = 8
+
+ArrayHandle = namedtuple('ArrayHandle', 'name offset shape dtype')
+MaskedArrayHandle = namedtuple('MaskedArrayHandle', 'data mask')
+SharedTile = namedtuple('SharedTile', 'latitudes longitudes times data swath_shape')
+
+_open_arenas = {}
+_open_arenas_lock = threading.Lock()
+_attached = OrderedDict()
+
+
+def _aligned(size):
+    return (size + ALIGNMENT - 1) // ALIGNMENT * ALIGNMENT
+
+
+def _masked_nbytes(array):
+    nbytes = _aligned(np.ma.getdata(array).nbytes)
+    if np.ma.getmask(array) is not np.ma.nomask:
+        nbytes += _aligned(array.size)
+    return nbytes
+
+
+def tile_nbytes(tile):
+    """
+    Bytes of arena needed by put_tile(tile).
+    """
+    return sum(_masked_nbytes(array) for array in (tile.latitudes, tile.longitudes, tile.times, tile.data))
+
+
+class SharedArena(object):
+    """
+    A block of shared memory, a file in /dev/shm, that arrays are copied into once so other processes can map them
+    without pickling. Arrays are placed one after the other and freed all at once by close.
+
+    The creating process owns the arena and must close it, ideally with a with statement. Arenas that are garbage
+    collected or still open at exit without having been closed are logged as leaks and removed. remove_stale_arenas
+    removes the arenas left in /dev/shm by processes that no longer exist.
+
+    :param size: Size of the arena in bytes
+    """
+
+    def __init__(self, size):
+        self.size = max(size, 1)
+        self.logger = logging.getLogger('nexus')
+
+        fd, self.name = tempfile.mkstemp(prefix='%s%d-' % (ARENA_PREFIX, os.getpid()), dir=ARENA_DIR)
+        try:
+            os.ftruncate(fd, self.size)
+            self._mmap = mmap.mmap(fd, self.size)
+        finally:
+            os.close(fd)
+
+        self._offset = 0
+        self._pid = os.getpid()
+
+        with _open_arenas_lock:
+            _open_arenas[self.name] = (self._pid, self.size, time.time())
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def __del__(self):
+        # Arenas inherited by forked processes belong to the parent
+        if getattr(self, 'name', None) in _open_arenas and self._pid == os.getpid():
+            self.logger.warn("Arena %s of %d bytes was collected without being closed" % (self.name, self.size))
+            self.close()
+
+    def close(self):
+        with _open_arenas_lock:
+            if _open_arenas.pop(self.name, None) is None:
+                return
+
+        self._mmap.close()
+        try:
+            os.unlink(self.name)
+        except OSError as e:
+            if e.errno != errno.ENOENT:
+                raise
+
+    def put(self, array):
+        """
+        Copy array into the arena.
+
+        :return: ArrayHandle of the copy
+        """
+        array = np.asarray(array)
+        offset = self._offset
+        if offset + array.nbytes > self.size:
+            raise ValueError("Arena %s is full, %d of %d bytes used" % (self.name, offset, self.size))
+
+        copy = np.ndarray(array.shape, dtype=array.dtype, buffer=self._mmap, offset=offset)
+        copy[...] = array
+        self._offset = offset + _aligned(array.nbytes)
+
+        return ArrayHandle(self.name, offset, array.shape, array.dtype.str)
+
+    def put_masked(self, array):
+        """
+        Copy the data and, if there is one, the mask of masked array into the arena.
+
+        :return: MaskedArrayHandle of the copy
+        """
+        mask = np.ma.getmask(array)
+        return MaskedArrayHandle(self.put(np.ma.getdata(array)),
+                                 self.put(mask) if mask is not np.ma.nomask else None)
+
+    def put_tile(self, tile):
+        """
+        Copy the coordinates and data of tile into the arena.
+
+        :return: SharedTile that get_tile turns back into a Tile
+        """
+        return SharedTile(self.put_masked(tile.latitudes), self.put_masked(tile.longitudes),
+                          self.put_masked(tile.times), self.put_masked(tile.data), tile.swath_shape)
+
+
+def _arena_buffer(name):
+    if name in _attached:
+        _attached[name] = _attached.pop(name)
+        return _attached[name]
+
+    # An arena closed by its owner stays in memory for as long as it is mapped
+    for closed_name in [attached_name for attached_name in _attached if not os.path.exists(attached_name)]:
+        del _attached[closed_name]
+
+    with open(name, 'rb') as arena_file:
+        arena_mmap = mmap.mmap(arena_file.fileno(), 0, access=mmap.ACCESS_READ)
+
+    # Arrays of an arena that is no longer attached keep its mmap, and the memory, until they are collected
+    _attached[name] = arena_mmap
+    while len(_attached) > MAX_ATTACHED_ARENAS:
+        _attached.popitem(last=False)
+
+    return arena_mmap
+
+
+def detach_arenas():
+    """
+    Drop the mappings of the arenas attached to by get_array in this process. The memory of an arena is freed once its
+    owner closed it and no process maps it, so call this when done with the arrays of a task. Arrays still referenced
+    keep their mapping until they are collected.
+    """
+    _attached.clear()
+
+
+def get_array(handle):
+    """
+    :return: Read only array backed by the shared memory of handle
+    """
+    return np.ndarray(handle.shape, dtype=np.dtype(handle.dtype), buffer=_arena_buffer(handle.name),
+                      offset=handle.offset)
+
+
+def get_masked_array(handle):
+    mask = get_array(handle.mask) if handle.mask is not None else np.ma.nomask
+    return np.ma.array(get_array(handle.data), mask=mask, copy=False)
+
+
+def get_tile(shared_tile):
+    """
+    :return: Tile with the coordinates and data of shared_tile, backed by shared memory
+    """
+    tile = Tile()
+    tile.latitudes = get_masked_array(shared_tile.latitudes)
+    tile.longitudes = get_masked_array(shared_tile.longitudes)
+    tile.times = get_masked_array(shared_tile.times)
+    tile.data = get_masked_array(shared_tile.data)
+    tile.swath_shape = shared_tile.swath_shape
+    return tile
+
+
+def open_arenas():
+    """
+    :return: dict of the name of each arena open in this process to its age in seconds
+    """
+    now = time.time()
+    with _open_arenas_lock:
+        return {name: now - created for name, (pid, size, created) in _open_arenas.iteritems() if pid == os.getpid()}
+
+
+def remove_stale_arenas():
+    """
+    Remove the arenas left behind by processes that no longer exist.
+
+    :return: Names of the removed arenas
+    """
+    removed = []
+    for file_name in os.listdir(ARENA_DIR):
+        if not file_name.startswith(ARENA_PREFIX):
+            continue
+
+        try:
+            pid = int(file_name[len(ARENA_PREFIX):].split('-')[0])
+            os.kill(pid, 0)
+        except ValueError:
+            continue
+        except OSError as e:
+            if e.errno != errno.ESRCH:
+                continue
+
+            name = os.path.join(ARENA_DIR, file_name)
+            logging.getLogger('nexus').warn("Removing arena %s of process %d that no longer exists" % (name, pid))
+            try:
+                os.unlink(name)
+                removed.append(name)
+            except OSError:
+                pass
+
+    return removed
+
+
+@atexit.register
+def _close_open_arenas():
+    with _open_arenas_lock:
+        arenas = _open_arenas.items()
+        _open_arenas.clear()
+
+    for name, (pid, size, created) in arenas:
+        # Arenas inherited by forked processes belong to the parent
+        if pid != os.getpid():
+            continue
+
+        logging.getLogger('nexus').warn("Arena %s of %d bytes was never closed" % (name, size))
+        try:
+            os.unlink(name)
+        except OSError:
+            pass
@@ -8,13 +8,22 @@ import logging
 import sys
 import importlib
 import threading
+import time
 
 import matplotlib
 import tornado.web
+from nexustiles.nexustiles import get_tile_service
+from nexustiles.tracing import Histogram, current_trace, end_trace, render_metrics, span, start_trace
 from tornado.options import define, options, parse_command_line
 
-from webmodel import NexusRequestObject, NexusResults, NexusProcessingException
+from executor import ExecutorRegistry
+from responsecache import ResponseCache, cache_key
+from webmodel import NexusRequestObject, NexusResults, NexusProcessingException, StoredRequestObject
 from webservice import NexusHandler
+from webservice.jobs import Job, JobManager
+from webservice.sharedarrays import open_arenas, remove_stale_arenas
+from webservice.webmodel import StreamingResults
+from webservice.workerpool import start_worker_pool
 
 matplotlib.use('Agg')
 
@@ -27,11 +36,54 @@ class ContentTypes(object):
     NETCDF = "NETCDF"
 
 
+# Streamed results are flushed to the client every STREAM_FLUSH_RECORDS records or STREAM_FLUSH_SECONDS seconds
+STREAM_FLUSH_RECORDS = 1000
+STREAM_FLUSH_SECONDS = 1.0
+
+request_seconds = Histogram('nexus_request_seconds', "Seconds from the start of a request until its response was done",
+                            'path')
+
+
+def render_results(results, content_type):
+    """
+    :return: Tuple of the mime type and body of results in content_type, or (None, None) for unknown content types
+    """
+    if content_type == ContentTypes.JSON:
+        try:
+            return "application/json", results.toJson()
+        except AttributeError:
+            return "application/json", json.dumps(results, indent=4)
+    elif content_type == ContentTypes.PNG:
+        try:
+            return "image/png", results.toImage()
+        except AttributeError:
+            raise NexusProcessingException(reason="Unable to convert results to an Image.")
+    elif content_type == ContentTypes.CSV:
+        try:
+            return "text/csv", results.toCSV()
+        except:
+            raise NexusProcessingException(reason="Unable to convert results to CSV.")
+    elif content_type == ContentTypes.NETCDF:
+        try:
+            return "application/x-netcdf", results.toNetCDF()
+        except:
+            raise NexusProcessingException(reason="Unable to convert results to NetCDF.")
+
+    return None, None
+
+
 class BaseHandler(tornado.web.RequestHandler):
     path = r"/"
+    # Send the spans of each request in a Server-Timing header, set from the [tracing] section of web.ini
+    server_timing = False
 
-    def initialize(self):
+    def initialize(self, executors):
         self.logger = logging.getLogger('nexus')
+        self.executors = executors
+        self.io_loop = tornado.ioloop.IOLoop.current()
+        self.closed = False
+        self._flushed = threading.Event()
+        self._flushed.set()
 
     # def __toCSV(self, data):
     #     data0 = []
@@ -84,29 +136,44 @@ class BaseHandler(tornado.web.RequestHandler):
     #     }
     #     return meta
 
+    def executor_path(self):
+        """
+        Path of the RequestExecutor that runs the requests of this handler
+        """
+        return self.request.path
+
     @tornado.web.asynchronous
-    def get(self):
-        class T(threading.Thread):
-
-            def __init__(self, context):
-                threading.Thread.__init__(self)
-                self.context = context
-                self.logger = logging.getLogger(__name__)
-
-            def run(self):
-                try:
-                    self.context.set_header("Access-Control-Allow-Origin", "*")
-                    reqObject = NexusRequestObject(self.context)
-                    results = self.context.do_get(reqObject)
-                    self.context.async_callback(results)
-                except NexusProcessingException as e:
-                    self.logger.error("Error processing request", exc_info=True)
-                    self.context.async_onerror_callback(e.reason, e.code)
-                except Exception as e:
-                    self.logger.error("Error processing request", exc_info=True)
-                    self.context.async_onerror_callback(str(e), 500)
-
-        t = T(self).start()
+    def get(self, *args):
+        executor = self.executors.get(self.executor_path())
+        if not executor.submit(self._run):
+            stats = executor.stats()
+            self.logger.warn("Rejected request for %s, %d requests running and %d queued" % (
+                self.request.path, stats['running'], stats['queued']))
+            self.set_header("Retry-After", str(self.executors.retry_after))
+            self.async_onerror_callback("Too many requests for %s, try again later" % self.request.path, 503)
+
+    def _run(self):
+        trace = start_trace(self.request.path)
+        try:
+            self.set_header("Access-Control-Allow-Origin", "*")
+            reqObject = NexusRequestObject(self)
+            results = self.do_get(reqObject)
+            self.async_callback(results)
+        except NexusProcessingException as e:
+            self.logger.error("Error processing request", exc_info=True)
+            self.async_onerror_callback(e.reason, e.code)
+        except Exception as e:
+            self.logger.error("Error processing request", exc_info=True)
+            self.async_onerror_callback(str(e), 500)
+        finally:
+            end_trace()
+            request_seconds.observe(self.executor_path(), trace.elapsed())
+            self.logger.info("Request %s" % trace.summary())
+
+    def set_timing_header(self):
+        trace = current_trace()
+        if self.server_timing and trace is not None:
+            self.set_header("Server-Timing", trace.server_timing())
 
     def async_onerror_callback(self, reason, code=500):
         self.set_header("Content-Type", "application/json")
@@ -118,10 +185,49 @@ class BaseHandler(tornado.web.RequestHandler):
         }
 
         self.write(json.dumps(response, indent=5))
+        self.set_timing_header()
         self.finish()
 
     def async_callback(self, results):
-        self.finish()
+        if not self.closed:
+            self.set_timing_header()
+            self.finish()
+
+    def on_connection_close(self):
+        self.closed = True
+        self._flushed.set()
+
+    def write_chunk(self, chunk):
+        """
+        Write chunk and flush it to the client from a request thread. Waits until the previous chunk was sent, so a
+        slow client holds back the calculation instead of filling up memory.
+
+        :return: False if the client has gone away
+        """
+        self._flushed.wait()
+        if self.closed:
+            return False
+
+        self._flushed.clear()
+        self.io_loop.add_callback(self._write_and_flush, chunk)
+        return True
+
+    def wait_flushed(self):
+        self._flushed.wait()
+
+    def _write_and_flush(self, chunk):
+        try:
+            self.write(chunk)
+            future = self.flush()
+        except Exception:
+            self.logger.warn("Could not write to the client of %s" % self.request.path, exc_info=True)
+            self.on_connection_close()
+            return
+
+        if future is None:
+            self._flushed.set()
+        else:
+            future.add_done_callback(lambda _: self._flushed.set())
 
     ''' Override me for standard handlers! '''
 
@@ -130,39 +236,212 @@ class BaseHandler(tornado.web.RequestHandler):
 
 
 class ModularNexusHandlerWrapper(BaseHandler):
-    def initialize(self, clazz, algorithm_config):
+    def initialize(self, clazz, algorithm_config, executors, response_cache=None):
+        BaseHandler.initialize(self, executors)
         self.algorithm_config = algorithm_config
         self.__clazz = clazz
+        self.__response_cache = response_cache if clazz.cacheable() else None
 
     def do_get(self, request):
-        instance = self.__clazz.instance(self.algorithm_config)
+        content_type = request.get_content_type()
+
+        if self.__response_cache is not None:
+            # Read the insert times before calculating so a response is never newer than its insert times
+            key = cache_key(self.request.path, self.request.arguments, content_type)
+            insert_times = self.__response_cache.insert_times(self.request.arguments)
+            response = self.__response_cache.get(key, insert_times)
+            if response is not None:
+                self.set_header("Content-Type", response.content_type)
+                self.set_header("X-Nexus-Cache", "hit")
+                self.write(response.body)
+                return
 
-        results = instance.calc(request)
+        instance = self.__clazz.instance(self.algorithm_config)
 
-        if request.get_content_type() == ContentTypes.JSON:
+        started = time.time()
+        with span('calc'):
+            results = instance.calc(request)
+
+        if isinstance(results, StreamingResults) and content_type in (ContentTypes.JSON, ContentTypes.CSV):
+            with span('stream'):
+                self.stream_results(results, content_type)
+            return
+
+        with span('render'):
+            mime_type, body = render_results(results, content_type)
+        if body is None:
+            return
+
+        self.set_header("Content-Type", mime_type)
+        self.write(body)
+
+        if self.__response_cache is not None:
+            self.set_header("X-Nexus-Cache", "miss")
+            self.__response_cache.put(key, mime_type, body, insert_times, started=started)
+
+    def stream_results(self, results, content_type):
+        """
+        Send the records of results as they are produced, as a chunked JSON document or CSV rows. Streamed responses
+        are not cached.
+        """
+        if content_type == ContentTypes.JSON:
             self.set_header("Content-Type", "application/json")
-            try:
-                self.write(results.toJson())
-            except AttributeError:
-                self.write(json.dumps(results, indent=4))
-        elif request.get_content_type() == ContentTypes.PNG:
-            self.set_header("Content-Type", "image/png")
-            try:
-                self.write(results.toImage())
-            except AttributeError:
-                raise NexusProcessingException(reason="Unable to convert results to an Image.")
-        elif request.get_content_type() == ContentTypes.CSV:
+            pieces = results.iterJson()
+        else:
             self.set_header("Content-Type", "text/csv")
-            try:
-                self.write(results.toCSV())
-            except:
-                raise NexusProcessingException(reason="Unable to convert results to CSV.")
-        elif request.get_content_type() == ContentTypes.NETCDF:
-            self.set_header("Content-Type", "application/x-netcdf")
-            try:
-                self.write(results.toNetCDF())
-            except:
-                raise NexusProcessingException(reason="Unable to convert results to NetCDF.")
+            pieces = results.iterCSV()
+
+        sent = False
+        buffered = []
+        last_flush = time.time()
+        try:
+            for piece in pieces:
+                buffered.append(piece)
+                if len(buffered) >= STREAM_FLUSH_RECORDS or time.time() - last_flush >= STREAM_FLUSH_SECONDS:
+                    if not self.write_chunk(''.join(buffered)):
+                        self.logger.info("Client of %s went away, stopped streaming" % self.request.path)
+                        return
+                    sent = True
+                    buffered = []
+                    last_flush = time.time()
+
+            self.write_chunk(''.join(buffered))
+            self.wait_flushed()
+        except Exception:
+            if not sent:
+                raise
+
+            # The status has been sent, cutting the response short is the only way left to tell the client
+            self.logger.error("Error streaming results of %s" % self.request.path, exc_info=True)
+            self.closed = True
+            self.io_loop.add_callback(self.request.connection.close)
+        finally:
+            # Stops the tile reads of records that are no longer needed
+            pieces.close()
+
+
+class JobSubmitHandler(BaseHandler):
+    """
+    Submits the calc of a handler as a job, with the same arguments as the handler itself, and returns the job status.
+    """
+
+    def initialize(self, clazz, algorithm_config, executors, jobs):
+        BaseHandler.initialize(self, executors)
+        self.algorithm_config = algorithm_config
+        self.__clazz = clazz
+        self.__jobs = jobs
+
+    def executor_path(self):
+        return JobStatusHandler.path
+
+    def do_get(self, request):
+        job = self.__jobs.submit(self.__clazz, self.algorithm_config, StoredRequestObject(self))
+        if job is None:
+            self.set_header("Retry-After", str(self.executors.retry_after))
+            raise NexusProcessingException(reason="Too many requests for %s, try again later" % self.__clazz.path(),
+                                           code=503)
+
+        self.set_status(202)
+        self.set_header("Location", "/jobs/%s" % job.id)
+        self.set_header("Content-Type", "application/json")
+        self.write(json.dumps(job.to_dict(), indent=4))
+
+
+class JobStatusHandler(BaseHandler):
+    path = r"/jobs/([0-9a-f]{32})"
+
+    def initialize(self, executors, jobs):
+        BaseHandler.initialize(self, executors)
+        self.jobs = jobs
+
+    def executor_path(self):
+        return JobStatusHandler.path
+
+    def get_job(self):
+        job = self.jobs.get(self.path_args[0])
+        if job is None:
+            raise NexusProcessingException(reason="Job %s not found or expired" % self.path_args[0], code=404)
+        return job
+
+    def do_get(self, request):
+        job = self.get_job()
+
+        self.set_header("Content-Type", "application/json")
+        self.write(json.dumps(job.to_dict(), indent=4))
+
+
+class JobResultHandler(JobStatusHandler):
+    """
+    Result of a job in the format of the output argument. Returns the job status with code 202 while the job is queued
+    or running, and the error of the job if it failed.
+    """
+    path = r"/jobs/([0-9a-f]{32})/result"
+
+    def do_get(self, request):
+        job = self.get_job()
+
+        if job.status == Job.FAILED:
+            raise NexusProcessingException(reason=job.error, code=job.code)
+        elif job.status != Job.SUCCEEDED:
+            self.set_status(202)
+            JobStatusHandler.do_get(self, request)
+            return
+
+        results = self.jobs.get_results(job.id)
+        if results is None:
+            raise NexusProcessingException(reason="Results of job %s not found or expired" % job.id, code=404)
+
+        mime_type, body = render_results(results, request.get_content_type())
+        if body is None:
+            raise NexusProcessingException(reason="Unsupported output %s" % request.get_content_type(), code=400)
+
+        self.set_header("Content-Type", mime_type)
+        self.write(body)
+
+
+class MetricsHandler(tornado.web.RequestHandler):
+    """
+    Spans, counters and request latencies of this process, and the state of its executors, response cache and shared
+    memory arenas, in the Prometheus text format.
+    """
+    path = r"/metrics"
+
+    def initialize(self, executors, response_cache=None):
+        self.executors = executors
+        self.response_cache = response_cache
+
+    def get(self):
+        lines = request_seconds.render()
+
+        executor_stats = self.executors.stats()
+        for stat in ('running', 'queued', 'completed', 'rejected'):
+            lines.append("# TYPE nexus_executor_%s gauge" % stat)
+            lines.extend('nexus_executor_%s{path="%s"} %d' % (stat, path, stats[stat])
+                         for path, stats in sorted(executor_stats.iteritems()))
+
+        if self.response_cache is not None:
+            cache_stats = self.response_cache.stats()
+            for stat in ('hits', 'misses', 'entries', 'size_bytes'):
+                lines.append("# TYPE nexus_response_cache_%s gauge" % stat)
+                lines.extend('nexus_response_cache_%s{tier="%s"} %d' % (stat, tier, stats[stat])
+                             for tier, stats in sorted(cache_stats.iteritems()) if stats is not None)
+
+        lines.append("# TYPE nexus_open_arenas gauge")
+        lines.append("nexus_open_arenas %d" % len(open_arenas()))
+
+        self.set_header("Content-Type", "text/plain; version=0.0.4")
+        self.write(render_metrics(lines))
+
+
+class ExecutorStatsHandler(tornado.web.RequestHandler):
+    path = r"/executorStats"
+
+    def initialize(self, executors):
+        self.executors = executors
+
+    def get(self):
+        self.set_header("Content-Type", "application/json")
+        self.write(json.dumps(self.executors.stats(), indent=4))
 
 
 if __name__ == "__main__":
@@ -199,15 +478,48 @@ if __name__ == "__main__":
     else:
         log.info("Static resources disabled")
 
-    handlers = []
+    executors = ExecutorRegistry(webconfig)
+    handlers = [(ExecutorStatsHandler.path, ExecutorStatsHandler, dict(executors=executors))]
 
     log.info("Running Nexus Initializers")
     NexusHandler.executeInitializers(algorithm_config)
 
+    remove_stale_arenas()
+
+    maxprocesses = algorithm_config.getint("multiprocessing", "maxprocesses")
+    if maxprocesses > 1:
+        log.info("Starting %d worker processes" % maxprocesses)
+        start_worker_pool(maxprocesses, algorithm_config.getint("multiprocessing", "worker_retries"),
+                          task_timeout=algorithm_config.getint("multiprocessing", "task_timeout_seconds"),
+                          map_timeout=algorithm_config.getint("multiprocessing", "map_timeout_seconds"))
+
+    response_cache = None
+    if webconfig.has_section("cache") and webconfig.getboolean("cache", "enabled"):
+        log.info("Caching responses")
+        response_cache = ResponseCache(get_tile_service(skipCassandra=True),
+                                       webconfig.getint("cache", "memory_bytes"),
+                                       disk_dir=webconfig.get("cache", "disk_dir") or None,
+                                       disk_bytes=webconfig.getint("cache", "disk_bytes"),
+                                       check_seconds=webconfig.getint("cache", "check_seconds"))
+
+    handlers.append((MetricsHandler.path, MetricsHandler, dict(executors=executors, response_cache=response_cache)))
+
+    if webconfig.has_section("tracing"):
+        BaseHandler.server_timing = webconfig.getboolean("tracing", "server_timing")
+
+    jobs = JobManager(executors, result_dir=webconfig.get("jobs", "result_dir") or None,
+                      ttl_seconds=webconfig.getint("jobs", "ttl_seconds"))
+    handlers.append((JobStatusHandler.path, JobStatusHandler, dict(executors=executors, jobs=jobs)))
+    handlers.append((JobResultHandler.path, JobResultHandler, dict(executors=executors, jobs=jobs)))
+
     for clazzWrapper in NexusHandler.AVAILABLE_HANDLERS:
         handlers.append(
             (clazzWrapper.path(), ModularNexusHandlerWrapper,
-             dict(clazz=clazzWrapper, algorithm_config=algorithm_config)))
+             dict(clazz=clazzWrapper, algorithm_config=algorithm_config, executors=executors,
+                  response_cache=response_cache)))
+        handlers.append(
+            ("%s/jobs" % clazzWrapper.path(), JobSubmitHandler,
+             dict(clazz=clazzWrapper, algorithm_config=algorithm_config, executors=executors, jobs=jobs)))
 
     if staticEnabled:
         handlers.append(
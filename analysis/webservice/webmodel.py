@@ -2,9 +2,12 @@
 Copyright (c) 2016 Jet Propulsion Laboratory,
 California Institute of Technology.  All rights reserved
 """
+import csv
+import itertools
 import re
 import json
 import numpy as np
+from cStringIO import StringIO
 from datetime import datetime
 from decimal import Decimal
 
@@ -121,6 +124,9 @@ class NexusRequestObject(StatsComputeOptions):
     def get_argument(self, name, default=None):
         return self.requestHandler.get_argument(name, default=default)
 
+    def get_header(self, name):
+        return self.requestHandler.request.headers.get(name)
+
     def __validate_is_shortname(self, v):
         if v is None or len(v) == 0:
             return False
@@ -184,8 +190,8 @@ class NexusRequestObject(StatsComputeOptions):
 
     def get_environment(self):
         env = self.get_argument(RequestParameters.ENVIRONMENT, None)
-        if env is None and "Origin" in self.requestHandler.request.headers:
-            origin = self.requestHandler.request.headers["Origin"]
+        origin = self.get_header("Origin")
+        if env is None and origin is not None:
             if origin == "http://localhost:63342":
                 env = "DEV"
             if origin == "https://sealevel.uat.earthdata.nasa.gov":
@@ -234,6 +240,25 @@ class NexusRequestObject(StatsComputeOptions):
         return self.get_argument(RequestParameters.PLOT_TYPE, default=default)
 
 
+class StoredRequestObject(NexusRequestObject):
+    """
+    NexusRequestObject of the arguments and headers copied from a request, for calculations that outlive the request
+    such as jobs. Unlike NexusRequestObject it can be pickled.
+    """
+
+    def __init__(self, reqHandler):
+        NexusRequestObject.__init__(self, reqHandler)
+        self.arguments = {name: reqHandler.get_argument(name) for name in reqHandler.request.arguments}
+        self.headers = dict(reqHandler.request.headers)
+        self.requestHandler = None
+
+    def get_argument(self, name, default=None):
+        return self.arguments.get(name, default)
+
+    def get_header(self, name):
+        return self.headers.get(name)
+
+
 class NexusResults:
     def __init__(self, results=None, meta=None, stats=None, compute_options=None, **args):
         self.__results = results
@@ -327,6 +352,71 @@ class NexusResults:
         raise Exception("Not implemented for this result type")
 
 
+class StreamingResults(NexusResults):
+    """
+    NexusResults whose data is an iterable of records, such as a generator that yields the points of each tile as it
+    is read, so the records can be sent while they are still being calculated instead of being held all at once.
+
+    The records are written before meta and stats, so calc can still fill those in while the records are produced.
+    The records can be iterated only once unless materialize is called.
+
+    :param records: Iterable of JSON serializable records
+    :param csv_fields: Column names of the CSV output, None if the records have no CSV form
+    :param csv_row: Function of a record to the list of its CSV column values
+    """
+
+    def __init__(self, records, csv_fields=None, csv_row=None, **kwargs):
+        NexusResults.__init__(self, **kwargs)
+        self.__records = records
+        self.__csv_fields = csv_fields
+        self.__csv_row = csv_row
+
+    def results(self):
+        return self.__records
+
+    def materialize(self):
+        """
+        Read all records into a list, so the results can be rendered more than once and pickled.
+        """
+        self.__records = list(self.__records)
+
+    def has_csv(self):
+        return self.__csv_fields is not None
+
+    def iterJson(self):
+        """
+        :return: Generator of the pieces of the JSON document, one per record
+        """
+        yield '{"data": ['
+        separator = ''
+        for record in self.__records:
+            yield separator + json.dumps(record, cls=CustomEncoder)
+            separator = ', '
+        yield '], "meta": %s, "stats": %s}' % (json.dumps(self.meta(), cls=CustomEncoder),
+                                               json.dumps(self.stats(), cls=CustomEncoder))
+
+    def iterCSV(self):
+        """
+        :return: Generator of the lines of the CSV document, the header then one per record
+        """
+        if not self.has_csv():
+            raise NexusProcessingException(reason="Results have no CSV form", code=400)
+
+        line = StringIO()
+        writer = csv.writer(line)
+        for row in itertools.chain([self.__csv_fields], itertools.imap(self.__csv_row, self.__records)):
+            writer.writerow(row)
+            yield line.getvalue()
+            line.seek(0)
+            line.truncate()
+
+    def toJson(self):
+        return ''.join(self.iterJson())
+
+    def toCSV(self):
+        return ''.join(self.iterCSV())
+
+
 class CustomEncoder(json.JSONEncoder):
     def default(self, obj):
         """If input object is an ndarray it will be converted into a dict
@@ -0,0 +1,447 @@
+"""
+Copyright (c) 2016 Jet Propulsion Laboratory,
+California Institute of Technology.  All rights reserved
+"""
+import logging
+import math
+import os
+import select
+import signal
+import threading
+import time
+import traceback
+from _multiprocessing import Connection
+from collections import deque
+from multiprocessing import Process, Pipe
+from multiprocessing.reduction import recv_handle, send_handle
+
+from nexustiles.nexustiles import get_tile_service
+
+from webservice.jobs import report_progress
+
+_worker_pool = None
+_worker_pool_pid = None
+
+
+def start_worker_pool(processes, max_retries=1, task_timeout=None, map_timeout=None):
+    """
+    Start the worker pool of this process. Call it once at server start, before the IOLoop and any request threads
+    run, so the process that forks the workers, also those replacing workers that died later, is forked from a quiet
+    process.
+    """
+    global _worker_pool, _worker_pool_pid
+
+    _worker_pool = WorkerPool(processes, max_retries=max_retries, initializer=get_tile_service,
+                              task_timeout=task_timeout, map_timeout=map_timeout)
+    _worker_pool.start()
+    _worker_pool_pid = os.getpid()
+    return _worker_pool
+
+
+def get_worker_pool():
+    """
+    :return: The WorkerPool started in this process, or None if there is none. Callers should then do the work
+    themselves.
+    """
+    if _worker_pool_pid != os.getpid():
+        return None
+    return _worker_pool
+
+
+class WorkerError(Exception):
+    pass
+
+
+class TaskFuture(object):
+    """
+    Result of a chunk of tasks submitted to a WorkerPool.
+    """
+
+    def __init__(self):
+        self._done = threading.Event()
+        self._lock = threading.Lock()
+        self._result = None
+        self._error = None
+
+    def _set(self, result, error):
+        with self._lock:
+            if self._done.is_set():
+                return
+            self._result = result
+            self._error = error
+            self._done.set()
+
+    def set_result(self, result):
+        self._set(result, None)
+
+    def set_error(self, error):
+        """
+        Fail the future, unless it is already done.
+        """
+        self._set(None, error)
+
+    def cancel(self):
+        """
+        Fail the future if it is not done yet. A chunk that has not been handed to a worker yet is then not run.
+        """
+        self.set_error(WorkerError("Cancelled"))
+
+    def done(self):
+        return self._done.is_set()
+
+    def result(self, timeout=None):
+        """
+        :return: The list of results of the tasks in the chunk
+        :raises WorkerError: if a task raised an exception, its worker kept crashing or timeout seconds passed
+        """
+        if not self._done.wait(timeout):
+            raise WorkerError("Timed out waiting for a worker")
+        if self._error is not None:
+            raise self._error
+        return self._result
+
+
+class _Task(object):
+    def __init__(self, fn, chunk):
+        self.fn = fn
+        self.chunk = chunk
+        self.future = TaskFuture()
+        self.attempts = 0
+
+
+class _Worker(object):
+    def __init__(self, conn, pid):
+        self.conn = conn
+        self.pid = pid
+        self.task = None
+        self.started = None
+
+    def kill(self):
+        try:
+            os.kill(self.pid, signal.SIGKILL)
+        except OSError:
+            pass
+        self.conn.close()
+
+
+class _Spawner(object):
+    """
+    Process that forks the workers. It is started with the pool, while the server runs no other threads, and stays
+    single-threaded, so workers are never forked while some thread of the server holds a lock the worker then needs,
+    such as the lock of the logging module or of a registry of shared services.
+    """
+
+    def __init__(self, initializer):
+        self.conn, child_conn = Pipe()
+        self.process = Process(target=_spawn_workers, args=(child_conn, initializer), name='nexus-worker-spawner')
+        self.process.daemon = True
+        self.process.start()
+        child_conn.close()
+
+    def spawn(self):
+        """
+        :return: New _Worker
+        :raises WorkerError: if the worker could not be started
+        """
+        conn, child_conn = Pipe()
+        try:
+            self.conn.send('spawn')
+            send_handle(self.conn, child_conn.fileno(), self.process.pid)
+            started, pid = self.conn.recv()
+        except (EOFError, IOError, OSError) as e:
+            conn.close()
+            raise WorkerError("The worker spawner process is not running: %s" % e)
+        finally:
+            child_conn.close()
+
+        if not started:
+            conn.close()
+            raise WorkerError("Could not fork a worker: %s" % pid)
+        return _Worker(conn, pid)
+
+    def stop(self):
+        self.conn.close()
+        self.process.join(1)
+        if self.process.is_alive():
+            self.process.terminate()
+
+
+def _spawn_workers(conn, initializer):
+    # Workers are not waited for, the pool notices that a worker died when its connection is closed
+    signal.signal(signal.SIGCHLD, signal.SIG_IGN)
+
+    while True:
+        try:
+            conn.recv()
+            fd = recv_handle(conn)
+        except (EOFError, IOError):
+            return
+
+        try:
+            pid = os.fork()
+        except OSError as e:
+            os.close(fd)
+            conn.send((False, str(e)))
+            continue
+
+        if pid == 0:
+            signal.signal(signal.SIGCHLD, signal.SIG_DFL)
+            conn.close()
+            code = 0
+            try:
+                _work(Connection(fd), initializer)
+            except Exception:
+                logging.getLogger('nexus').exception("Worker failed")
+                code = 1
+            finally:
+                os._exit(code)
+
+        os.close(fd)
+        conn.send((True, pid))
+
+
+def _work(conn, initializer):
+    if initializer is not None:
+        try:
+            initializer()
+        except Exception:
+            logging.getLogger('nexus').exception("Worker initializer failed")
+
+    while True:
+        try:
+            task = conn.recv()
+        except EOFError:
+            # The server exited
+            return
+        if task is None:
+            return
+
+        fn, chunk = task
+        try:
+            conn.send((True, [fn(*args) for args in chunk]))
+        except Exception:
+            conn.send((False, traceback.format_exc()))
+
+
+class WorkerPool(object):
+    """
+    Long-lived worker processes that run chunks of tasks for any number of requests.
+
+    Every worker runs initializer once when it starts, so state such as the NexusTileService of the worker and its
+    caches is reused by all the tasks it runs. Workers are forked by a spawner process started with the pool. A
+    dispatcher thread hands chunks to idle workers. When a worker dies, or runs a chunk for longer than task_timeout
+    seconds and is killed, it is replaced and the chunk is run again on another worker, up to max_retries times, after
+    which only the future of that chunk fails. An error in the dispatcher fails the chunks it was running, never the
+    pool.
+
+    :param processes: Number of worker processes
+    :param max_retries: Number of times a chunk is run again after its worker died
+    :param initializer: Function called without arguments in each new worker
+    :param task_timeout: Seconds a chunk may run on a worker, None for no limit
+    :param map_timeout: Seconds map waits for all of its chunks by default, None for no limit
+    """
+
+    # Seconds between checks for workers running past task_timeout and for workers that could not be started
+    CHECK_SECONDS = 1.0
+
+    def __init__(self, processes, max_retries=1, initializer=None, task_timeout=None, map_timeout=None):
+        self.processes = processes
+        self.max_retries = max_retries
+        self.task_timeout = task_timeout or None
+        self.map_timeout = map_timeout or None
+        self.logger = logging.getLogger('nexus')
+
+        self._initializer = initializer
+        self._spawner = None
+        self._workers = []
+        self._pending = deque()
+        self._lock = threading.Lock()
+        self._wakeup_read, self._wakeup_write = os.pipe()
+        self._stopped = False
+        self._thread = None
+
+    def start(self):
+        self._spawner = _Spawner(self._initializer)
+        self._start_workers()
+        self._thread = threading.Thread(target=self._dispatch, name='nexus-worker-pool')
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self):
+        self._stopped = True
+        self._wakeup()
+        self._thread.join()
+        for worker in self._workers:
+            try:
+                worker.conn.send(None)
+            except IOError:
+                pass
+            worker.conn.close()
+        self._spawner.stop()
+
+    def submit(self, fn, chunk):
+        """
+        Run fn(*args) for each args in chunk on one worker. fn must be a module level function and its arguments and
+        results must be picklable.
+
+        :return: TaskFuture of the list of results
+        """
+        task = _Task(fn, chunk)
+        with self._lock:
+            self._pending.append(task)
+        self._wakeup()
+        return task.future
+
+    def map(self, fn, args_list, chunksize=None, timeout=None, unit=None):
+        """
+        Run fn(*args) for each args in args_list, in chunks of chunksize tasks (by default about four chunks per
+        worker), and wait at most timeout seconds (by default map_timeout) for all of them. If unit is given, the
+        progress of the job that calls map is reported in unit as each chunk finishes.
+
+        :return: List of the results in the order of args_list
+        :raises WorkerError: if any chunk failed or the timeout passed. The chunks not run yet are then cancelled.
+        """
+        if chunksize is None:
+            chunksize = max(1, int(math.ceil(len(args_list) / (self.processes * 4.0))))
+        if timeout is None:
+            timeout = self.map_timeout
+        deadline = None if timeout is None else time.time() + timeout
+
+        futures = [self.submit(fn, args_list[i:i + chunksize]) for i in xrange(0, len(args_list), chunksize)]
+
+        results = []
+        try:
+            for future in futures:
+                results.extend(future.result(None if deadline is None else max(0, deadline - time.time())))
+                if unit is not None:
+                    report_progress(len(results), len(args_list), unit)
+        except WorkerError:
+            for future in futures:
+                future.cancel()
+            raise
+        return results
+
+    def _wakeup(self):
+        os.write(self._wakeup_write, 'x')
+
+    def _dispatch(self):
+        while not self._stopped:
+            try:
+                self._dispatch_once()
+            except Exception:
+                self.logger.exception("Worker pool dispatcher failed, failing the chunks being run")
+                self._fail_running(WorkerError("Worker pool dispatcher failed"))
+
+    def _dispatch_once(self):
+        self._start_workers()
+        self._kill_timed_out()
+        self._assign()
+
+        busy = {worker.conn.fileno(): worker for worker in self._workers if worker.task is not None}
+        readable, _, _ = select.select(busy.keys() + [self._wakeup_read], [], [], self.CHECK_SECONDS)
+
+        for fd in readable:
+            if fd == self._wakeup_read:
+                os.read(self._wakeup_read, 4096)
+            else:
+                self._receive(busy[fd])
+
+    def _start_workers(self):
+        """
+        Start workers until there are processes of them. When none can be started all pending chunks fail, rather
+        than wait for a worker that may never come.
+        """
+        while len(self._workers) < self.processes:
+            try:
+                self._workers.append(self._spawner.spawn())
+            except WorkerError as e:
+                self.logger.error("Could not start a worker process: %s" % e)
+                break
+
+        if len(self._workers) == 0:
+            with self._lock:
+                pending, self._pending = self._pending, deque()
+            for task in pending:
+                task.future.set_error(WorkerError("No worker processes are running"))
+
+    def _kill_timed_out(self):
+        if self.task_timeout is None:
+            return
+
+        now = time.time()
+        for worker in list(self._workers):
+            if worker.task is not None and now - worker.started > self.task_timeout:
+                self._replace(worker, "timed out", kill=True)
+
+    def _assign(self):
+        for worker in self._workers:
+            if worker.task is not None:
+                continue
+
+            with self._lock:
+                # Skip the chunks of maps that gave up
+                while len(self._pending) > 0 and self._pending[0].future.done():
+                    self._pending.popleft()
+                if len(self._pending) == 0:
+                    return
+                task = self._pending.popleft()
+
+            task.attempts += 1
+            worker.task = task
+            worker.started = time.time()
+            try:
+                worker.conn.send((task.fn, task.chunk))
+            except IOError:
+                self._replace(worker, "exited")
+            except Exception as e:
+                # Tasks that can not be pickled
+                worker.task = None
+                task.future.set_error(WorkerError("Could not submit task: %s" % e))
+
+    def _receive(self, worker):
+        task = worker.task
+        try:
+            succeeded, result = worker.conn.recv()
+        except (EOFError, IOError):
+            self._replace(worker, "exited")
+            return
+        except Exception as e:
+            # A result that can not be unpickled. It was read in full, so the worker can run the next chunk.
+            worker.task = None
+            task.future.set_error(WorkerError("Could not receive the result of %s: %s" % (task.fn.__name__, e)))
+            return
+
+        worker.task = None
+        if succeeded:
+            task.future.set_result(result)
+        else:
+            task.future.set_error(WorkerError(result))
+
+    def _replace(self, worker, reason, kill=False):
+        """
+        Drop worker, killing it if kill is set, run its chunk again or fail it, and start a new worker.
+        """
+        task = worker.task
+        self.logger.error("Worker %s %s while running %s, starting a new worker" % (worker.pid, reason,
+                                                                                    task.fn.__name__))
+        if kill:
+            worker.kill()
+        else:
+            worker.conn.close()
+        self._workers.remove(worker)
+
+        if task.attempts > self.max_retries:
+            task.future.set_error(WorkerError("Worker %s %d times while running %s" % (reason, task.attempts,
+                                                                                     task.fn.__name__)))
+        else:
+            with self._lock:
+                self._pending.appendleft(task)
+
+        self._start_workers()
+
+    def _fail_running(self, error):
+        for worker in list(self._workers):
+            if worker.task is not None:
+                worker.task.future.set_error(error)
+                worker.kill()
+                self._workers.remove(worker)
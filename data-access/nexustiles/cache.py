@@ -0,0 +1,231 @@
+"""
+Copyright (c) 2016 Jet Propulsion Laboratory,
+California Institute of Technology.  All rights reserved
+"""
+import threading
+import time
+from collections import OrderedDict, namedtuple
+
+import numpy as np
+import numpy.ma as ma
+
+CacheStats = namedtuple('CacheStats',
+                        ('hits', 'misses', 'evictions', 'expirations', 'entries', 'size_bytes', 'max_size_bytes'))
+
+
+class LRUCache(object):
+    """
+    Thread-safe least recently used cache bounded by the total size in bytes of the values it holds.
+
+    :param max_size_bytes: Entries are evicted, least recently used first, once the sizes of the cached values add up
+                           to more than this
+    :param sizeof: Function that returns the size in bytes of a value
+    :param ttl_seconds: If set, entries older than this many seconds are treated as missing
+    """
+
+    def __init__(self, max_size_bytes, sizeof, ttl_seconds=None):
+        self.max_size_bytes = max_size_bytes
+        self.ttl_seconds = ttl_seconds
+        self._sizeof = sizeof
+
+        self._lock = threading.Lock()
+        # key -> (value, size in bytes, time added)
+        self._entries = OrderedDict()
+        self._size_bytes = 0
+
+        self._hits = 0
+        self._misses = 0
+        self._evictions = 0
+        self._expirations = 0
+
+    def get(self, key, default=None):
+        with self._lock:
+            try:
+                value, size, added = self._entries.pop(key)
+            except KeyError:
+                self._misses += 1
+                return default
+
+            if self.ttl_seconds is not None and time.time() - added > self.ttl_seconds:
+                self._size_bytes -= size
+                self._expirations += 1
+                self._misses += 1
+                return default
+
+            # Re-insert to mark the entry as the most recently used
+            self._entries[key] = (value, size, added)
+            self._hits += 1
+            return value
+
+    def put(self, key, value):
+        size = self._sizeof(value)
+
+        with self._lock:
+            if key in self._entries:
+                self._size_bytes -= self._entries.pop(key)[1]
+
+            if size > self.max_size_bytes:
+                return
+
+            self._entries[key] = (value, size, time.time())
+            self._size_bytes += size
+
+            while self._size_bytes > self.max_size_bytes:
+                _, (_, evicted_size, _) = self._entries.popitem(last=False)
+                self._size_bytes -= evicted_size
+                self._evictions += 1
+
+    def delete(self, key):
+        with self._lock:
+            if key in self._entries:
+                self._size_bytes -= self._entries.pop(key)[1]
+
+    def __contains__(self, key):
+        with self._lock:
+            return key in self._entries
+
+    def __len__(self):
+        with self._lock:
+            return len(self._entries)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._size_bytes = 0
+
+    def stats(self):
+        with self._lock:
+            return CacheStats(self._hits, self._misses, self._evictions, self._expirations, len(self._entries),
+                              self._size_bytes, self.max_size_bytes)
+
+
+class BoxQueryCache(object):
+    """
+    LRU cache of the Solr documents of the tiles found by searches for a box. Entries are keyed by the rest of the
+    search (for example the dataset and time) and the box. A search for a box inside a cached box with the same key is
+    answered with the cached documents of the tiles that intersect it.
+
+    :param max_docs: Entries are evicted, least recently used first, once they hold more documents than this
+    :param ttl_seconds: If set, entries older than this many seconds are not used
+    """
+
+    def __init__(self, max_docs, ttl_seconds=None):
+        self._cache = LRUCache(max_docs, len, ttl_seconds=ttl_seconds)
+
+        self._lock = threading.Lock()
+        # key -> boxes that may be cached for it
+        self._boxes = {}
+
+        self._hits = 0
+        self._misses = 0
+
+    def get(self, key, min_lat, max_lat, min_lon, max_lon):
+        """
+        :return: List of the documents of the tiles that intersect the box or None if no cached box contains it
+        """
+        with self._lock:
+            boxes = list(self._boxes.get(key, ()))
+
+        for box in boxes:
+            cached_min_lat, cached_max_lat, cached_min_lon, cached_max_lon = box
+            if not (cached_min_lat <= min_lat and max_lat <= cached_max_lat and
+                    cached_min_lon <= min_lon and max_lon <= cached_max_lon):
+                continue
+
+            docs = self._cache.get((key, box))
+            if docs is None:
+                # Evicted or expired
+                continue
+
+            with self._lock:
+                self._hits += 1
+            if box == (min_lat, max_lat, min_lon, max_lon):
+                return list(docs)
+            return [doc for doc in docs if doc['tile_min_lat'] <= max_lat and doc['tile_max_lat'] >= min_lat and
+                    doc['tile_min_lon'] <= max_lon and doc['tile_max_lon'] >= min_lon]
+
+        with self._lock:
+            self._misses += 1
+        return None
+
+    def put(self, key, min_lat, max_lat, min_lon, max_lon, docs):
+        box = (min_lat, max_lat, min_lon, max_lon)
+        self._cache.put((key, box), list(docs))
+
+        with self._lock:
+            # Forget the boxes that are no longer cached
+            boxes = set(a_box for a_box in self._boxes.get(key, ()) if (key, a_box) in self._cache)
+            boxes.add(box)
+            self._boxes[key] = boxes
+
+            # Also forget the keys whose entries have all been evicted
+            if len(self._boxes) > 2 * len(self._cache) + 100:
+                self._boxes = {a_key: a_boxes for a_key, a_boxes in self._boxes.iteritems()
+                               if any((a_key, a_box) in self._cache for a_box in a_boxes)}
+
+    def clear(self):
+        self._cache.clear()
+        with self._lock:
+            self._boxes.clear()
+
+    def stats(self):
+        """
+        :return: CacheStats where hits and misses count searches and sizes count documents
+        """
+        cache_stats = self._cache.stats()
+        with self._lock:
+            return cache_stats._replace(hits=self._hits, misses=self._misses)
+
+
+def nbytes(value):
+    """
+    Size in bytes of the numpy arrays (including masks) in value, which may be an array or a (nested) tuple, list or
+    dict of arrays. Anything else counts as 0 bytes.
+    """
+    if isinstance(value, np.ndarray):
+        size = value.nbytes
+        if isinstance(value, ma.MaskedArray) and value.mask is not ma.nomask:
+            size += value.mask.nbytes
+        return size
+    elif isinstance(value, (tuple, list)):
+        return sum(nbytes(item) for item in value)
+    elif isinstance(value, dict):
+        return sum(nbytes(item) for item in value.itervalues())
+
+    return 0
+
+
+def read_only(value):
+    """
+    Mark the numpy arrays (and their masks) in value as not writeable. value may be an array or a (nested) tuple, list
+    or dict of arrays. Returns value.
+    """
+    if isinstance(value, np.ndarray):
+        value.flags.writeable = False
+        if isinstance(value, ma.MaskedArray) and value.mask is not ma.nomask:
+            value.mask.flags.writeable = False
+    elif isinstance(value, (tuple, list)):
+        for item in value:
+            read_only(item)
+    elif isinstance(value, dict):
+        for item in value.itervalues():
+            read_only(item)
+
+    return value
+
+
+def view_of(value):
+    """
+    New array objects sharing the memory of the arrays in value, so that attributes such as the mask can be replaced
+    on the result without affecting value.
+    """
+    if isinstance(value, np.ndarray):
+        return value.view()
+    elif isinstance(value, tuple):
+        return tuple(view_of(item) for item in value)
+    elif isinstance(value, list):
+        return [view_of(item) for item in value]
+    elif isinstance(value, dict):
+        return {key: view_of(item) for key, item in value.iteritems()}
+
+    return value
@@ -0,0 +1,211 @@
+"""
+Copyright (c) 2016 Jet Propulsion Laboratory,
+California Institute of Technology.  All rights reserved
+"""
+import calendar
+import logging
+import threading
+import time
+from collections import defaultdict
+from datetime import timedelta
+
+import numpy as np
+
+# Solr fields kept for every tile, enough to build a Tile with NexusTileService._solr_docs_to_tiles
+CATALOG_FIELDS = ('id', 'dataset_s', 'granule_s', 'sectionSpec_s', 'tile_var_name_s', 'day_of_year_i',
+                  'tile_min_lat', 'tile_max_lat', 'tile_min_lon', 'tile_max_lon', 'tile_min_time_dt',
+                  'tile_max_time_dt', 'tile_min_val_d', 'tile_max_val_d', 'tile_avg_val_d', 'tile_count_i',
+                  'insert_timestamp')
+
+# Tiles inserted this many seconds before the newest tile already seen are fetched again on refresh, to pick up
+# documents that became visible in Solr after a later one
+REFRESH_OVERLAP_SECONDS = 60
+
+
+def to_seconds(a_datetime):
+    return calendar.timegm(a_datetime.utctimetuple())
+
+
+class DatasetCatalog(object):
+    """
+    Summaries of the tiles of one dataset held in columnar arrays, sorted by min time, max time and id (the order of
+    SolrProxy.find_all_tiles_in_box_sorttimeasc).
+
+    Time searches use an interval index: a tile spans at most max_duration seconds, so the tiles intersecting a time
+    range are among those whose min time is within max_duration before the range. That slice is found with a binary
+    search on the sorted min times and filtered on the remaining columns.
+    """
+
+    def __init__(self, columns):
+        order = np.lexsort((columns['id'], columns['max_time'], columns['min_time']))
+        self.columns = {name: column[order] for name, column in columns.iteritems()}
+        self.max_duration = np.max(self.columns['max_time'] - self.columns['min_time']) if len(order) > 0 else 0
+
+    @staticmethod
+    def from_docs(docs):
+        def column(values, dtype):
+            an_array = np.empty(len(docs), dtype=dtype)
+            an_array[:] = values
+            return an_array
+
+        return DatasetCatalog({
+            'doc': column(docs, object),
+            'id': column([doc['id'] for doc in docs], object),
+            'min_lat': column([doc['tile_min_lat'] for doc in docs], float),
+            'max_lat': column([doc['tile_max_lat'] for doc in docs], float),
+            'min_lon': column([doc['tile_min_lon'] for doc in docs], float),
+            'max_lon': column([doc['tile_max_lon'] for doc in docs], float),
+            'min_time': column([to_seconds(doc['tile_min_time_dt']) for doc in docs], np.int64),
+            'max_time': column([to_seconds(doc['tile_max_time_dt']) for doc in docs], np.int64),
+            'min_val': column([doc.get('tile_min_val_d', np.nan) for doc in docs], float),
+            'max_val': column([doc.get('tile_max_val_d', np.nan) for doc in docs], float),
+            'avg_val': column([doc.get('tile_avg_val_d', np.nan) for doc in docs], float),
+            'count': column([doc.get('tile_count_i', 0) for doc in docs], np.int64)
+        })
+
+    def merge(self, other):
+        """
+        New DatasetCatalog with the tiles of other added to those of this one. Tiles of this catalog with the same id
+        as a tile of other are replaced.
+        """
+        kept = ~np.in1d(self.columns['id'], other.columns['id'])
+        return DatasetCatalog({name: np.concatenate((column[kept], other.columns[name]))
+                               for name, column in self.columns.iteritems()})
+
+    def __len__(self):
+        return len(self.columns['id'])
+
+    def find_tiles_in_box(self, min_lat, max_lat, min_lon, max_lon, start_time=None, end_time=None):
+        """
+        Solr documents of the tiles with data that intersect the box and, if given, the time range [start_time,
+        end_time], sorted by time.
+        """
+        rows, selected = self._select(min_lat, max_lat, min_lon, max_lon, start_time, end_time)
+        return self.columns['doc'][rows][selected].tolist()
+
+    def find_boundary_tiles(self, min_lat, max_lat, min_lon, max_lon, start_time=None, end_time=None):
+        """
+        Same as find_tiles_in_box but only the tiles that are not within the box.
+        """
+        rows, selected = self._select(min_lat, max_lat, min_lon, max_lon, start_time, end_time)
+        selected &= ~((self.columns['min_lat'][rows] >= min_lat) & (self.columns['max_lat'][rows] <= max_lat)
+                      & (self.columns['min_lon'][rows] >= min_lon) & (self.columns['max_lon'][rows] <= max_lon))
+        return self.columns['doc'][rows][selected].tolist()
+
+    def find_days_in_range(self, min_lat, max_lat, min_lon, max_lon, start_time, end_time):
+        """
+        Sorted distinct times, in seconds since the epoch, of the single-time tiles with data that intersect the box
+        and start in [start_time, end_time].
+        """
+        rows, selected = self._select(min_lat, max_lat, min_lon, max_lon, start_time, end_time)
+        min_time = self.columns['min_time'][rows]
+        selected &= (min_time == self.columns['max_time'][rows]) & (min_time >= start_time)
+        return np.unique(min_time[selected]).astype(float).tolist()
+
+    def _select(self, min_lat, max_lat, min_lon, max_lon, start_time, end_time):
+        # Slice of rows that may intersect the time range and which of them intersect the box and time range
+        min_time = self.columns['min_time']
+        if start_time is None:
+            rows = slice(0, len(min_time))
+        else:
+            rows = slice(np.searchsorted(min_time, start_time - self.max_duration, side='left'),
+                         np.searchsorted(min_time, end_time, side='right'))
+
+        selected = (self.columns['min_lat'][rows] <= max_lat) & (self.columns['max_lat'][rows] >= min_lat) \
+                   & (self.columns['min_lon'][rows] <= max_lon) & (self.columns['max_lon'][rows] >= min_lon) \
+                   & (self.columns['count'][rows] > 0)
+        if start_time is not None:
+            selected &= self.columns['max_time'][rows] >= start_time
+
+        return rows, selected
+
+
+class TileCatalog(object):
+    """
+    In-memory DatasetCatalog of every dataset, loaded from Solr by a background thread and refreshed every
+    refresh_seconds with the tiles inserted since the last refresh (by insert_timestamp). Tiles deleted from Solr stay
+    in the catalog until the process restarts.
+
+    :param solr: SolrProxy used only by the refresh thread
+    :param refresh_seconds: Seconds between refreshes
+    :param max_age_seconds: get returns None when the last successful refresh is older than this
+    """
+
+    def __init__(self, solr, refresh_seconds=60, max_age_seconds=300):
+        self.refresh_seconds = refresh_seconds
+        self.max_age_seconds = max_age_seconds
+        self.logger = logging.getLogger('nexus')
+
+        self._solr = solr
+        self._datasets = {}
+        self._last_refresh = None
+        self._last_inserted = None
+
+        self._stop = threading.Event()
+        self._thread = None
+
+    def copy(self, solr):
+        """
+        A new TileCatalog, not started, with the settings and tiles of this one that refreshes from solr. Used by a
+        forked process, which must not share the Solr connections of its parent.
+        """
+        catalog = TileCatalog(solr, refresh_seconds=self.refresh_seconds, max_age_seconds=self.max_age_seconds)
+        catalog._datasets = self._datasets
+        catalog._last_refresh = self._last_refresh
+        catalog._last_inserted = self._last_inserted
+        return catalog
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name='nexus-catalog')
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                self.refresh()
+            except Exception:
+                self.logger.exception("Could not refresh the tile catalog")
+            self._stop.wait(self.refresh_seconds)
+
+    def refresh(self):
+        """
+        Add the tiles inserted since the last refresh, or all tiles on the first call.
+        """
+        start = time.time()
+
+        inserted_after = None
+        if self._last_inserted is not None:
+            inserted_after = self._last_inserted - timedelta(seconds=REFRESH_OVERLAP_SECONDS)
+
+        docs_by_dataset = defaultdict(list)
+        last_inserted = self._last_inserted
+        for doc in self._solr.find_tile_summaries_generator(CATALOG_FIELDS, inserted_after=inserted_after):
+            docs_by_dataset[doc['dataset_s']].append(doc)
+            if 'insert_timestamp' in doc and (last_inserted is None or doc['insert_timestamp'] > last_inserted):
+                last_inserted = doc['insert_timestamp']
+
+        datasets = dict(self._datasets)
+        for dataset, docs in docs_by_dataset.iteritems():
+            new_tiles = DatasetCatalog.from_docs(docs)
+            datasets[dataset] = datasets[dataset].merge(new_tiles) if dataset in datasets else new_tiles
+
+        # Readers only ever see a complete set of catalogs
+        self._datasets = datasets
+        self._last_inserted = last_inserted
+        self._last_refresh = time.time()
+
+        self.logger.debug("Refreshed tile catalog with %d tiles in %.4f seconds" % (
+            sum(len(docs) for docs in docs_by_dataset.itervalues()), time.time() - start))
+
+    def get(self, dataset):
+        """
+        :return: DatasetCatalog of dataset, or None if the catalog is stale or has no tiles for dataset
+        """
+        if self._last_refresh is None or time.time() - self._last_refresh > self.max_age_seconds:
+            return None
+
+        return self._datasets.get(dataset)
@@ -1,12 +1,32 @@
+import ConfigParser
+import logging
+import os
+import threading
+import time
 import uuid
+from collections import OrderedDict
 
 import nexusproto.NexusContent_pb2 as nexusproto
 import numpy as np
+from cassandra.concurrent import execute_concurrent_with_args
 from cassandra.cqlengine import columns
 from cassandra.cqlengine import connection
 from cassandra.cqlengine.models import Model
 from cassandra.policies import TokenAwarePolicy, DCAwareRoundRobinPolicy
 from nexusproto.serialization import from_shaped_array
+from nexustiles.tracing import add_count, span
+
+# Names of the summed-area tables the ingest tile summarizer can store in the meta data of grid tiles, see
+# NexusTileData.get_summed_area_tables
+SUMMED_AREA_SUM = 'summed_area_sum'
+SUMMED_AREA_SUM_OF_SQUARES = 'summed_area_sum_of_squares'
+SUMMED_AREA_COUNT = 'summed_area_count'
+SUMMED_AREA_TABLES = (SUMMED_AREA_SUM, SUMMED_AREA_SUM_OF_SQUARES, SUMMED_AREA_COUNT)
+
+# The cqlengine connection is shared by every CassandraProxy in the process. This is the id of the process that set it
+# up, a forked process has to set up its own because the driver's connections and threads do not survive a fork.
+_connection_pid = None
+_connection_lock = threading.Lock()
 
 
 class NexusTileData(Model):
@@ -46,7 +66,9 @@ class NexusTileData(Model):
             meta_data = {}
             for meta_data_obj in grid_tile.meta_data:
                 name = meta_data_obj.name
-                meta_array = meta_data_obj.meta_data
+                if name in SUMMED_AREA_TABLES:
+                    continue
+                meta_array = np.ma.masked_invalid(from_shaped_array(meta_data_obj.meta_data))
                 if len(meta_array.shape) == 2:
                     meta_array = meta_array[np.newaxis, :]
                 meta_data[name] = meta_array
@@ -55,53 +77,70 @@ class NexusTileData(Model):
         elif self._get_nexus_tile().HasField('swath_tile'):
             swath_tile = self._get_nexus_tile().swath_tile
 
-            latitude_data = np.ma.masked_invalid(from_shaped_array(swath_tile.latitude)).reshape(-1)
-            longitude_data = np.ma.masked_invalid(from_shaped_array(swath_tile.longitude)).reshape(-1)
-            time_data = np.ma.masked_invalid(from_shaped_array(swath_tile.time)).reshape(-1)
-
-            # Simplify the tile if the time dimension is the same value repeated
-            if np.all(time_data == np.min(time_data)):
-                time_data = np.array([np.min(time_data)])
-
-            swath_tile_data = np.ma.masked_invalid(from_shaped_array(swath_tile.variable_data))
+            # Swath tiles are returned as flat arrays with one entry per point. Use get_swath_shape to map a point
+            # back to its index in the swath.
+            swath_tile_data = from_shaped_array(swath_tile.variable_data)
+            swath_shape = swath_tile_data.shape
 
-            tile_data = self._to_standard_index(swath_tile_data,
-                                                (len(time_data), len(latitude_data), len(longitude_data)))
+            tile_data = np.ma.masked_invalid(swath_tile_data).reshape(-1)
+            latitude_data = self._to_points(from_shaped_array(swath_tile.latitude), swath_shape)
+            longitude_data = self._to_points(from_shaped_array(swath_tile.longitude), swath_shape)
+            time_data = self._to_points(from_shaped_array(swath_tile.time), swath_shape)
 
             # Extract the meta data
             meta_data = {}
             for meta_data_obj in swath_tile.meta_data:
                 name = meta_data_obj.name
-                actual_meta_array = np.ma.masked_invalid(from_shaped_array(meta_data_obj.meta_data))
-                reshaped_meta_array = self._to_standard_index(actual_meta_array, tile_data.shape)
-                meta_data[name] = reshaped_meta_array
+                meta_data[name] = self._to_points(from_shaped_array(meta_data_obj.meta_data), swath_shape)
 
             return latitude_data, longitude_data, time_data, tile_data, meta_data
         else:
             raise NotImplementedError("Only supports grid_tile and swath_tile")
 
-    @staticmethod
-    def _to_standard_index(data_array, desired_shape):
-
-        if desired_shape[0] == 1:
-            reshaped_array = np.ma.masked_all((desired_shape[1], desired_shape[2]))
-            row, col = np.indices(data_array.shape)
-
-            reshaped_array[np.diag_indices(desired_shape[1], len(reshaped_array.shape))] = data_array[
-                row.flat, col.flat]
-            reshaped_array.mask[np.diag_indices(desired_shape[1], len(reshaped_array.shape))] = data_array.mask[
-                row.flat, col.flat]
-            reshaped_array = reshaped_array[np.newaxis, :]
-        else:
-            reshaped_array = np.ma.masked_all(desired_shape)
-            row, col = np.indices(data_array.shape)
+    def get_summed_area_tables(self):
+        """
+        Latitudes, longitudes and summed-area tables of a grid tile ingested with them, without decoding its data.
+        The tables hold the sum, sum of squares and count of the valid data above and left of each position and have a
+        leading row and column of zeros, so the sum over data[r0:r1, c0:c1] is
+        table[r1, c1] - table[r0, c1] - table[r1, c0] + table[r0, c0].
+
+        :return: Tuple of the latitudes, longitudes and dict of table name to table, or None for swath tiles and grid
+                 tiles without tables
+        """
+        if not self._get_nexus_tile().HasField('grid_tile'):
+            return None
+        grid_tile = self._get_nexus_tile().grid_tile
+
+        tables = {meta_data_obj.name: from_shaped_array(meta_data_obj.meta_data)
+                  for meta_data_obj in grid_tile.meta_data if meta_data_obj.name in SUMMED_AREA_TABLES}
+        if len(tables) != len(SUMMED_AREA_TABLES):
+            return None
+
+        latitude_data = np.ma.masked_invalid(from_shaped_array(grid_tile.latitude))
+        longitude_data = np.ma.masked_invalid(from_shaped_array(grid_tile.longitude))
+        return latitude_data, longitude_data, tables
+
+    def get_swath_shape(self):
+        """
+        Shape of the variable data of a swath tile, None for grid tiles.
+        """
+        if self._get_nexus_tile().HasField('swath_tile'):
+            return tuple(self._get_nexus_tile().swath_tile.variable_data.shape)
+
+        return None
 
-            reshaped_array[np.diag_indices(desired_shape[1], len(reshaped_array.shape))] = data_array[
-                row.flat, col.flat]
-            reshaped_array.mask[np.diag_indices(desired_shape[1], len(reshaped_array.shape))] = data_array.mask[
-                row.flat, col.flat]
+    @staticmethod
+    def _to_points(data_array, swath_shape):
+        """
+        Flatten data_array to one value per point of a swath of shape swath_shape. Arrays with fewer dimensions than
+        the swath, such as a time per row, are repeated along the missing trailing dimensions.
+        """
+        if data_array.shape != swath_shape:
+            if data_array.shape == swath_shape[:data_array.ndim]:
+                data_array = data_array.reshape(data_array.shape + (1,) * (len(swath_shape) - data_array.ndim))
+            data_array = np.broadcast_to(data_array, swath_shape)
 
-        return reshaped_array
+        return np.ma.masked_invalid(data_array).reshape(-1)
 
 
 class CassandraProxy(object):
@@ -111,22 +150,92 @@ class CassandraProxy(object):
         self.__cass_keyspace = config.get("cassandra", "keyspace")
         self.__cass_local_DC = config.get("cassandra", "local_datacenter")
         self.__cass_protocol_version = int(config.get("cassandra", "protocol_version"))
+        try:
+            self.__fetch_concurrency = int(config.get("cassandra", "fetch_concurrency"))
+        except ConfigParser.Error:
+            self.__fetch_concurrency = 64
+        try:
+            self.__executor_threads = int(config.get("cassandra", "executor_threads"))
+        except ConfigParser.Error:
+            self.__executor_threads = 2
+        self.logger = logging.getLogger('nexus')
+        # (process id, statement) as a statement is prepared on the session of one process
+        self.__fetch_statement = (None, None)
         self.__open()
 
     def __open(self):
-        dc_policy = DCAwareRoundRobinPolicy(self.__cass_local_DC)
-        token_policy = TokenAwarePolicy(dc_policy)
-        connection.setup([host for host in self.__cass_url.split(',')], self.__cass_keyspace,
-                         protocol_version=self.__cass_protocol_version, load_balancing_policy=token_policy)
+        global _connection_pid
+
+        with _connection_lock:
+            if _connection_pid == os.getpid():
+                return
+
+            dc_policy = DCAwareRoundRobinPolicy(self.__cass_local_DC)
+            token_policy = TokenAwarePolicy(dc_policy)
+            connection.setup([host for host in self.__cass_url.split(',')], self.__cass_keyspace,
+                             protocol_version=self.__cass_protocol_version, load_balancing_policy=token_policy,
+                             executor_threads=self.__executor_threads)
+            _connection_pid = os.getpid()
+
+    def _get_session(self):
+        self.__open()
+        return connection.get_session()
+
+    def _get_fetch_statement(self):
+        pid, statement = self.__fetch_statement
+        if pid != os.getpid():
+            statement = self._get_session().prepare(
+                "SELECT tile_id, tile_blob FROM %s.%s WHERE tile_id=?" % (self.__cass_keyspace,
+                                                                          NexusTileData.__table_name__))
+            self.__fetch_statement = (os.getpid(), statement)
+        return statement
+
+    def _order_by_replica(self, tile_ids):
+        """
+        Positions of tile_ids ordered by the first replica that owns each partition, so requests to the same node are
+        sent one after the other. TokenAwarePolicy routes each request to its replica whatever the order.
+        :param tile_ids: list of UUID
+        :return: list of (position in tile_ids, tile_id)
+        """
+        statement = self._get_fetch_statement()
+        metadata = self._get_session().cluster.metadata
+
+        by_replica = OrderedDict()
+        for position, tile_id in enumerate(tile_ids):
+            routing_key = statement.bind((tile_id,)).routing_key
+            replicas = metadata.get_replicas(self.__cass_keyspace, routing_key)
+            replica = replicas[0] if len(replicas) > 0 else None
+            by_replica.setdefault(replica, []).append((position, tile_id))
+
+        return [positioned_id for positioned_ids in by_replica.itervalues() for positioned_id in positioned_ids]
 
     def fetch_nexus_tiles(self, *tile_ids):
+        """
+        Fetch the tiles with the given ids using a prepared statement and at most fetch_concurrency requests in
+        flight, across all replicas. Tiles are returned in the order they were requested; ids that are not found are
+        left out.
+        """
         tile_ids = [uuid.UUID(str(tile_id)) for tile_id in tile_ids if
                     (isinstance(tile_id, str) or isinstance(tile_id, unicode))]
 
-        res = []
-        for tile_id in tile_ids:
-            filterResults = NexusTileData.objects.filter(tile_id=tile_id)
-            if len(filterResults) > 0:
-                res.append(filterResults[0])
+        if len(tile_ids) == 0:
+            return []
+
+        session = self._get_session()
+        statement = self._get_fetch_statement()
+        positioned_ids = self._order_by_replica(tile_ids)
+
+        start = time.time()
+        with span('cassandra.fetch'):
+            results = execute_concurrent_with_args(session, statement, [(tile_id,) for _, tile_id in positioned_ids],
+                                                   concurrency=self.__fetch_concurrency)
+        self.logger.debug("Fetched %d tiles in %.4f seconds" % (len(positioned_ids), time.time() - start))
+
+        res = [None] * len(tile_ids)
+        for (position, _), (success, rows) in zip(positioned_ids, results):
+            for row in rows:
+                res[position] = NexusTileData(tile_id=row['tile_id'], tile_blob=row['tile_blob'])
+                add_count('tiles_fetched')
+                add_count('tile_bytes_fetched', len(row['tile_blob']))
 
-        return res
+        return [tile for tile in res if tile is not None]
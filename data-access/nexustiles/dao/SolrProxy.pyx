@@ -1,8 +1,89 @@
+import ConfigParser
+import json
 import logging
+import os
+import threading
 import time
+from Queue import Queue, Empty
+from bisect import bisect_left, bisect_right
+from contextlib import contextmanager
 from datetime import datetime
+from multiprocessing.pool import ThreadPool
 
 import solr
+from nexustiles.cache import BoxQueryCache, LRUCache
+from nexustiles.catalog import to_seconds
+from nexustiles.tracing import add_count, attach, current_trace, span
+
+# Connection pools shared by every SolrProxy in the process, see get_connection_pool
+_connection_pools = {}
+_connection_pools_lock = threading.Lock()
+
+# Generation of the query cache entries of each dataset, part of their keys, see invalidate_query_caches
+_query_cache_generations = {}
+_query_cache_generations_lock = threading.Lock()
+
+
+def get_connection_pool(url, size):
+    """
+    Return the process-wide SolrConnectionPool for url, creating it on first use. A process forked after the pool was
+    created gets a new one because the connections cannot be shared with the parent.
+    """
+    with _connection_pools_lock:
+        pool = _connection_pools.get(url)
+        if pool is None or pool.pid != os.getpid():
+            pool = SolrConnectionPool(url, size)
+            _connection_pools[url] = pool
+
+        return pool
+
+
+def invalidate_query_caches(ds):
+    """
+    Stop every SolrProxy in the process from answering searches of dataset ds from its query caches, for example once
+    new tiles of ds were ingested. The old entries are evicted as they age.
+    """
+    with _query_cache_generations_lock:
+        _query_cache_generations[ds] = _query_cache_generations.get(ds, 0) + 1
+
+
+def _query_cache_generation(ds):
+    return _query_cache_generations.get(ds, 0)
+
+
+class SolrConnectionPool(object):
+    """
+    Keep-alive connections to a Solr core. A solr.Solr connection is not thread-safe, so each one is used by a single
+    thread at a time and at most size are open at once.
+    """
+
+    def __init__(self, url, size):
+        self.url = url
+        self.size = size
+        self.pid = os.getpid()
+
+        self._idle = Queue()
+        self._available = threading.BoundedSemaphore(size)
+
+    @contextmanager
+    def connection(self):
+        self._available.acquire()
+        try:
+            try:
+                solrcon = self._idle.get_nowait()
+            except Empty:
+                solrcon = solr.Solr(self.url)
+
+            try:
+                yield solrcon
+            except Exception:
+                # The connection may be left half way through a response
+                solrcon.close()
+                raise
+
+            self._idle.put(solrcon)
+        finally:
+            self._available.release()
 
 
 class SolrProxy(object):
@@ -11,7 +92,65 @@ class SolrProxy(object):
         self.solrUrl = config.get("solr", "host")
         self.solrCore = config.get("solr", "core")
         self.logger = logging.getLogger('nexus')
-        self.solrcon = solr.Solr('http://%s/solr/%s' % (self.solrUrl, self.solrCore))
+        try:
+            self.rows_per_page = int(config.get("solr", "rows_per_page"))
+        except ConfigParser.Error:
+            self.rows_per_page = 1000
+        try:
+            self.time_slices = int(config.get("solr", "time_slices"))
+        except ConfigParser.Error:
+            self.time_slices = 1
+        try:
+            pool_size = int(config.get("solr", "pool_size"))
+        except ConfigParser.Error:
+            pool_size = 16
+        self._pool_size = pool_size
+        self._pool = get_connection_pool(self._core_url(), pool_size)
+
+        try:
+            query_cache_docs = int(config.get("solr", "query_cache_docs"))
+        except ConfigParser.Error:
+            query_cache_docs = 0
+        try:
+            query_cache_ttl_seconds = float(config.get("solr", "query_cache_ttl_seconds")) or None
+        except ConfigParser.Error:
+            query_cache_ttl_seconds = None
+
+        self._tiles_cache = None
+        self._days_cache = None
+        self._query_cache_ttl_seconds = query_cache_ttl_seconds if query_cache_docs > 0 else 0
+        if query_cache_docs > 0:
+            self._tiles_cache = BoxQueryCache(query_cache_docs, ttl_seconds=query_cache_ttl_seconds)
+            self._days_cache = LRUCache(query_cache_docs, len, ttl_seconds=query_cache_ttl_seconds)
+
+    def _core_url(self):
+        return 'http://%s/solr/%s' % (self.solrUrl, self.solrCore)
+
+    def _connection_pool(self):
+        """
+        The connection pool of this process. A SolrProxy inherited by a forked process must not use the keep-alive
+        connections of its parent.
+        """
+        if self._pool.pid != os.getpid():
+            self._pool = get_connection_pool(self._core_url(), self._pool_size)
+        return self._pool
+
+    def get_query_cache_stats(self):
+        """
+        :return: Tuple of the cache.CacheStats of the tile search cache and the day list cache, sized in documents and
+                 days, or None if the caches are disabled
+        """
+        if self._tiles_cache is None:
+            return None
+
+        return self._tiles_cache.stats(), self._days_cache.stats()
+
+    def get_query_cache_ttl(self):
+        """
+        :return: Seconds a cached search is used for, 0 if the caches are disabled or None if searches are cached until
+                 they are evicted
+        """
+        return self._query_cache_ttl_seconds
 
     def find_tile_by_id(self, tile_id):
 
@@ -52,6 +191,24 @@ class SolrProxy(object):
         l = sorted(l, key=lambda entry: entry["title"])
         return l
 
+    def get_last_insert_times(self):
+        """
+        :return: dict of the short name of each dataset to the insert_timestamp of its most recently ingested tile
+        """
+        search = "*:*"
+        params = {
+            "rows": 0,
+            "facet": "true",
+            "facet.pivot": "{!stats=piv1}dataset_s",
+            "stats": "on",
+            "stats.field": "{!tag=piv1 max=true}insert_timestamp"
+        }
+
+        response = self.do_query_raw(*(search, None, None, False, None), **params)
+
+        return {g["value"]: g["stats"]["stats_fields"]["insert_timestamp"]["max"]
+                for g in response.facet_counts["facet_pivot"]["dataset_s"]}
+
     def find_tile_by_bbox_and_most_recent_day_of_year(self, min_lat, max_lat, min_lon, max_lon, ds, day_of_year):
 
         search = 'dataset_s:%s' % ds
@@ -72,10 +229,28 @@ class SolrProxy(object):
 
     def find_days_in_range_asc(self, min_lat, max_lat, min_lon, max_lon, ds, start_time, end_time, **kwargs):
 
+        if self._days_cache is None or 'fq' in kwargs:
+            return self._find_days_in_range_asc(min_lat, max_lat, min_lon, max_lon, ds, start_time, end_time, **kwargs)
+
+        # Cache every day of the dataset in the box and take the range from it
+        key = (ds, _query_cache_generation(ds), min_lat, max_lat, min_lon, max_lon)
+        days = self._days_cache.get(key)
+        if days is None:
+            days = self._find_days_in_range_asc(min_lat, max_lat, min_lon, max_lon, ds, None, None, **kwargs)
+            self._days_cache.put(key, days)
+
+        # Solr compares whole seconds
+        return days[bisect_left(days, int(start_time)):bisect_right(days, int(end_time))]
+
+    def _find_days_in_range_asc(self, min_lat, max_lat, min_lon, max_lon, ds, start_time, end_time, **kwargs):
+
         search = 'dataset_s:%s' % ds
 
-        search_start_s = datetime.utcfromtimestamp(start_time).strftime('%Y-%m-%dT%H:%M:%SZ')
-        search_end_s = datetime.utcfromtimestamp(end_time).strftime('%Y-%m-%dT%H:%M:%SZ')
+        if start_time is None:
+            search_start_s = search_end_s = '*'
+        else:
+            search_start_s = datetime.utcfromtimestamp(start_time).strftime('%Y-%m-%dT%H:%M:%SZ')
+            search_end_s = datetime.utcfromtimestamp(end_time).strftime('%Y-%m-%dT%H:%M:%SZ')
 
         additionalparams = {
             'fq': [
@@ -104,6 +279,18 @@ class SolrProxy(object):
     def find_all_tiles_in_box_sorttimeasc(self, min_lat, max_lat, min_lon, max_lon, ds, start_time=0,
                                           end_time=-1, **kwargs):
 
+        return list(self.find_all_tiles_in_box_sorttimeasc_generator(min_lat, max_lat, min_lon, max_lon, ds,
+                                                                     start_time, end_time, **kwargs))
+
+    def find_all_tiles_in_box_sorttimeasc_generator(self, min_lat, max_lat, min_lon, max_lon, ds, start_time=0,
+                                                    end_time=-1, **kwargs):
+        """
+        Same as find_all_tiles_in_box_sorttimeasc but yields the tiles as the pages arrive.
+
+        If time_slices (kwarg, or solr.time_slices in the config) is more than 1 and a time range is given, the range
+        is split into that many disjoint slices on tile_min_time_dt that are fetched in parallel. Tiles are still
+        yielded in time order.
+        """
         search = 'dataset_s:%s' % ds
 
         additionalparams = {
@@ -128,13 +315,49 @@ class SolrProxy(object):
                           )
             additionalparams['fq'].append(time_clause)
 
+        time_slices = kwargs.pop('time_slices', self.time_slices)
+
         self._merge_kwargs(additionalparams, **kwargs)
 
-        return self.do_query_all(
-            *(search, None, None, False, 'tile_min_time_dt asc, tile_max_time_dt asc'),
-            **additionalparams)
+        args = (search, None, None, False, 'tile_min_time_dt asc, tile_max_time_dt asc')
+        if time_slices > 1 and 0 < start_time < end_time and 'start' not in additionalparams:
+            return self.do_query_all_time_sliced(start_time, end_time, time_slices, *args, **additionalparams)
+        else:
+            return self.do_query_all_generator(*args, **additionalparams)
+
+    def find_tile_summaries_generator(self, fields, inserted_after=None):
+        """
+        Yield the given fields of every tile of every dataset, or only of the tiles whose insert_timestamp is at or
+        after the datetime inserted_after.
+        """
+        search = '*:*'
+
+        additionalparams = {
+            'fq': []
+        }
+
+        if inserted_after is not None:
+            additionalparams['fq'].append(
+                "insert_timestamp:[%s TO *]" % inserted_after.strftime('%Y-%m-%dT%H:%M:%SZ'))
+
+        return self.do_query_all_generator(*(search, ','.join(fields), None, False, None), **additionalparams)
 
     def find_all_tiles_in_box_at_time(self, min_lat, max_lat, min_lon, max_lon, ds, time, **kwargs):
+        cacheable = self._tiles_cache is not None and 'fq' not in kwargs and 'start' not in kwargs
+        if cacheable:
+            key = (ds, _query_cache_generation(ds), 'at_time', time)
+            results = self._tiles_cache.get(key, min_lat, max_lat, min_lon, max_lon)
+            if results is not None:
+                return results
+
+        results = self._find_all_tiles_in_box_at_time(min_lat, max_lat, min_lon, max_lon, ds, time, **kwargs)
+
+        if cacheable:
+            self._tiles_cache.put(key, min_lat, max_lat, min_lon, max_lon, results)
+
+        return results
+
+    def _find_all_tiles_in_box_at_time(self, min_lat, max_lat, min_lon, max_lon, ds, time, **kwargs):
         search = 'dataset_s:%s' % ds
 
         the_time = datetime.utcfromtimestamp(time).strftime('%Y-%m-%dT%H:%M:%SZ')
@@ -181,6 +404,92 @@ class SolrProxy(object):
         return self.do_query_all(*(search, "product(tile_avg_val_d, tile_count_i),*", None, False, None),
                                  **additionalparams)
 
+    def find_daily_stats_within_box(self, min_lat, max_lat, min_lon, max_lon, ds, days, **kwargs):
+        """
+        Stats of the tiles within the box at each of days, a sorted list of seconds since the epoch, summed by Solr from
+        the tile summaries. Single-time tiles are summed by day with one JSON facet request; the few tiles that span
+        several days are fetched and added to each day they span.
+
+        :return: dict of each day with tiles within the box to a dict of their min, max, count, sum and sum_sq, and
+                 without_sums, the number of those tiles ingested before summaries had sums
+        """
+        search = 'dataset_s:%s' % ds
+
+        start_s = datetime.utcfromtimestamp(days[0]).strftime('%Y-%m-%dT%H:%M:%SZ')
+        end_s = datetime.utcfromtimestamp(days[-1]).strftime('%Y-%m-%dT%H:%M:%SZ')
+        within = [
+            "geo:\"Within(ENVELOPE(%s,%s,%s,%s))\"" % (min_lon, max_lon, max_lat, min_lat),
+            "tile_count_i:[1 TO *]"
+        ]
+
+        day_facet = {
+            "days": {
+                "type": "terms",
+                "field": "tile_min_time_dt",
+                "limit": -1,
+                "mincount": 1,
+                "sort": "index asc",
+                "facet": {
+                    "min": "min(tile_min_val_d)",
+                    "max": "max(tile_max_val_d)",
+                    "valid_count": "sum(tile_count_i)",
+                    "sum": "sum(tile_sum_val_d)",
+                    "sum_sq": "sum(tile_sum_sq_val_d)",
+                    "without_sums": {"type": "query", "q": "-tile_sum_sq_val_d:[* TO *]"}
+                }
+            }
+        }
+        additionalparams = {
+            'fq': within + [
+                "{!frange l=0 u=0}ms(tile_min_time_dt,tile_max_time_dt)",
+                "tile_min_time_dt:[%s TO %s]" % (start_s, end_s)
+            ],
+            'rows': 0,
+            'json_facet': json.dumps(day_facet)
+        }
+        self._merge_kwargs(additionalparams, **kwargs)
+
+        response = self.do_query_raw(*(search, None, None, False, None), **additionalparams)
+
+        stats_by_day = {}
+        # Solr leaves out the days facet when no tile matches
+        for bucket in getattr(response, 'facets', {}).get("days", {}).get("buckets", []):
+            stats_by_day[to_seconds(bucket["val"])] = {
+                "min": bucket["min"],
+                "max": bucket["max"],
+                "count": int(bucket["valid_count"]),
+                "sum": bucket.get("sum", 0.0),
+                "sum_sq": bucket.get("sum_sq", 0.0),
+                "without_sums": bucket["without_sums"]["count"]
+            }
+
+        additionalparams = {
+            'fq': within + [
+                "{!frange l=1}ms(tile_max_time_dt,tile_min_time_dt)",
+                "tile_min_time_dt:[* TO %s]" % end_s,
+                "tile_max_time_dt:[%s TO *]" % start_s
+            ]
+        }
+        self._merge_kwargs(additionalparams, **kwargs)
+
+        fields = "tile_min_time_dt,tile_max_time_dt,tile_min_val_d,tile_max_val_d,tile_count_i,tile_sum_val_d," \
+                 "tile_sum_sq_val_d"
+        for doc in self.do_query_all_generator(*(search, fields, None, False, None), **additionalparams):
+            for day in days[bisect_left(days, to_seconds(doc['tile_min_time_dt'])):
+                            bisect_right(days, to_seconds(doc['tile_max_time_dt']))]:
+                stats = stats_by_day.setdefault(int(day), {"min": float('inf'), "max": float('-inf'), "count": 0,
+                                                           "sum": 0.0, "sum_sq": 0.0, "without_sums": 0})
+                stats["min"] = min(stats["min"], doc['tile_min_val_d'])
+                stats["max"] = max(stats["max"], doc['tile_max_val_d'])
+                stats["count"] += doc['tile_count_i']
+                if 'tile_sum_sq_val_d' in doc:
+                    stats["sum"] += doc['tile_sum_val_d']
+                    stats["sum_sq"] += doc['tile_sum_sq_val_d']
+                else:
+                    stats["without_sums"] += 1
+
+        return stats_by_day
+
     def find_all_boundary_tiles_at_time(self, min_lat, max_lat, min_lon, max_lon, ds, time, **kwargs):
         search = 'dataset_s:%s' % ds
 
@@ -215,24 +524,117 @@ class SolrProxy(object):
 
     def do_query_raw(self, *args, **params):
 
-        response = self.solrcon.select(*args, **params)
+        with span('solr.query'), self._connection_pool().connection() as solrcon:
+            response = solrcon.select(*args, **params)
 
+        add_count('solr_docs', len(response.results))
         return response
 
     def do_query_all(self, *args, **params):
 
-        results = []
-        response = self.solrcon.select(*args, **params)
-        results.extend(response.results)
-
-        while len(results) < response.numFound:
-            params['start'] = len(results)
-            response = self.solrcon.select(*args, **params)
-            results.extend(response.results)
-
-        assert len(results) == response.numFound
+        return list(self.do_query_all_generator(*args, **params))
+
+    def do_query_all_generator(self, *args, **params):
+        """
+        Yield every document matching the query, fetching one page of rows (default solr.rows_per_page) at a time.
+        Each page is fetched with a connection from the pool so the generator can be consumed on any thread.
+        """
+        return self._query_all_generator(args, params)
+
+    def _query_all_generator(self, args, params):
+        params = dict(params)
+        params.setdefault('rows', self.rows_per_page)
+
+        if 'start' in params:
+            # A cursor cannot be combined with an offset
+            for doc in self._query_all_by_offset(args, params):
+                yield doc
+            return
+
+        # Deep paging with a cursor needs a sort that ends on the unique key
+        args = self._with_unique_key_sort(args)
+        params['cursorMark'] = '*'
+        while True:
+            start = time.time()
+            response = self.do_query_raw(*args, **params)
+            self.logger.debug("Fetched page of %d documents in %.4f seconds" % (len(response.results),
+                                                                                time.time() - start))
+
+            for doc in response.results:
+                yield doc
+
+            if response.nextCursorMark == params['cursorMark']:
+                break
+            params['cursorMark'] = response.nextCursorMark
+
+    def _query_all_by_offset(self, args, params):
+        response = self.do_query_raw(*args, **params)
+        found = len(response.results)
+        for doc in response.results:
+            yield doc
+
+        while found < response.numFound:
+            params['start'] = params.get('start', 0) + len(response.results)
+            response = self.do_query_raw(*args, **params)
+            if len(response.results) == 0:
+                break
+            found += len(response.results)
+            for doc in response.results:
+                yield doc
+
+    def do_query_all_time_sliced(self, start_time, end_time, time_slices, *args, **params):
+        """
+        Yield every document matching the query, splitting [start_time, end_time] into time_slices disjoint ranges on
+        tile_min_time_dt that are fetched in parallel. The first and last slices are
+        open ended so documents with a tile_min_time_dt outside the range are still found. Documents are yielded slice
+        by slice, so if the query sorts on tile_min_time_dt first they come out in sorted order.
+        """
+        step = float(end_time - start_time) / time_slices
+        bounds = [datetime.utcfromtimestamp(int(start_time + step * i)).strftime('%Y-%m-%dT%H:%M:%SZ')
+                  for i in xrange(1, time_slices)]
+        lower_bounds = ['*'] + bounds
+        upper_bounds = bounds + ['*']
+
+        slice_params = []
+        for lower, upper in zip(lower_bounds, upper_bounds):
+            a_slice_params = dict(params)
+            a_slice_params['fq'] = list(params.get('fq', [])) + [
+                "tile_min_time_dt:[%s TO %s%s" % (lower, upper, ']' if upper == '*' else '}')]
+            slice_params.append(a_slice_params)
+
+        trace = current_trace()
+
+        def fetch_slice(a_slice_params):
+            attach(trace)
+            try:
+                return list(self._query_all_generator(args, a_slice_params))
+            finally:
+                attach(None)
+
+        pool = ThreadPool(processes=time_slices)
+        try:
+            for docs in pool.imap(fetch_slice, slice_params):
+                for doc in docs:
+                    yield doc
+        finally:
+            pool.terminate()
 
-        return results
+    @staticmethod
+    def _with_unique_key_sort(args):
+        args = list(args) + [None] * (5 - len(args))
+        sort = args[4]
+        if sort is None:
+            sort = []
+        elif isinstance(sort, basestring):
+            sort = [field.strip() for field in sort.split(',')]
+        else:
+            sort = list(sort)
+
+        if 'id' not in [field.split()[0] for field in sort]:
+            sort.append('id asc')
+
+        args[4] = ', '.join(sort)
+        return args
 
     @staticmethod
     def _merge_kwargs(additionalparams, **kwargs):
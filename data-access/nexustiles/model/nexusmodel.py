@@ -7,8 +7,13 @@ from collections import namedtuple
 import numpy as np
 
 NexusPoint = namedtuple('NexusPoint', 'latitude longitude depth time index data_val')
+# Columns of many points: 1-d arrays of latitude, longitude, time and data_val and an array of index with one row per
+# point
+NexusPoints = namedtuple('NexusPoints', 'latitude longitude time index data_val')
 BBox = namedtuple('BBox', 'min_lat max_lat min_lon max_lon')
 TileStats = namedtuple('TileStats', 'min max mean count')
+# Count, sum and sum of squares of the valid data of a tile inside a box
+BoxStats = namedtuple('BoxStats', 'count sum sum_of_squares')
 
 
 class Tile(object):
@@ -33,6 +38,10 @@ class Tile(object):
 
         self.meta_data = None  # This should be a dict of the form { 'meta_data_name' : [[[ndarray]]] }. Each ndarray should be the same shape as data.
 
+        # Swath tiles are sparse: latitudes, longitudes, times, data and each meta_data array are 1-d ndarrays with one
+        # entry per point and swath_shape is the shape of the swath the points were read from (None for grid tiles).
+        self.swath_shape = None
+
     def __str__(self):
         return self.get_summary()
 
@@ -48,24 +57,36 @@ class Tile(object):
 
         return summary
 
-    def nexus_point_generator(self, include_nan=False):
+    def is_swath(self):
+        return self.swath_shape is not None
+
+    def nexus_points(self, include_nan=False):
+        """
+        The points of this tile as a NexusPoints of arrays, in the same order as nexus_point_generator. Unless
+        include_nan, only the cells that nexus_point_generator yields (unmasked and non-zero) are included.
+        """
         if include_nan:
-            for index in np.ndindex(self.data.shape):
-                time = self.times[index[0]]
-                lat = self.latitudes[index[1]]
-                lon = self.longitudes[index[2]]
-                data_val = self.data[index]
-                point = NexusPoint(lat, lon, None, time, index, data_val)
-                yield point
+            flat_indices = np.arange(self.data.size)
         else:
-            for index in np.transpose(np.nonzero(self.data)):
-                index = tuple(index)
-                time = self.times[index[0]]
-                lat = self.latitudes[index[1]]
-                lon = self.longitudes[index[2]]
-                data_val = self.data[index]
-                point = NexusPoint(lat, lon, None, time, index, data_val)
-                yield point
+            flat_indices = np.flatnonzero(np.ma.filled(self.data, 0))
+
+        data_vals = self.data.reshape(-1)[flat_indices]
+
+        if self.is_swath():
+            # Swath arrays hold one entry per point and the index is the point's index in the swath
+            index = np.unravel_index(flat_indices, self.swath_shape)
+            return NexusPoints(self.latitudes[flat_indices], self.longitudes[flat_indices], self.times[flat_indices],
+                               np.column_stack(index), data_vals)
+
+        index = np.unravel_index(flat_indices, self.data.shape)
+        return NexusPoints(self.latitudes[index[1]], self.longitudes[index[2]], self.times[index[0]],
+                           np.column_stack(index), data_vals)
+
+    def nexus_point_generator(self, include_nan=False):
+        points = self.nexus_points(include_nan)
+        for i in xrange(len(points.data_val)):
+            yield NexusPoint(points.latitude[i], points.longitude[i], None, points.time[i], tuple(points.index[i]),
+                             points.data_val[i])
 
     def contains_point(self, lat, lon):
         return (
@@ -77,6 +98,21 @@ class Tile(object):
                )
 
 
+def get_nexus_points(tiles, include_nan=False):
+    """
+    The points of all tiles as one NexusPoints of arrays, see Tile.nexus_points, and an array with the position in
+    tiles of the tile each point came from.
+    """
+    tile_points = [tile.nexus_points(include_nan) for tile in tiles]
+    if len(tile_points) == 0:
+        return NexusPoints(*[np.array([]) for _ in NexusPoints._fields]), np.array([], dtype=int)
+
+    points = NexusPoints(*[np.ma.concatenate(column) for column in zip(*tile_points)])
+    tile_positions = np.repeat(np.arange(len(tile_points)), [len(p.data_val) for p in tile_points])
+
+    return points, tile_positions
+
+
 def get_approximate_value_for_lat_lon(tile_list, lat, lon, arrayName=None):
     """
     This function pulls the value out of one of the tiles in tile_list that is the closest to the given
@@ -116,3 +152,83 @@ def get_approximate_value_for_lat_lon(tile_list, lat, lon, arrayName=None):
         return None
 
     return data_val.item() if (data_val is not np.ma.masked) and data_val.size == 1 else float('Nan')
+
+
+def get_approximate_values_for_lat_lons(tile_list, lats, lons, arrayName=None):
+    """
+    Vectorized get_approximate_value_for_lat_lon for arrays of lats and lons. Each point is assigned to the first
+    grid tile in tile_list that contains it and its cell is found with a binary search over the tile's coordinates.
+
+    :returns (values, valid) arrays with one entry per point. valid is False, and the value NaN, where the point is not
+    contained in any tile or the value is masked.
+    """
+    lats = np.asarray(lats, dtype=float)
+    lons = np.asarray(lons, dtype=float)
+
+    values = np.full(lats.shape, np.nan)
+    valid = np.zeros(lats.shape, dtype=bool)
+    assigned = np.zeros(lats.shape, dtype=bool)
+
+    for tile in tile_list:
+        if tile.is_swath():
+            continue
+
+        in_tile = ~assigned & _contains_points(tile.bbox, lats, lons)
+        if not np.any(in_tile):
+            continue
+        assigned |= in_tile
+
+        lat_idx = _approximate_indices(tile.latitudes, lats[in_tile])
+        lon_idx = _approximate_indices(tile.longitudes, lons[in_tile])
+        found = (lat_idx >= 0) & (lon_idx >= 0)
+
+        if arrayName is None or arrayName == "data":
+            array = tile.data
+        else:
+            array = tile.meta_data[arrayName]
+        if array.ndim == 3:
+            array = array[0]
+
+        tile_values = np.full(lat_idx.shape, np.nan)
+        tile_values[found] = np.ma.getdata(array)[lat_idx[found], lon_idx[found]]
+        found[found] = ~np.ma.getmaskarray(array)[lat_idx[found], lon_idx[found]]
+        tile_values[~found] = np.nan
+
+        values[in_tile] = tile_values
+        valid[in_tile] = found & ~np.isnan(tile_values)
+
+    return values, valid
+
+
+def _contains_points(bbox, lats, lons):
+    # Same as Tile.contains_point for arrays of lats and lons
+    return ((bbox.min_lat < lats) | np.isclose(bbox.min_lat, lats)) \
+           & ((lats < bbox.max_lat) | np.isclose(lats, bbox.max_lat)) \
+           & ((bbox.min_lon < lons) | np.isclose(bbox.min_lon, lons)) \
+           & ((lons < bbox.max_lon) | np.isclose(lons, bbox.max_lon))
+
+
+def _approximate_indices(coordinates, points):
+    """
+    Index of each point in coordinates as chosen by get_approximate_value_for_lat_lon: the coordinate close to the
+    point or else the last coordinate smaller than the point. -1 where there is none or the coordinate is masked.
+    """
+    values = np.ma.getdata(coordinates)
+    masked = np.ma.getmaskarray(coordinates)
+
+    if len(values) > 1 and np.all(np.diff(values) > 0):
+        after = np.searchsorted(values, points, side='left')
+        before = after - 1
+        close_before = (before >= 0) & np.isclose(values[np.maximum(before, 0)], points)
+        close_after = (after < len(values)) & np.isclose(values[np.minimum(after, len(values) - 1)], points)
+        indices = np.where(close_before, before, np.where(close_after, after, before))
+    else:
+        # Unsorted coordinates, compare every point with every coordinate
+        close = np.isclose(values[np.newaxis, :], points[:, np.newaxis])
+        smaller = values[np.newaxis, :] < points[:, np.newaxis]
+        last_smaller = len(values) - 1 - np.argmax(smaller[:, ::-1], axis=1)
+        indices = np.where(close.any(axis=1), np.argmax(close, axis=1),
+                           np.where(smaller.any(axis=1), last_smaller, -1))
+
+    indices[(indices >= 0) & masked[np.maximum(indices, 0)]] = -1
+    return indices
@@ -2,17 +2,124 @@
 Copyright (c) 2016 Jet Propulsion Laboratory,
 California Institute of Technology.  All rights reserved
 """
+from collections import OrderedDict
 from functools import wraps
 import ConfigParser
+import os
 import pkg_resources
+import threading
 from StringIO import StringIO
 
 import numpy as np
 import numpy.ma as ma
 
-from dao.CassandraProxy import CassandraProxy
-from dao.SolrProxy import SolrProxy
-from model.nexusmodel import Tile, BBox, TileStats
+from cache import LRUCache, nbytes, read_only, view_of
+from catalog import TileCatalog
+from dao.CassandraProxy import CassandraProxy, SUMMED_AREA_COUNT, SUMMED_AREA_SUM, SUMMED_AREA_SUM_OF_SQUARES
+from dao.SolrProxy import SolrProxy, invalidate_query_caches
+from model.nexusmodel import Tile, BBox, BoxStats, TileStats
+from prefetch import prefetched_batches
+from tracing import add_count, span, traced_methods
+
+# Decoded tile data shared by every NexusTileService in the process, see get_tile_cache
+_tile_cache = None
+_tile_cache_lock = threading.Lock()
+
+# Tile summaries shared by every NexusTileService in the process, see get_tile_catalog
+_tile_catalog = None
+_tile_catalog_pid = None
+_tile_catalog_lock = threading.Lock()
+
+# NexusTileServices shared by the process by (skipCassandra, skipSolr), see get_tile_service
+_tile_services = {}
+_tile_services_pid = None
+_tile_services_lock = threading.Lock()
+
+
+def get_tile_service(skipCassandra=False, skipSolr=False):
+    """
+    Return the NexusTileService shared by every caller in the process, creating it on first use. NexusTileService is
+    thread-safe and its Cassandra session and Solr connection pool are set up once per process, so use this instead of
+    creating a NexusTileService per request or task. A process forked after the service was created gets a new one.
+    """
+    global _tile_services, _tile_services_pid
+
+    with _tile_services_lock:
+        if _tile_services_pid != os.getpid():
+            _tile_services = {}
+            _tile_services_pid = os.getpid()
+
+        key = (skipCassandra, skipSolr)
+        if key not in _tile_services:
+            _tile_services[key] = NexusTileService(skipCassandra, skipSolr)
+
+        return _tile_services[key]
+
+
+def get_tile_cache(config):
+    """
+    Return the process-wide cache of decoded tile data, creating it from the [cache] section of config on first use.
+    Returns None if the cache is disabled (size_mb = 0).
+    """
+    global _tile_cache
+
+    with _tile_cache_lock:
+        if _tile_cache is None:
+            try:
+                size_mb = config.getfloat("cache", "size_mb")
+            except ConfigParser.Error:
+                size_mb = 0
+            try:
+                ttl_seconds = config.getfloat("cache", "ttl_seconds") or None
+            except ConfigParser.Error:
+                ttl_seconds = None
+
+            if size_mb <= 0:
+                return None
+
+            _tile_cache = LRUCache(int(size_mb * 1024 * 1024), nbytes, ttl_seconds=ttl_seconds)
+
+        return _tile_cache
+
+
+def get_tile_catalog(config):
+    """
+    Return the process-wide catalog of tile summaries, creating and starting it from the [catalog] section of config on
+    first use. Returns None if the catalog is disabled.
+    """
+    global _tile_catalog, _tile_catalog_pid
+
+    with _tile_catalog_lock:
+        if _tile_catalog is not None and _tile_catalog_pid != os.getpid():
+            # The refresh thread does not survive a fork and the Solr connections of the parent cannot be used, the
+            # tiles already loaded can
+            _tile_catalog = _tile_catalog.copy(SolrProxy(config))
+            _tile_catalog.start()
+            _tile_catalog_pid = os.getpid()
+
+        if _tile_catalog is None:
+            try:
+                enabled = config.getboolean("catalog", "enabled")
+            except ConfigParser.Error:
+                enabled = False
+            if not enabled:
+                return None
+
+            try:
+                refresh_seconds = config.getfloat("catalog", "refresh_seconds")
+            except ConfigParser.Error:
+                refresh_seconds = 60
+            try:
+                max_age_seconds = config.getfloat("catalog", "max_age_seconds")
+            except ConfigParser.Error:
+                max_age_seconds = 300
+
+            _tile_catalog = TileCatalog(SolrProxy(config), refresh_seconds=refresh_seconds,
+                                        max_age_seconds=max_age_seconds)
+            _tile_catalog.start()
+            _tile_catalog_pid = os.getpid()
+
+        return _tile_catalog
 
 
 def tile_data(default_fetch=True):
@@ -34,26 +141,78 @@ def tile_data(default_fetch=True):
     return tile_data_decorator
 
 
+def _sorted_index_range(coordinates, lower, upper):
+    """
+    Slice of the coordinates between lower and upper (inclusive). coordinates must be sorted, ascending or descending.
+    """
+    values = ma.getdata(coordinates)
+    if len(values) > 1 and values[0] > values[-1]:
+        reversed_values = values[::-1]
+        return slice(len(values) - np.searchsorted(reversed_values, upper, side='right'),
+                     len(values) - np.searchsorted(reversed_values, lower, side='left'))
+
+    return slice(np.searchsorted(values, lower, side='left'), np.searchsorted(values, upper, side='right'))
+
+
+@traced_methods('tileservice')
 class NexusTileService(object):
     def __init__(self, skipCassandra=False, skipSolr=False):
         self._config = ConfigParser.RawConfigParser()
 
         self._config.readfp(pkg_resources.resource_stream(__name__, "config/datastores.ini"), filename='datastores.ini')
 
+        self._tile_cache = None
         if not skipCassandra:
             self._cass = CassandraProxy(self._config)
+            self._tile_cache = get_tile_cache(self._config)
 
+        self._catalog = None
         if not skipSolr:
             self._solr = SolrProxy(self._config)
+            self._catalog = get_tile_catalog(self._config)
+
+    def get_tile_cache_stats(self):
+        """
+        :return: cache.CacheStats of the tile data cache or None if the cache is disabled
+        """
+        return self._tile_cache.stats() if self._tile_cache is not None else None
+
+    def get_query_cache_stats(self):
+        """
+        :return: See SolrProxy.get_query_cache_stats
+        """
+        return self._solr.get_query_cache_stats()
+
+    def get_query_cache_ttl(self):
+        """
+        :return: See SolrProxy.get_query_cache_ttl
+        """
+        return self._solr.get_query_cache_ttl()
+
+    def invalidate_query_caches(self, dataset):
+        """
+        See SolrProxy.invalidate_query_caches, for every NexusTileService in the process.
+        """
+        invalidate_query_caches(dataset)
 
     def get_dataseries_list(self):
         return self._solr.get_data_series_list()
 
+    def get_last_insert_times(self):
+        """
+        :return: See SolrProxy.get_last_insert_times
+        """
+        return self._solr.get_last_insert_times()
+
     @tile_data()
     def find_tile_by_id(self, tile_id, **kwargs):
         return self._solr.find_tile_by_id(tile_id)
 
     def find_days_in_range_asc(self, min_lat, max_lat, min_lon, max_lon, dataset, start_time, end_time, **kwargs):
+        catalog = self._catalog_for(dataset, **kwargs)
+        if catalog is not None:
+            return catalog.find_days_in_range(min_lat, max_lat, min_lon, max_lon, start_time, end_time)
+
         return self._solr.find_days_in_range_asc(min_lat, max_lat, min_lon, max_lon, dataset, start_time, end_time,
                                                  **kwargs)
 
@@ -65,27 +224,76 @@ class NexusTileService(object):
 
     @tile_data()
     def find_all_tiles_in_box_at_time(self, min_lat, max_lat, min_lon, max_lon, dataset, time, **kwargs):
+        catalog = self._catalog_for(dataset, **kwargs)
+        if catalog is not None:
+            return catalog.find_tiles_in_box(min_lat, max_lat, min_lon, max_lon, time, time)
+
         return self._solr.find_all_tiles_in_box_at_time(min_lat, max_lat, min_lon, max_lon, dataset, time, rows=5000,
                                                         **kwargs)
 
     @tile_data()
     def find_tiles_in_box(self, min_lat, max_lat, min_lon, max_lon, ds=None, start_time=0, end_time=-1, **kwargs):
+        catalog = self._catalog_for(ds, **kwargs)
+        if catalog is not None:
+            catalog_start_time, catalog_end_time = self._catalog_time_range(start_time, end_time)
+            return catalog.find_tiles_in_box(min_lat, max_lat, min_lon, max_lon, catalog_start_time, catalog_end_time)
+
         # Find chunks that fall in the given box in the Solr index
         return self._solr.find_all_tiles_in_box_sorttimeasc(min_lat, max_lat, min_lon, max_lon, ds, start_time,
                                                             end_time, **kwargs)
 
     @tile_data()
     def find_all_boundary_tiles_at_time(self, min_lat, max_lat, min_lon, max_lon, dataset, time, **kwargs):
+        catalog = self._catalog_for(dataset, **kwargs)
+        if catalog is not None:
+            return catalog.find_boundary_tiles(min_lat, max_lat, min_lon, max_lon, time, time)
+
         return self._solr.find_all_boundary_tiles_at_time(min_lat, max_lat, min_lon, max_lon, dataset, time, rows=5000,
                                                           **kwargs)
 
     def get_tiles_bounded_by_box(self, min_lat, max_lat, min_lon, max_lon, ds=None, start_time=0, end_time=-1,
-                                 **kwargs):
+                                 crop=False, **kwargs):
         tiles = self.find_tiles_in_box(min_lat, max_lat, min_lon, max_lon, ds, start_time, end_time, **kwargs)
-        tiles = self.mask_tiles_to_bbox(min_lat, max_lat, min_lon, max_lon, tiles)
+        tiles = self.mask_tiles_to_bbox(min_lat, max_lat, min_lon, max_lon, tiles, crop=crop)
 
         return tiles
 
+    def get_tile_batches_bounded_by_box_generator(self, min_lat, max_lat, min_lon, max_lon, ds=None, start_time=0,
+                                                  end_time=-1, batch_size=100, prefetch=2, crop=False, **kwargs):
+        """
+        Generator of lists of at most batch_size tiles in the box, in time order, with their data masked (or cropped,
+        see mask_tiles_to_bbox) to the box.
+
+        The Solr pages and tile data are fetched on a background thread that stays at most prefetch batches ahead of
+        the caller. Memory use depends on batch_size and prefetch, not on the length of the time range.
+        """
+
+        def load(solr_docs):
+            tiles = self._solr_docs_to_tiles(*solr_docs)
+            self.fetch_data_for_tiles(*tiles)
+            return self.mask_tiles_to_bbox(min_lat, max_lat, min_lon, max_lon, tiles, crop=crop)
+
+        catalog = self._catalog_for(ds, **kwargs)
+        if catalog is not None:
+            catalog_start_time, catalog_end_time = self._catalog_time_range(start_time, end_time)
+            solr_docs = catalog.find_tiles_in_box(min_lat, max_lat, min_lon, max_lon, catalog_start_time,
+                                                  catalog_end_time)
+        else:
+            solr_docs = self._solr.find_all_tiles_in_box_sorttimeasc_generator(min_lat, max_lat, min_lon, max_lon, ds,
+                                                                               start_time, end_time, **kwargs)
+
+        return prefetched_batches(solr_docs, batch_size, load=load, depth=prefetch)
+
+    def get_tiles_bounded_by_box_generator(self, min_lat, max_lat, min_lon, max_lon, ds=None, start_time=0,
+                                           end_time=-1, batch_size=100, prefetch=2, crop=False, **kwargs):
+        """
+        Same as get_tile_batches_bounded_by_box_generator but yields one tile at a time.
+        """
+        for tiles in self.get_tile_batches_bounded_by_box_generator(min_lat, max_lat, min_lon, max_lon, ds, start_time,
+                                                                    end_time, batch_size, prefetch, crop, **kwargs):
+            for tile in tiles:
+                yield tile
+
     def get_tiles_bounded_by_box_at_time(self, min_lat, max_lat, min_lon, max_lon, dataset, time, **kwargs):
         tiles = self.find_all_tiles_in_box_at_time(min_lat, max_lat, min_lon, max_lon, dataset, time, **kwargs)
         tiles = self.mask_tiles_to_bbox(min_lat, max_lat, min_lon, max_lon, tiles)
@@ -104,43 +312,195 @@ class NexusTileService(object):
 
         return tiles
 
-    def mask_tiles_to_bbox(self, min_lat, max_lat, min_lon, max_lon, tiles):
+    def get_daily_stats_within_box(self, min_lat, max_lat, min_lon, max_lon, dataset, days, **kwargs):
+        """
+        Stats of the tiles within the box at each of days, summed by Solr from the tile summaries without reading any
+        tile data. See SolrProxy.find_daily_stats_within_box.
+        """
+        return self._solr.find_daily_stats_within_box(min_lat, max_lat, min_lon, max_lon, dataset, days, **kwargs)
+
+    def _catalog_for(self, dataset, **kwargs):
+        """
+        The catalog of dataset to answer a search from, or None if the search has to go to Solr because the catalog
+        is disabled or stale or the search has Solr-specific arguments.
+        """
+        if self._catalog is None or 'fq' in kwargs or 'start' in kwargs:
+            return None
+
+        return self._catalog.get(dataset)
+
+    @staticmethod
+    def _catalog_time_range(start_time, end_time):
+        # Same as SolrProxy.find_all_tiles_in_box_sorttimeasc, which only filters on time for a valid range
+        if 0 < start_time <= end_time:
+            return start_time, end_time
+        return None, None
+
+    def mask_tiles_to_bbox(self, min_lat, max_lat, min_lon, max_lon, tiles, crop=False):
+        """
+        Mask the data of tiles outside of the box.
+
+        With crop, grid tiles are instead cut down to the rows and columns whose latitude and longitude are in the box.
+        The cropped latitudes, longitudes, data and meta data are views of the original arrays and the data only gets a
+        new mask if some of the remaining cells are invalid. Algorithms that look up values by position in the tile
+        rather than by latitude and longitude must not use crop. Swath tiles are always masked.
+        """
 
         for tile in tiles:
+            if crop and not tile.is_swath():
+                self._crop_tile_to_bbox(min_lat, max_lat, min_lon, max_lon, tile)
+                continue
+
             tile.latitudes = ma.masked_outside(tile.latitudes, min_lat, max_lat)
             tile.longitudes = ma.masked_outside(tile.longitudes, min_lon, max_lon)
 
             # Or together the masks of the individual arrays to create the new mask
-            data_mask = ma.getmaskarray(tile.times)[:, np.newaxis, np.newaxis] \
-                        | ma.getmaskarray(tile.latitudes)[np.newaxis, :, np.newaxis] \
-                        | ma.getmaskarray(tile.longitudes)[np.newaxis, np.newaxis, :]
+            if tile.is_swath():
+                # Swath arrays hold one entry per point
+                data_mask = ma.getmaskarray(tile.times) \
+                            | ma.getmaskarray(tile.latitudes) \
+                            | ma.getmaskarray(tile.longitudes)
+            else:
+                data_mask = ma.getmaskarray(tile.times)[:, np.newaxis, np.newaxis] \
+                            | ma.getmaskarray(tile.latitudes)[np.newaxis, :, np.newaxis] \
+                            | ma.getmaskarray(tile.longitudes)[np.newaxis, np.newaxis, :]
 
             tile.data = ma.masked_where(data_mask, tile.data)
 
         return tiles
 
+    @staticmethod
+    def _crop_tile_to_bbox(min_lat, max_lat, min_lon, max_lon, tile):
+        lat_slice = _sorted_index_range(tile.latitudes, min_lat, max_lat)
+        lon_slice = _sorted_index_range(tile.longitudes, min_lon, max_lon)
+
+        tile.latitudes = tile.latitudes[lat_slice]
+        tile.longitudes = tile.longitudes[lon_slice]
+        tile.data = tile.data[:, lat_slice, lon_slice]
+        tile.meta_data = {name: meta_array[..., lat_slice, lon_slice] if isinstance(meta_array, np.ndarray)
+                          else meta_array for name, meta_array in tile.meta_data.iteritems()}
+
+        # Only masked coordinates are left to mask
+        data_mask = ma.getmaskarray(tile.times)[:, np.newaxis, np.newaxis] \
+                    | ma.getmaskarray(tile.latitudes)[np.newaxis, :, np.newaxis] \
+                    | ma.getmaskarray(tile.longitudes)[np.newaxis, np.newaxis, :]
+        if np.any(data_mask):
+            tile.data = ma.array(tile.data, mask=ma.getmaskarray(tile.data) | data_mask, copy=False)
+
     def fetch_data_for_tiles(self, *tiles):
 
         nexus_tile_ids = set([tile.tile_id for tile in tiles])
-        matched_tile_data = self._cass.fetch_nexus_tiles(*nexus_tile_ids)
-        tile_data_by_id = {str(a_tile_data.tile_id): a_tile_data for a_tile_data in matched_tile_data}
+
+        tile_data_by_id = {}
+        if self._tile_cache is not None:
+            for tile_id in nexus_tile_ids:
+                cached_tile_data = self._tile_cache.get(tile_id)
+                if cached_tile_data is not None:
+                    tile_data_by_id[tile_id] = cached_tile_data
+            add_count('tile_cache_hits', len(tile_data_by_id))
+
+        # Keep the request order so the bulk fetch returns tiles in the same order they were asked for
+        ordered_tile_ids = [tile_id for tile_id in OrderedDict.fromkeys([tile.tile_id for tile in tiles]).keys()
+                            if tile_id not in tile_data_by_id]
+        if len(ordered_tile_ids) > 0:
+            for a_tile_data in self._cass.fetch_nexus_tiles(*ordered_tile_ids):
+                tile_data_by_id[str(a_tile_data.tile_id)] = self._decode_tile_data(a_tile_data)
 
         missing_data = nexus_tile_ids.difference(tile_data_by_id.keys())
         if len(missing_data) > 0:
             raise StandardError("Missing data for tile_id(s) %s." % missing_data)
 
         for a_tile in tiles:
-            lats, lons, times, data, meta = tile_data_by_id[a_tile.tile_id].get_lat_lon_time_data_meta()
+            self._set_tile_data(a_tile, tile_data_by_id[a_tile.tile_id])
 
-            a_tile.latitudes = lats
-            a_tile.longitudes = lons
-            a_tile.times = times
-            a_tile.data = data
-            a_tile.meta_data = meta
+        return tiles
 
-            del (tile_data_by_id[a_tile.tile_id])
+    def get_stats_in_box_for_tiles(self, min_lat, max_lat, min_lon, max_lon, tiles):
+        """
+        Count, sum and sum of squares of the valid data of each of tiles inside the box, without fetching the data of
+        tiles into them.
 
-        return tiles
+        Grid tiles ingested with summed-area tables are answered from four corners of each table without decoding
+        their data. The data of the other tiles is taken from the tile cache or fetched, and masked to the box.
+
+        :return: List of BoxStats in the order of tiles
+        """
+        nexus_tile_ids = set([tile.tile_id for tile in tiles])
+
+        tile_data_by_id = {}
+        if self._tile_cache is not None:
+            for tile_id in nexus_tile_ids:
+                cached_tile_data = self._tile_cache.get(tile_id)
+                if cached_tile_data is not None:
+                    tile_data_by_id[tile_id] = cached_tile_data
+            add_count('tile_cache_hits', len(tile_data_by_id))
+
+        stats_by_id = {}
+        ordered_tile_ids = [tile_id for tile_id in OrderedDict.fromkeys([tile.tile_id for tile in tiles]).keys()
+                            if tile_id not in tile_data_by_id]
+        if len(ordered_tile_ids) > 0:
+            for a_tile_data in self._cass.fetch_nexus_tiles(*ordered_tile_ids):
+                tile_id = str(a_tile_data.tile_id)
+                with span('decode'):
+                    summed_area = a_tile_data.get_summed_area_tables()
+
+                # The tables count every cell, so tiles with invalid coordinates are masked like any other tile
+                if summed_area is not None and ma.count_masked(summed_area[0]) == 0 and \
+                        ma.count_masked(summed_area[1]) == 0:
+                    stats_by_id[tile_id] = self._summed_area_box_stats(min_lat, max_lat, min_lon, max_lon,
+                                                                       *summed_area)
+                else:
+                    tile_data_by_id[tile_id] = self._decode_tile_data(a_tile_data)
+            add_count('summed_area_tiles', len(stats_by_id))
+
+        for tile_id, tile_data in tile_data_by_id.iteritems():
+            a_tile = Tile()
+            self._set_tile_data(a_tile, tile_data)
+            self.mask_tiles_to_bbox(min_lat, max_lat, min_lon, max_lon, [a_tile])
+
+            values = a_tile.data.compressed().astype(np.float64)
+            stats_by_id[tile_id] = BoxStats(values.size, np.sum(values).item(), np.sum(np.square(values)).item())
+
+        missing_data = nexus_tile_ids.difference(stats_by_id.keys())
+        if len(missing_data) > 0:
+            raise StandardError("Missing data for tile_id(s) %s." % missing_data)
+
+        return [stats_by_id[tile.tile_id] for tile in tiles]
+
+    @staticmethod
+    def _summed_area_box_stats(min_lat, max_lat, min_lon, max_lon, latitudes, longitudes, tables):
+        lat_slice = _sorted_index_range(latitudes, min_lat, max_lat)
+        lon_slice = _sorted_index_range(longitudes, min_lon, max_lon)
+        r0, r1 = lat_slice.start, max(lat_slice.start, lat_slice.stop)
+        c0, c1 = lon_slice.start, max(lon_slice.start, lon_slice.stop)
+
+        def box_sum(name):
+            # As python numbers, the count tables are unsigned
+            table = tables[name]
+            return table[r1, c1].item() - table[r0, c1].item() - table[r1, c0].item() + table[r0, c0].item()
+
+        return BoxStats(box_sum(SUMMED_AREA_COUNT), box_sum(SUMMED_AREA_SUM), box_sum(SUMMED_AREA_SUM_OF_SQUARES))
+
+    def _decode_tile_data(self, a_tile_data):
+        with span('decode'):
+            lats_lons_times_data_meta = a_tile_data.get_lat_lon_time_data_meta() + (a_tile_data.get_swath_shape(),)
+
+        if self._tile_cache is not None:
+            # Cached arrays are shared by every request so make sure none of them can change them
+            self._tile_cache.put(str(a_tile_data.tile_id), read_only(lats_lons_times_data_meta))
+
+        return lats_lons_times_data_meta
+
+    @staticmethod
+    def _set_tile_data(a_tile, tile_data):
+        lats, lons, times, data, meta, swath_shape = view_of(tile_data)
+
+        a_tile.latitudes = lats
+        a_tile.longitudes = lons
+        a_tile.times = times
+        a_tile.data = data
+        a_tile.meta_data = meta
+        a_tile.swath_shape = swath_shape
 
     def _solr_docs_to_tiles(self, *solr_docs):
 
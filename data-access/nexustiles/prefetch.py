@@ -0,0 +1,72 @@
+"""
+Copyright (c) 2016 Jet Propulsion Laboratory,
+California Institute of Technology.  All rights reserved
+"""
+import sys
+import threading
+from Queue import Queue, Full
+
+from tracing import attach, current_trace
+
+_END = object()
+
+
+def prefetched_batches(items, batch_size, load=list, depth=2):
+    """
+    Generator that yields load(batch) for consecutive batches of at most batch_size elements of items.
+
+    Reading items and calling load happen on a background thread that works ahead of the caller by at most depth
+    batches, so at most depth + 2 loaded batches (queued, being loaded and being used by the caller) are held in memory
+    at once. Exceptions raised while reading or loading are raised from this generator. Closing the generator before
+    it is exhausted stops the background thread.
+    """
+    loaded = Queue(maxsize=max(depth, 1))
+    stop = threading.Event()
+    trace = current_trace()
+
+    def put(entry):
+        while not stop.is_set():
+            try:
+                loaded.put(entry, timeout=0.1)
+                return True
+            except Full:
+                pass
+        return False
+
+    def produce():
+        # Reads and loads are part of the request of the caller
+        attach(trace)
+        try:
+            batch = []
+            for item in items:
+                batch.append(item)
+                if len(batch) == batch_size:
+                    if not put((load(batch), None)):
+                        return
+                    batch = []
+            if len(batch) > 0:
+                if not put((load(batch), None)):
+                    return
+        except Exception:
+            put((None, sys.exc_info()))
+            return
+
+        put(_END)
+
+    producer = threading.Thread(target=produce, name='nexus-prefetch')
+    producer.daemon = True
+    producer.start()
+
+    try:
+        while True:
+            entry = loaded.get()
+            if entry is _END:
+                return
+
+            batch, exc_info = entry
+            if exc_info is not None:
+                raise exc_info[0], exc_info[1], exc_info[2]
+
+            yield batch
+    finally:
+        stop.set()
@@ -0,0 +1,250 @@
+"""
+Copyright (c) 2016 Jet Propulsion Laboratory,
+California Institute of Technology.  All rights reserved
+"""
+import inspect
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from functools import wraps
+
+# Upper bounds in seconds of the buckets of the latency histograms
+LATENCY_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 300.0)
+
+_current = threading.local()
+
+
+class Trace(object):
+    """
+    Time spent in each span of one request, and the counts added during it, by every thread attached to it.
+
+    :param name: Name of the traced request, such as its path
+    """
+
+    def __init__(self, name):
+        self.name = name
+        self.started = time.time()
+
+        self._lock = threading.Lock()
+        # span name -> [calls, seconds], in the order the spans were first seen
+        self._spans = {}
+        self._span_order = []
+        self._counts = {}
+
+    def add_span(self, name, seconds):
+        with self._lock:
+            if name not in self._spans:
+                self._spans[name] = [0, 0.0]
+                self._span_order.append(name)
+            self._spans[name][0] += 1
+            self._spans[name][1] += seconds
+
+    def add_count(self, name, value):
+        with self._lock:
+            self._counts[name] = self._counts.get(name, 0) + value
+
+    def elapsed(self):
+        return time.time() - self.started
+
+    def spans(self):
+        """
+        :return: List of (span name, calls, seconds) in the order the spans were first seen. Spans can be nested and
+                 run on several threads at once, so their seconds do not add up to the elapsed time.
+        """
+        with self._lock:
+            return [(name, self._spans[name][0], self._spans[name][1]) for name in self._span_order]
+
+    def counts(self):
+        with self._lock:
+            return dict(self._counts)
+
+    def summary(self):
+        """
+        :return: One line of the elapsed time, the spans and the counts of the trace for the log
+        """
+        parts = ["%s %.3fs" % (self.name, self.elapsed())]
+        parts.extend("%s=%dx%.3fs" % span for span in self.spans())
+        parts.extend("%s=%d" % count for count in sorted(self.counts().iteritems()))
+        return ' '.join(parts)
+
+    def server_timing(self):
+        """
+        :return: Value of a Server-Timing response header with the total milliseconds of each span
+        """
+        return ', '.join('%s;dur=%.1f;desc="%d calls"' % (name, seconds * 1000, calls)
+                         for name, calls, seconds in self.spans())
+
+
+def start_trace(name):
+    """
+    Start a Trace and attach it to the calling thread.
+    """
+    trace = Trace(name)
+    attach(trace)
+    return trace
+
+
+def current_trace():
+    """
+    :return: The Trace attached to the calling thread, or None
+    """
+    return getattr(_current, 'trace', None)
+
+
+def attach(trace):
+    """
+    Attach trace to the calling thread, so the spans of a background thread are added to the trace of the request it
+    works for. None detaches the current trace.
+    """
+    _current.trace = trace
+
+
+def end_trace():
+    """
+    Detach and return the Trace of the calling thread.
+    """
+    trace = current_trace()
+    attach(None)
+    return trace
+
+
+class Histogram(object):
+    """
+    Prometheus style histogram of observed values, one series per value of its label.
+    """
+
+    def __init__(self, name, description, label, buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.description = description
+        self.label = label
+        self.buckets = buckets
+
+        self._lock = threading.Lock()
+        # label value -> (per bucket counts with the last for values above all buckets, [count, sum])
+        self._series = {}
+
+    def observe(self, label_value, value):
+        with self._lock:
+            if label_value not in self._series:
+                self._series[label_value] = ([0] * (len(self.buckets) + 1), [0, 0.0])
+            bucket_counts, totals = self._series[label_value]
+            bucket_counts[bisect_left(self.buckets, value)] += 1
+            totals[0] += 1
+            totals[1] += value
+
+    def render(self):
+        lines = ["# HELP %s %s" % (self.name, self.description), "# TYPE %s histogram" % self.name]
+        with self._lock:
+            for label_value in sorted(self._series.keys()):
+                bucket_counts, (count, total) = self._series[label_value]
+                label = '%s="%s"' % (self.label, _escape(label_value))
+                cumulative = 0
+                for bound, bucket_count in zip(self.buckets, bucket_counts):
+                    cumulative += bucket_count
+                    lines.append('%s_bucket{%s,le="%s"} %d' % (self.name, label, bound, cumulative))
+                lines.append('%s_bucket{%s,le="+Inf"} %d' % (self.name, label, count))
+                lines.append('%s_sum{%s} %r' % (self.name, label, total))
+                lines.append('%s_count{%s} %d' % (self.name, label, count))
+        return lines
+
+
+class Counter(object):
+    """
+    Prometheus style counter, one series per value of its label.
+    """
+
+    def __init__(self, name, description, label):
+        self.name = name
+        self.description = description
+        self.label = label
+
+        self._lock = threading.Lock()
+        self._series = {}
+
+    def add(self, label_value, value=1):
+        with self._lock:
+            self._series[label_value] = self._series.get(label_value, 0) + value
+
+    def render(self):
+        lines = ["# HELP %s %s" % (self.name, self.description), "# TYPE %s counter" % self.name]
+        with self._lock:
+            for label_value in sorted(self._series.keys()):
+                lines.append('%s{%s="%s"} %d' % (self.name, self.label, _escape(label_value),
+                                                 self._series[label_value]))
+        return lines
+
+
+def _escape(label_value):
+    return str(label_value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+span_seconds = Histogram('nexus_span_seconds', "Seconds spent in each span of the tile service and the requests",
+                         'span')
+counts = Counter('nexus_count_total', "Tiles, bytes and documents read by the tile service", 'name')
+
+
+@contextmanager
+def span(name):
+    """
+    Time the with block as span name, in the histogram of the span and in the Trace of the calling thread.
+    """
+    start = time.time()
+    try:
+        yield
+    finally:
+        seconds = time.time() - start
+        span_seconds.observe(name, seconds)
+        trace = current_trace()
+        if trace is not None:
+            trace.add_span(name, seconds)
+
+
+def traced(name):
+    """
+    Decorator that times every call of the function as span name.
+    """
+
+    def traced_decorator(func):
+        @wraps(func)
+        def traced_func(*args, **kwargs):
+            with span(name):
+                return func(*args, **kwargs)
+
+        return traced_func
+
+    return traced_decorator
+
+
+def traced_methods(prefix):
+    """
+    Class decorator that times every call of each public method of the class as span <prefix>.<method name>. Methods
+    that return generators are left alone since a call only creates the generator.
+    """
+
+    def traced_methods_decorator(cls):
+        for name, method in cls.__dict__.items():
+            if name.startswith('_') or not inspect.isfunction(method) or inspect.isgeneratorfunction(method) or \
+                    name.endswith('_generator'):
+                continue
+            setattr(cls, name, traced('%s.%s' % (prefix, name))(method))
+        return cls
+
+    return traced_methods_decorator
+
+
+def add_count(name, value=1):
+    """
+    Add value to count name, in the process wide counter and in the Trace of the calling thread.
+    """
+    counts.add(name, value)
+    trace = current_trace()
+    if trace is not None:
+        trace.add_count(name, value)
+
+
+def render_metrics(extra_lines=()):
+    """
+    :return: The span histograms and counters of this process in the Prometheus text format, followed by extra_lines
+    """
+    return '\n'.join(span_seconds.render() + counts.render() + list(extra_lines)) + '\n'
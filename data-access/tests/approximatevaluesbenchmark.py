@@ -0,0 +1,55 @@
+"""
+Copyright (c) 2016 Jet Propulsion Laboratory,
+California Institute of Technology.  All rights reserved
+"""
+
+# Compares get_approximate_value_for_lat_lon called once per point with get_approximate_values_for_lat_lons
+# on random points over a 4 x 4 mosaic of 0.25 degree tiles of 40 x 40 cells.
+#
+# python approximatevaluesbenchmark.py [points]
+
+import sys
+import timeit
+
+import numpy as np
+from nexustiles.model.nexusmodel import get_approximate_value_for_lat_lon, get_approximate_values_for_lat_lons, \
+    Tile, BBox
+
+
+def make_tiles():
+    tiles = []
+    for min_lat in np.arange(0, 40, 10.0):
+        for min_lon in np.arange(0, 40, 10.0):
+            tile = Tile()
+            tile.latitudes = np.ma.array(min_lat + np.arange(40) * 0.25)
+            tile.longitudes = np.ma.array(min_lon + np.arange(40) * 0.25)
+            tile.bbox = BBox(min_lat, min_lat + 9.75, min_lon, min_lon + 9.75)
+            tile.times = np.ma.array([0L])
+            tile.data = np.ma.masked_invalid(np.random.rand(1, 40, 40))
+            tiles.append(tile)
+    return tiles
+
+
+def run(points):
+    tiles = make_tiles()
+    lats = np.random.uniform(0, 39.75, points)
+    lons = np.random.uniform(0, 39.75, points)
+
+    start = timeit.default_timer()
+    scalar_values = [get_approximate_value_for_lat_lon(tiles, lat, lon) for lat, lon in zip(lats, lons)]
+    scalar_time = timeit.default_timer() - start
+
+    start = timeit.default_timer()
+    values, valid = get_approximate_values_for_lat_lons(tiles, lats, lons)
+    batch_time = timeit.default_timer() - start
+
+    mismatches = np.count_nonzero(~np.isclose(np.array(scalar_values, dtype=float), values, equal_nan=True))
+
+    print '%d points, %d tiles' % (points, len(tiles))
+    print 'get_approximate_value_for_lat_lon    %8.3f s' % scalar_time
+    print 'get_approximate_values_for_lat_lons  %8.3f s (%.0fx)' % (batch_time, scalar_time / batch_time)
+    print '%d valid, %d mismatches' % (np.count_nonzero(valid), mismatches)
+
+
+if __name__ == '__main__':
+    run(int(sys.argv[1]) if len(sys.argv) > 1 else 100000)
@@ -0,0 +1,106 @@
+"""
+Copyright (c) 2016 Jet Propulsion Laboratory,
+California Institute of Technology.  All rights reserved
+"""
+import pyximport
+
+pyximport.install()
+
+import ConfigParser
+import os
+import unittest
+import uuid
+
+import nexustiles.dao.CassandraProxy as CassandraProxy
+
+
+class FakeBound(object):
+    def __init__(self, tile_id):
+        self.routing_key = tile_id
+
+
+class FakeStatement(object):
+    def bind(self, values):
+        return FakeBound(values[0])
+
+
+class FakeMetadata(object):
+    def __init__(self, replicas):
+        self.replicas = replicas
+
+    def get_replicas(self, keyspace, routing_key):
+        return [self.replicas[routing_key]]
+
+
+class FakeCluster(object):
+    def __init__(self, replicas):
+        self.metadata = FakeMetadata(replicas)
+
+
+class FakeSession(object):
+    def __init__(self, replicas):
+        self.cluster = FakeCluster(replicas)
+
+
+class TestFetchNexusTiles(unittest.TestCase):
+    def setUp(self):
+        config = ConfigParser.RawConfigParser()
+        config.add_section('cassandra')
+        config.set('cassandra', 'host', '127.0.0.1')
+        config.set('cassandra', 'keyspace', 'nexustiles')
+        config.set('cassandra', 'local_datacenter', 'datacenter1')
+        config.set('cassandra', 'protocol_version', '3')
+        config.set('cassandra', 'fetch_concurrency', '4')
+
+        self.connection_pid = CassandraProxy._connection_pid
+        self.execute_concurrent_with_args = CassandraProxy.execute_concurrent_with_args
+        # Already set up in this process, so no connection is made
+        CassandraProxy._connection_pid = os.getpid()
+        CassandraProxy.execute_concurrent_with_args = self.execute
+
+        self.ids = [uuid.uuid4() for _ in xrange(0, 10)]
+        # Three replicas, interleaved
+        self.replicas = {tile_id: 'node%d' % (i % 3) for i, tile_id in enumerate(self.ids)}
+        self.stored = set(self.ids[1:])
+        self.calls = []
+
+        self.proxy = CassandraProxy.CassandraProxy(config)
+        self.proxy._get_session = lambda: FakeSession(self.replicas)
+        self.proxy._get_fetch_statement = lambda: FakeStatement()
+
+    def tearDown(self):
+        CassandraProxy._connection_pid = self.connection_pid
+        CassandraProxy.execute_concurrent_with_args = self.execute_concurrent_with_args
+
+    def execute(self, session, statement, parameters, concurrency):
+        self.calls.append(([tile_id for tile_id, in parameters], concurrency))
+        return [(True, [{'tile_id': tile_id, 'tile_blob': 'blob'}] if tile_id in self.stored else [])
+                for tile_id, in parameters]
+
+    def test_one_concurrent_fetch(self):
+        self.proxy.fetch_nexus_tiles(*[str(tile_id) for tile_id in self.ids])
+
+        self.assertEquals(1, len(self.calls))
+        fetched, concurrency = self.calls[0]
+        self.assertEquals(4, concurrency)
+        self.assertEquals(sorted(self.ids), sorted(fetched))
+        # Grouped by replica
+        self.assertEquals(sorted(fetched, key=lambda tile_id: self.replicas[tile_id]), fetched)
+
+    def test_request_order(self):
+        requested = list(reversed(self.ids))
+
+        tiles = self.proxy.fetch_nexus_tiles(*[str(tile_id) for tile_id in requested])
+
+        self.assertEquals([tile_id for tile_id in requested if tile_id in self.stored],
+                          [tile.tile_id for tile in tiles])
+
+    def test_missing_ids(self):
+        self.stored = set()
+
+        self.assertEquals([], self.proxy.fetch_nexus_tiles(*[str(tile_id) for tile_id in self.ids]))
+        self.assertEquals([], self.proxy.fetch_nexus_tiles())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,124 @@
+"""
+Copyright (c) 2016 Jet Propulsion Laboratory,
+California Institute of Technology.  All rights reserved
+"""
+import unittest
+from datetime import datetime
+
+from nexustiles.catalog import DatasetCatalog, TileCatalog, to_seconds
+
+DAY = 86400
+
+
+def solr_doc(tile_id, min_lat, max_lat, min_lon, max_lon, min_time, max_time, count=10, dataset='MUR',
+             inserted=datetime(2016, 1, 1)):
+    return {
+        'id': tile_id,
+        'dataset_s': dataset,
+        'tile_min_lat': min_lat,
+        'tile_max_lat': max_lat,
+        'tile_min_lon': min_lon,
+        'tile_max_lon': max_lon,
+        'tile_min_time_dt': datetime.utcfromtimestamp(min_time),
+        'tile_max_time_dt': datetime.utcfromtimestamp(max_time),
+        'tile_count_i': count,
+        'insert_timestamp': inserted
+    }
+
+
+class FakeSolr(object):
+    def __init__(self, docs):
+        self.docs = docs
+        self.inserted_after = []
+
+    def find_tile_summaries_generator(self, fields, inserted_after=None):
+        self.inserted_after.append(inserted_after)
+        return iter([doc for doc in self.docs if inserted_after is None or doc['insert_timestamp'] >= inserted_after])
+
+
+class TestDatasetCatalog(unittest.TestCase):
+    def setUp(self):
+        self.catalog = DatasetCatalog.from_docs([
+            solr_doc('c', 0, 10, 0, 10, 2 * DAY, 2 * DAY),
+            solr_doc('a', 0, 10, 0, 10, DAY, DAY),
+            solr_doc('b', 10, 20, 0, 10, DAY, DAY),
+            solr_doc('empty', 0, 10, 0, 10, DAY, DAY, count=0),
+            solr_doc('long', 0, 10, 0, 10, 0, 3 * DAY)
+        ])
+
+    def ids(self, docs):
+        return [doc['id'] for doc in docs]
+
+    def test_sorted_by_time(self):
+        self.assertEquals(['long', 'a', 'b', 'c'], self.ids(self.catalog.find_tiles_in_box(-90, 90, -180, 180)))
+
+    def test_box(self):
+        self.assertEquals(['long', 'a', 'c'], self.ids(self.catalog.find_tiles_in_box(1, 5, 1, 5)))
+        self.assertEquals(['long', 'a', 'b', 'c'], self.ids(self.catalog.find_tiles_in_box(5, 15, 1, 5)))
+        self.assertEquals([], self.ids(self.catalog.find_tiles_in_box(1, 5, 20, 30)))
+
+    def test_time_range(self):
+        self.assertEquals(['long', 'c'], self.ids(self.catalog.find_tiles_in_box(1, 5, 1, 5, 2 * DAY, 5 * DAY)))
+        self.assertEquals(['long'], self.ids(self.catalog.find_tiles_in_box(1, 5, 1, 5, 2.5 * DAY, 2.5 * DAY)))
+
+    def test_boundary_tiles(self):
+        self.assertEquals(['b'], self.ids(self.catalog.find_boundary_tiles(0, 10, 0, 10, DAY, DAY)))
+
+    def test_days_in_range(self):
+        self.assertEquals([DAY, 2 * DAY], self.catalog.find_days_in_range(-90, 90, -180, 180, 0, 5 * DAY))
+        self.assertEquals([2 * DAY], self.catalog.find_days_in_range(-90, 90, -180, 180, 2 * DAY, 5 * DAY))
+
+    def test_merge_replaces_tiles(self):
+        merged = self.catalog.merge(DatasetCatalog.from_docs([
+            solr_doc('a', 50, 60, 0, 10, DAY, DAY),
+            solr_doc('d', 0, 10, 0, 10, 4 * DAY, 4 * DAY)
+        ]))
+
+        self.assertEquals(6, len(merged))
+        self.assertEquals(['long', 'c', 'd'], self.ids(merged.find_tiles_in_box(1, 5, 1, 5)))
+
+
+class TestTileCatalog(unittest.TestCase):
+    def test_refresh_adds_inserted_tiles(self):
+        solr = FakeSolr([solr_doc('a', 0, 10, 0, 10, DAY, DAY), solr_doc('b', 0, 10, 0, 10, DAY, DAY, dataset='SMAP')])
+        catalog = TileCatalog(solr)
+        catalog.refresh()
+
+        self.assertEquals(1, len(catalog.get('MUR')))
+        self.assertEquals(1, len(catalog.get('SMAP')))
+
+        solr.docs.append(solr_doc('c', 0, 10, 0, 10, DAY, DAY, inserted=datetime(2016, 1, 2)))
+        catalog.refresh()
+
+        self.assertEquals(datetime(2015, 12, 31, 23, 59), solr.inserted_after[-1])
+        self.assertEquals(2, len(catalog.get('MUR')))
+        self.assertIsNone(catalog.get('AVHRR'))
+
+    def test_stale(self):
+        catalog = TileCatalog(FakeSolr([solr_doc('a', 0, 10, 0, 10, DAY, DAY)]), max_age_seconds=-1)
+        self.assertIsNone(catalog.get('MUR'))
+
+        catalog.refresh()
+        self.assertIsNone(catalog.get('MUR'))
+
+    def test_copy(self):
+        catalog = TileCatalog(FakeSolr([solr_doc('a', 0, 10, 0, 10, DAY, DAY)]), refresh_seconds=5)
+        catalog.refresh()
+        solr = FakeSolr([solr_doc('b', 0, 10, 0, 10, DAY, DAY, inserted=datetime(2016, 1, 2))])
+
+        copy = catalog.copy(solr)
+        self.assertEquals(5, copy.refresh_seconds)
+        self.assertEquals(1, len(copy.get('MUR')))
+
+        # Only the copy refreshes from the new Solr
+        copy.refresh()
+        self.assertEquals(2, len(copy.get('MUR')))
+        self.assertEquals(1, len(catalog.get('MUR')))
+        self.assertEquals(datetime(2015, 12, 31, 23, 59), solr.inserted_after[-1])
+
+    def test_to_seconds(self):
+        self.assertEquals(DAY, to_seconds(datetime(1970, 1, 2)))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,79 @@
+"""
+Copyright (c) 2016 Jet Propulsion Laboratory,
+California Institute of Technology.  All rights reserved
+"""
+import pyximport
+
+pyximport.install()
+
+import unittest
+
+import numpy as np
+from nexustiles.model.nexusmodel import Tile
+from nexustiles.nexustiles import NexusTileService
+
+
+def grid_tile(latitudes):
+    tile = Tile()
+    tile.latitudes = np.ma.array(latitudes)
+    tile.longitudes = np.ma.array([10.0, 11.0, 12.0, 13.0])
+    tile.times = np.ma.array([0L])
+    tile.data = np.ma.masked_invalid(np.arange(len(latitudes) * 4.0).reshape((1, len(latitudes), 4)))
+    tile.data[0, 1, 1] = np.ma.masked
+    tile.meta_data = {'wind_dir': np.ma.arange(len(latitudes) * 4.0).reshape((1, len(latitudes), 4)) * 10}
+    return tile
+
+
+class TestMaskTilesToBbox(unittest.TestCase):
+    def setUp(self):
+        self.service = NexusTileService(skipCassandra=True, skipSolr=True)
+
+    def test_mask(self):
+        tile, = self.service.mask_tiles_to_bbox(0.5, 2.0, 10.5, 12.0, [grid_tile([0.0, 1.0, 2.0, 3.0])])
+
+        self.assertEquals((1, 4, 4), tile.data.shape)
+        self.assertEquals([6.0, 9.0, 10.0], tile.data.compressed().tolist())
+
+    def test_crop(self):
+        tile, = self.service.mask_tiles_to_bbox(0.5, 2.0, 10.5, 12.0, [grid_tile([0.0, 1.0, 2.0, 3.0])], crop=True)
+
+        self.assertEquals([1.0, 2.0], tile.latitudes.tolist())
+        self.assertEquals([11.0, 12.0], tile.longitudes.tolist())
+        self.assertEquals((1, 2, 2), tile.data.shape)
+        self.assertEquals([[[None, 6.0], [9.0, 10.0]]], tile.data.tolist())
+        self.assertEquals([[[50.0, 60.0], [90.0, 100.0]]], tile.meta_data['wind_dir'].tolist())
+
+    def test_crop_is_view(self):
+        original = grid_tile([0.0, 1.0, 2.0, 3.0])
+        data = original.data
+
+        tile, = self.service.mask_tiles_to_bbox(0.5, 2.0, 10.5, 12.0, [original], crop=True)
+
+        self.assertTrue(np.may_share_memory(data, tile.data))
+
+    def test_crop_descending_latitudes(self):
+        tile, = self.service.mask_tiles_to_bbox(0.5, 2.0, 10.5, 12.0, [grid_tile([3.0, 2.0, 1.0, 0.0])], crop=True)
+
+        self.assertEquals([2.0, 1.0], tile.latitudes.tolist())
+        self.assertEquals([[[None, 6.0], [9.0, 10.0]]], tile.data.tolist())
+
+    def test_crop_outside_box(self):
+        tile, = self.service.mask_tiles_to_bbox(5.0, 6.0, 10.5, 12.0, [grid_tile([0.0, 1.0, 2.0, 3.0])], crop=True)
+
+        self.assertEquals((1, 0, 2), tile.data.shape)
+
+    def test_swath(self):
+        tile = Tile()
+        tile.swath_shape = (2, 2)
+        tile.latitudes = np.ma.array([0.0, 1.0, 2.0, 3.0])
+        tile.longitudes = np.ma.array([10.0, 11.0, 12.0, 13.0])
+        tile.times = np.ma.array([0L, 0L, 0L, 0L])
+        tile.data = np.ma.array([1.0, 2.0, 3.0, 4.0])
+
+        tile, = self.service.mask_tiles_to_bbox(0.5, 2.0, 10.5, 12.0, [tile], crop=True)
+
+        self.assertEquals([None, 2.0, 3.0, None], tile.data.tolist())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -5,7 +5,8 @@ California Institute of Technology.  All rights reserved
 
 import unittest
 import numpy as np
-from nexustiles.model.nexusmodel import get_approximate_value_for_lat_lon, Tile, BBox
+from nexustiles.model.nexusmodel import get_approximate_value_for_lat_lon, get_approximate_values_for_lat_lons, \
+    get_nexus_points, Tile, BBox
 
 
 class TestApproximateValueMethod(unittest.TestCase):
@@ -178,3 +179,121 @@ class TestApproximateValueMethod(unittest.TestCase):
         #  1.0   [20.  21.  22.  23.  24.]]]
 
         self.assertAlmostEqual(11, get_approximate_value_for_lat_lon([tile], -0.4, -1))
+
+
+class TestSwathPointGenerator(unittest.TestCase):
+    def setUp(self):
+        # A 2 x 3 swath stored as one entry per point
+        self.tile = Tile()
+        self.tile.swath_shape = (2, 3)
+        self.tile.latitudes = np.ma.array([0.0, 0.1, 0.2, 1.0, 1.1, 1.2])
+        self.tile.longitudes = np.ma.array([10.0, 11.0, 12.0, 10.5, 11.5, 12.5])
+        self.tile.times = np.ma.array([100L, 100L, 100L, 200L, 200L, 200L])
+        self.tile.data = np.ma.array([1.0, 0.0, 3.0, 4.0, 5.0, 6.0], mask=[False, False, False, True, False, False])
+
+    def test_grid_tile_is_not_swath(self):
+        self.assertFalse(Tile().is_swath())
+        self.assertTrue(self.tile.is_swath())
+
+    def test_points(self):
+        points = list(self.tile.nexus_point_generator())
+
+        self.assertEquals([(0, 0), (0, 2), (1, 1), (1, 2)], [point.index for point in points])
+        self.assertEquals([1.0, 3.0, 5.0, 6.0], [point.data_val for point in points])
+        self.assertEquals([0.0, 0.2, 1.1, 1.2], [point.latitude for point in points])
+        self.assertEquals([10.0, 12.0, 11.5, 12.5], [point.longitude for point in points])
+        self.assertEquals([100L, 100L, 200L, 200L], [point.time for point in points])
+
+    def test_points_include_nan(self):
+        points = list(self.tile.nexus_point_generator(include_nan=True))
+
+        self.assertEquals(6, len(points))
+        self.assertEquals((1, 0), points[3].index)
+        self.assertIs(np.ma.masked, points[3].data_val)
+
+
+class TestNexusPoints(unittest.TestCase):
+    def setUp(self):
+        self.tile = Tile()
+        self.tile.latitudes = np.ma.array([0.0, 1.0])
+        self.tile.longitudes = np.ma.array([10.0, 11.0, 12.0])
+        self.tile.times = np.ma.array([100L])
+        self.tile.data = np.ma.array([[[1.0, 0.0, 3.0], [4.0, 5.0, 6.0]]],
+                                     mask=[[[False, False, False], [True, False, False]]])
+
+    def test_points(self):
+        points = self.tile.nexus_points()
+
+        self.assertEquals([0.0, 0.0, 1.0, 1.0], points.latitude.tolist())
+        self.assertEquals([10.0, 12.0, 11.0, 12.0], points.longitude.tolist())
+        self.assertEquals([100L] * 4, points.time.tolist())
+        self.assertEquals([[0, 0, 0], [0, 0, 2], [0, 1, 1], [0, 1, 2]], points.index.tolist())
+        self.assertEquals([1.0, 3.0, 5.0, 6.0], points.data_val.tolist())
+
+    def test_generator_matches_points(self):
+        points = self.tile.nexus_points(include_nan=True)
+        generated = list(self.tile.nexus_point_generator(include_nan=True))
+
+        self.assertEquals(6, len(generated))
+        self.assertEquals([tuple(index) for index in points.index], [point.index for point in generated])
+        self.assertEquals(points.data_val.tolist(), [None if point.data_val is np.ma.masked else point.data_val
+                                                     for point in generated])
+
+    def test_many_tiles(self):
+        other = Tile()
+        other.latitudes = np.ma.array([5.0])
+        other.longitudes = np.ma.array([20.0])
+        other.times = np.ma.array([200L])
+        other.data = np.ma.array([[[7.0]]])
+
+        points, tile_positions = get_nexus_points([self.tile, other])
+
+        self.assertEquals([1.0, 3.0, 5.0, 6.0, 7.0], points.data_val.tolist())
+        self.assertEquals([100L, 100L, 100L, 100L, 200L], points.time.tolist())
+        self.assertEquals([0, 0, 0, 0, 1], tile_positions.tolist())
+
+    def test_no_tiles(self):
+        points, tile_positions = get_nexus_points([])
+
+        self.assertEquals(0, len(points.data_val))
+        self.assertEquals(0, len(tile_positions))
+
+
+class TestApproximateValuesMethod(unittest.TestCase):
+    def setUp(self):
+        self.tile = Tile()
+        self.tile.bbox = BBox(-1.0, 1.0, -2.0, 2.0)
+        self.tile.latitudes = np.ma.array([-1.0, -0.5, 0, .5, 1.0])
+        self.tile.longitudes = np.ma.array([-2.0, -1.0, 0, 1.0, 2.0])
+        self.tile.times = np.ma.array([0L])
+        self.tile.data = np.ma.arange(25.0).reshape((1, 5, 5))
+        self.tile.data[0, 2, 2] = np.ma.masked
+
+        self.other_tile = Tile()
+        self.other_tile.bbox = BBox(1.0, 3.0, -2.0, 2.0)
+        self.other_tile.latitudes = np.ma.array([3.0, 2.0, 1.0])
+        self.other_tile.longitudes = np.ma.array([-2.0, 0, 2.0])
+        self.other_tile.times = np.ma.array([0L])
+        self.other_tile.data = np.ma.arange(100.0, 109.0).reshape((1, 3, 3))
+
+    def test_matches_single_point_lookup(self):
+        tiles = [self.tile, self.other_tile]
+        lats = np.concatenate((np.random.uniform(-1.5, 3.5, 500), [-1.0, -0.5, 1.0, 3.0, 0.0]))
+        lons = np.concatenate((np.random.uniform(-2.5, 2.5, 500), [-2.0, 0.0, 2.0, 0.0, 0.0]))
+
+        values, valid = get_approximate_values_for_lat_lons(tiles, lats, lons)
+
+        for lat, lon, value, is_valid in zip(lats, lons, values, valid):
+            expected = get_approximate_value_for_lat_lon(tiles, lat, lon)
+            if np.isnan(expected):
+                self.assertFalse(is_valid, (lat, lon))
+                self.assertTrue(np.isnan(value), (lat, lon))
+            else:
+                self.assertTrue(is_valid, (lat, lon))
+                self.assertAlmostEqual(expected, value)
+
+    def test_masked_and_out_of_bounds(self):
+        values, valid = get_approximate_values_for_lat_lons([self.tile], [0.0, 5.0, 1.0], [0.0, 0.0, 2.0])
+
+        self.assertEquals([False, False, True], valid.tolist())
+        self.assertAlmostEqual(24.0, values[2])
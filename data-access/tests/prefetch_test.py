@@ -0,0 +1,63 @@
+"""
+Copyright (c) 2016 Jet Propulsion Laboratory,
+California Institute of Technology.  All rights reserved
+"""
+import threading
+import time
+import unittest
+
+from nexustiles.prefetch import prefetched_batches
+
+
+class TestPrefetchedBatches(unittest.TestCase):
+    def test_batches_in_order(self):
+        batches = list(prefetched_batches(iter(range(10)), 4))
+
+        self.assertEquals([[0, 1, 2, 3], [4, 5, 6, 7], [8, 9]], batches)
+
+    def test_load_applied_to_each_batch(self):
+        batches = list(prefetched_batches(iter(range(6)), 3, load=sum))
+
+        self.assertEquals([3, 12], batches)
+
+    def test_empty(self):
+        self.assertEquals([], list(prefetched_batches(iter([]), 3)))
+
+    def test_loads_at_most_depth_ahead(self):
+        loaded = []
+
+        def load(batch):
+            loaded.append(batch)
+            return batch
+
+        batches = prefetched_batches(iter(range(100)), 1, load=load, depth=2)
+        next(batches)
+        time.sleep(0.2)
+
+        # The batch handed to the caller, depth queued batches and one waiting to be queued
+        self.assertEquals(4, len(loaded))
+        batches.close()
+
+    def test_close_stops_producer(self):
+        batches = prefetched_batches(iter(range(100)), 1, depth=1)
+        next(batches)
+        batches.close()
+        time.sleep(0.3)
+
+        self.assertEquals([], [thread for thread in threading.enumerate() if thread.name == 'nexus-prefetch'])
+
+    def test_exception_raised_to_caller(self):
+        def load(batch):
+            if batch[0] == 2:
+                raise ValueError("bad batch")
+            return batch
+
+        batches = prefetched_batches(iter(range(4)), 1, load=load)
+
+        self.assertEquals([0], next(batches))
+        self.assertEquals([1], next(batches))
+        self.assertRaises(ValueError, next, batches)
+
+
+if __name__ == '__main__':
+    unittest.main()
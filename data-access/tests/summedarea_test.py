@@ -0,0 +1,160 @@
+"""
+Copyright (c) 2016 Jet Propulsion Laboratory,
+California Institute of Technology.  All rights reserved
+"""
+import pyximport
+
+pyximport.install()
+
+import unittest
+import uuid
+
+import nexusproto.NexusContent_pb2 as nexusproto
+import numpy as np
+from nexusproto.serialization import to_metadata, to_shaped_array
+from nexustiles.dao.CassandraProxy import NexusTileData, SUMMED_AREA_COUNT, SUMMED_AREA_SUM, \
+    SUMMED_AREA_SUM_OF_SQUARES
+from nexustiles.model.nexusmodel import Tile
+from nexustiles.nexustiles import NexusTileService
+from nexustiles.tracing import end_trace, start_trace
+
+
+def summed_area(array, dtype):
+    table = np.zeros((array.shape[0] + 1, array.shape[1] + 1), dtype=dtype)
+    table[1:, 1:] = np.cumsum(np.cumsum(array, axis=0, dtype=dtype), axis=1, dtype=dtype)
+    return table
+
+
+def grid_tile_data(latitudes, longitudes, data, with_tables=True):
+    grid_tile = nexusproto.GridTile()
+    grid_tile.latitude.CopyFrom(to_shaped_array(np.array(latitudes)))
+    grid_tile.longitude.CopyFrom(to_shaped_array(np.array(longitudes)))
+    grid_tile.variable_data.CopyFrom(to_shaped_array(data[np.newaxis, :]))
+    grid_tile.time = 0
+    grid_tile.meta_data.add().CopyFrom(to_metadata('wind_dir', data * 10, nexusproto.ShapedArray.DEFLATE))
+
+    if with_tables:
+        valid = ~np.isnan(data)
+        values = np.where(valid, data, 0).astype(np.float64)
+        grid_tile.meta_data.add().CopyFrom(to_metadata(SUMMED_AREA_SUM, summed_area(values, np.float64)))
+        grid_tile.meta_data.add().CopyFrom(to_metadata(SUMMED_AREA_SUM_OF_SQUARES,
+                                                       summed_area(values ** 2, np.float64)))
+        grid_tile.meta_data.add().CopyFrom(to_metadata(SUMMED_AREA_COUNT, summed_area(valid, np.uint16)))
+
+    tile_data = nexusproto.TileData()
+    tile_data.grid_tile.CopyFrom(grid_tile)
+    return NexusTileData(tile_id=uuid.uuid4(), tile_blob=tile_data.SerializeToString())
+
+
+class FakeCassandra(object):
+    def __init__(self, *tile_datas):
+        self.tile_datas = {str(tile_data.tile_id): tile_data for tile_data in tile_datas}
+        self.fetched = []
+
+    def fetch_nexus_tiles(self, *tile_ids):
+        self.fetched.extend(tile_ids)
+        return [self.tile_datas[tile_id] for tile_id in tile_ids]
+
+
+def tile_for(tile_data):
+    tile = Tile()
+    tile.tile_id = str(tile_data.tile_id)
+    return tile
+
+
+class TestGridMetaData(unittest.TestCase):
+    def test_meta_data_decoded(self):
+        data = np.arange(12.0).reshape((3, 4))
+        tile_data = grid_tile_data([0.0, 1.0, 2.0], [10.0, 11.0, 12.0, 13.0], data)
+
+        meta = tile_data.get_lat_lon_time_data_meta()[4]
+
+        self.assertEquals(['wind_dir'], meta.keys())
+        self.assertEquals((1, 3, 4), meta['wind_dir'].shape)
+        self.assertEquals((data * 10).tolist(), meta['wind_dir'][0].tolist())
+
+    def test_summed_area_tables(self):
+        tile_data = grid_tile_data([0.0, 1.0, 2.0], [10.0, 11.0, 12.0, 13.0], np.arange(12.0).reshape((3, 4)))
+
+        latitudes, longitudes, tables = tile_data.get_summed_area_tables()
+
+        self.assertEquals([0.0, 1.0, 2.0], latitudes.tolist())
+        self.assertEquals((4, 5), tables[SUMMED_AREA_SUM].shape)
+        self.assertEquals(66.0, tables[SUMMED_AREA_SUM][3, 4])
+
+    def test_no_summed_area_tables(self):
+        tile_data = grid_tile_data([0.0, 1.0, 2.0], [10.0, 11.0, 12.0, 13.0], np.arange(12.0).reshape((3, 4)),
+                                   with_tables=False)
+
+        self.assertIsNone(tile_data.get_summed_area_tables())
+
+
+class TestStatsInBox(unittest.TestCase):
+    def setUp(self):
+        random = np.random.RandomState(0)
+        self.data = (random.rand(40, 30) * 30 + 270).astype(np.float32)
+        self.data[random.rand(40, 30) < 0.2] = np.nan
+        # Descending latitudes, like many gridded products
+        self.latitudes = np.linspace(20.0, 0.5, 40)
+        self.longitudes = np.linspace(-15.0, 14.0, 30)
+
+        self.service = NexusTileService(skipCassandra=True, skipSolr=True)
+
+    def assert_matches_masked_data(self, tile_data, boxes):
+        self.service._cass = FakeCassandra(tile_data)
+
+        for min_lat, max_lat, min_lon, max_lon in boxes:
+            stats, = self.service.get_stats_in_box_for_tiles(min_lat, max_lat, min_lon, max_lon, [tile_for(tile_data)])
+
+            lat_mask = (self.latitudes < min_lat) | (self.latitudes > max_lat)
+            lon_mask = (self.longitudes < min_lon) | (self.longitudes > max_lon)
+            values = np.ma.array(self.data, mask=np.isnan(self.data) | lat_mask[:, np.newaxis] |
+                                 lon_mask[np.newaxis, :]).compressed().astype(np.float64)
+
+            self.assertEquals(values.size, stats.count)
+            self.assertAlmostEquals(np.sum(values), stats.sum, places=6)
+            self.assertAlmostEquals(np.sum(values ** 2), stats.sum_of_squares, places=3)
+
+    def boxes(self):
+        random = np.random.RandomState(1)
+        boxes = [(-90.0, 90.0, -180.0, 180.0), (30.0, 40.0, 0.0, 10.0), (5.0, 5.1, 0.0, 0.1)]
+        for _ in xrange(0, 50):
+            min_lat, max_lat = sorted(random.uniform(-2.0, 22.0, 2))
+            min_lon, max_lon = sorted(random.uniform(-17.0, 16.0, 2))
+            boxes.append((min_lat, max_lat, min_lon, max_lon))
+        return boxes
+
+    def test_summed_area_tables(self):
+        self.assert_matches_masked_data(grid_tile_data(self.latitudes, self.longitudes, self.data), self.boxes())
+
+    def test_without_summed_area_tables(self):
+        self.assert_matches_masked_data(grid_tile_data(self.latitudes, self.longitudes, self.data, with_tables=False),
+                                        self.boxes())
+
+    def test_masked_coordinates(self):
+        self.latitudes[3] = np.nan
+        self.data[3, :] = np.nan
+
+        self.assert_matches_masked_data(grid_tile_data(self.latitudes, self.longitudes, self.data), self.boxes())
+
+    def test_tile_order(self):
+        first = grid_tile_data(self.latitudes, self.longitudes, self.data)
+        second = grid_tile_data(self.latitudes, self.longitudes, self.data * 2, with_tables=False)
+        self.service._cass = FakeCassandra(first, second)
+
+        trace = start_trace('/test')
+        try:
+            stats = self.service.get_stats_in_box_for_tiles(-90.0, 90.0, -180.0, 180.0,
+                                                            [tile_for(second), tile_for(first)])
+        finally:
+            end_trace()
+
+        # Only the tile with tables is answered from them
+        self.assertEquals(1, trace.counts()['summed_area_tiles'])
+
+        self.assertAlmostEquals(2 * stats[1].sum, stats[0].sum, places=3)
+        self.assertEquals(sorted([str(first.tile_id), str(second.tile_id)]), sorted(self.service._cass.fetched))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,148 @@
+"""
+Copyright (c) 2016 Jet Propulsion Laboratory,
+California Institute of Technology.  All rights reserved
+"""
+import unittest
+
+import numpy as np
+from nexustiles.cache import BoxQueryCache, LRUCache, nbytes, read_only, view_of
+
+
+class TestLRUCache(unittest.TestCase):
+    def test_get_put(self):
+        cache = LRUCache(100, len)
+        cache.put('a', 'x' * 10)
+
+        self.assertEquals('x' * 10, cache.get('a'))
+        self.assertIsNone(cache.get('b'))
+
+        stats = cache.stats()
+        self.assertEquals(1, stats.hits)
+        self.assertEquals(1, stats.misses)
+        self.assertEquals(1, stats.entries)
+        self.assertEquals(10, stats.size_bytes)
+
+    def test_evicts_least_recently_used(self):
+        cache = LRUCache(30, len)
+        cache.put('a', 'x' * 10)
+        cache.put('b', 'x' * 10)
+        cache.put('c', 'x' * 10)
+
+        # Use a so b is the least recently used
+        cache.get('a')
+        cache.put('d', 'x' * 10)
+
+        self.assertIn('a', cache)
+        self.assertNotIn('b', cache)
+        self.assertIn('c', cache)
+        self.assertIn('d', cache)
+        self.assertEquals(1, cache.stats().evictions)
+        self.assertEquals(30, cache.stats().size_bytes)
+
+    def test_replace_updates_size(self):
+        cache = LRUCache(100, len)
+        cache.put('a', 'x' * 10)
+        cache.put('a', 'x' * 20)
+
+        self.assertEquals(1, len(cache))
+        self.assertEquals(20, cache.stats().size_bytes)
+
+    def test_delete(self):
+        cache = LRUCache(100, len)
+        cache.put('a', 'x' * 10)
+        cache.delete('a')
+        cache.delete('b')
+
+        self.assertNotIn('a', cache)
+        self.assertEquals(0, cache.stats().size_bytes)
+
+    def test_value_larger_than_cache_not_stored(self):
+        cache = LRUCache(10, len)
+        cache.put('a', 'x' * 5)
+        cache.put('b', 'x' * 11)
+
+        self.assertIn('a', cache)
+        self.assertNotIn('b', cache)
+
+    def test_ttl(self):
+        cache = LRUCache(100, len, ttl_seconds=-1)
+        cache.put('a', 'x')
+
+        self.assertIsNone(cache.get('a'))
+        self.assertEquals(1, cache.stats().expirations)
+        self.assertEquals(0, cache.stats().size_bytes)
+
+
+def tile_doc(tile_id, min_lat, max_lat, min_lon, max_lon):
+    return {'id': tile_id, 'tile_min_lat': min_lat, 'tile_max_lat': max_lat, 'tile_min_lon': min_lon,
+            'tile_max_lon': max_lon}
+
+
+class TestBoxQueryCache(unittest.TestCase):
+    def setUp(self):
+        self.cache = BoxQueryCache(100)
+        self.cache.put(('MUR', 10), 0, 20, 0, 20, [tile_doc('a', 0, 10, 0, 10), tile_doc('b', 10, 20, 0, 10),
+                                                   tile_doc('c', 0, 10, 10, 20), tile_doc('d', 10, 20, 10, 20)])
+
+    def ids(self, docs):
+        return [doc['id'] for doc in docs]
+
+    def test_same_box(self):
+        self.assertEquals(['a', 'b', 'c', 'd'], self.ids(self.cache.get(('MUR', 10), 0, 20, 0, 20)))
+
+    def test_contained_box(self):
+        self.assertEquals(['a'], self.ids(self.cache.get(('MUR', 10), 2, 5, 2, 5)))
+        self.assertEquals(['a', 'b'], self.ids(self.cache.get(('MUR', 10), 5, 15, 2, 5)))
+
+    def test_miss(self):
+        self.assertIsNone(self.cache.get(('MUR', 10), 5, 25, 2, 5))
+        self.assertIsNone(self.cache.get(('MUR', 11), 2, 5, 2, 5))
+
+        stats = self.cache.stats()
+        self.assertEquals(0, stats.hits)
+        self.assertEquals(2, stats.misses)
+        self.assertEquals(4, stats.size_bytes)
+
+    def test_evicted(self):
+        cache = BoxQueryCache(2)
+        cache.put('MUR', 0, 20, 0, 20, [tile_doc('a', 0, 10, 0, 10), tile_doc('b', 10, 20, 0, 10)])
+        cache.put('MUR', 0, 5, 0, 5, [tile_doc('a', 0, 10, 0, 10)])
+
+        self.assertIsNone(cache.get('MUR', 10, 15, 0, 5))
+        self.assertEquals(['a'], self.ids(cache.get('MUR', 1, 2, 1, 2)))
+
+
+class TestCachedArrays(unittest.TestCase):
+    def setUp(self):
+        self.data = np.ma.masked_invalid(np.array([[[1.0, np.nan], [3.0, 4.0]]]))
+        self.lats = np.ma.array([1.0, 2.0])
+        self.meta = {'wind_dir': np.ma.masked_invalid(np.array([[[0.0, np.nan], [1.0, 2.0]]]))}
+
+    def test_nbytes(self):
+        self.assertEquals(32 + 4 + 16 + 32 + 4, nbytes((self.data, self.lats, self.meta)))
+
+    def test_read_only(self):
+        read_only((self.data, self.lats, self.meta))
+
+        with self.assertRaises(ValueError):
+            self.data[0, 0, 0] = 10
+        with self.assertRaises(ValueError):
+            self.data.mask[0, 0, 0] = True
+        with self.assertRaises(ValueError):
+            self.meta['wind_dir'][0, 0, 0] = 10
+
+    def test_view_does_not_change_cached(self):
+        cached = read_only((self.data, self.lats, self.meta))
+        data, lats, meta = view_of(cached)
+
+        data = np.ma.masked_where(np.ones(data.shape, dtype=bool), data)
+        lats.mask = [True, False]
+        meta['new'] = np.ma.array([1])
+
+        self.assertEquals(3, np.ma.count(self.data))
+        self.assertEquals(2, np.ma.count(self.lats))
+        self.assertEquals(['wind_dir'], self.meta.keys())
+
+
+if __name__ == '__main__':
+    unittest.main()
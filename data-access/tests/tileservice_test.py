@@ -0,0 +1,140 @@
+"""
+Copyright (c) 2016 Jet Propulsion Laboratory,
+California Institute of Technology.  All rights reserved
+"""
+import pyximport
+
+pyximport.install()
+
+import ConfigParser
+import threading
+import unittest
+
+import nexustiles.dao.SolrProxy as SolrProxy
+import nexustiles.nexustiles as nexustiles
+
+
+class TestGetTileService(unittest.TestCase):
+    def test_shared(self):
+        service = nexustiles.get_tile_service(skipCassandra=True, skipSolr=True)
+
+        self.assertIs(service, nexustiles.get_tile_service(skipCassandra=True, skipSolr=True))
+
+    def test_new_after_fork(self):
+        service = nexustiles.get_tile_service(skipCassandra=True, skipSolr=True)
+
+        # As seen by a forked process
+        nexustiles._tile_services_pid = -1
+
+        self.assertIsNot(service, nexustiles.get_tile_service(skipCassandra=True, skipSolr=True))
+
+
+class FakeSolr(object):
+    def __init__(self, url):
+        self.url = url
+        self.closed = False
+
+    def close(self):
+        self.closed = True
+
+
+class TestSolrConnectionPool(unittest.TestCase):
+    def setUp(self):
+        self.solr_class = SolrProxy.solr.Solr
+        SolrProxy.solr.Solr = FakeSolr
+
+    def tearDown(self):
+        SolrProxy.solr.Solr = self.solr_class
+
+    def test_shared(self):
+        pool = SolrProxy.get_connection_pool('http://localhost:8983/solr/test_shared', 2)
+
+        self.assertIs(pool, SolrProxy.get_connection_pool('http://localhost:8983/solr/test_shared', 2))
+
+    def test_proxy_new_pool_after_fork(self):
+        config = ConfigParser.RawConfigParser()
+        config.add_section('solr')
+        config.set('solr', 'host', 'localhost:8983')
+        config.set('solr', 'core', 'test_fork')
+        config.set('solr', 'pool_size', '3')
+        proxy = SolrProxy.SolrProxy(config)
+        pool = proxy._connection_pool()
+
+        self.assertIs(pool, proxy._connection_pool())
+
+        # As seen by a forked process
+        pool.pid = -1
+
+        forked_pool = proxy._connection_pool()
+        self.assertIsNot(pool, forked_pool)
+        self.assertEquals(3, forked_pool.size)
+
+    def test_invalidate_query_caches(self):
+        config = ConfigParser.RawConfigParser()
+        config.add_section('solr')
+        config.set('solr', 'host', 'localhost:8983')
+        config.set('solr', 'core', 'test_invalidate')
+        config.set('solr', 'query_cache_docs', '100')
+        config.set('solr', 'query_cache_ttl_seconds', '300')
+        proxy = SolrProxy.SolrProxy(config)
+        searches = []
+
+        def find_days(min_lat, max_lat, min_lon, max_lon, ds, start_time, end_time, **kwargs):
+            searches.append(ds)
+            return [86400, 172800]
+
+        proxy._find_days_in_range_asc = find_days
+
+        for _ in xrange(0, 2):
+            proxy.find_days_in_range_asc(0, 10, 0, 10, 'MUR', 0, 172800)
+            proxy.find_days_in_range_asc(0, 10, 0, 10, 'SMAP', 0, 172800)
+        self.assertEquals(['MUR', 'SMAP'], searches)
+        self.assertEquals(300, proxy.get_query_cache_ttl())
+
+        SolrProxy.invalidate_query_caches('MUR')
+        proxy.find_days_in_range_asc(0, 10, 0, 10, 'MUR', 0, 172800)
+        proxy.find_days_in_range_asc(0, 10, 0, 10, 'SMAP', 0, 172800)
+
+        self.assertEquals(['MUR', 'SMAP', 'MUR'], searches)
+
+    def test_reuses_connections(self):
+        pool = SolrProxy.SolrConnectionPool('http://localhost:8983/solr/nexustiles', 2)
+
+        with pool.connection() as first:
+            pass
+        with pool.connection() as second:
+            pass
+
+        self.assertIs(first, second)
+
+    def test_closes_failed_connections(self):
+        pool = SolrProxy.SolrConnectionPool('http://localhost:8983/solr/nexustiles', 2)
+
+        with self.assertRaises(IOError):
+            with pool.connection() as failed:
+                raise IOError()
+        with pool.connection() as solrcon:
+            pass
+
+        self.assertTrue(failed.closed)
+        self.assertIsNot(failed, solrcon)
+
+    def test_bounded(self):
+        pool = SolrProxy.SolrConnectionPool('http://localhost:8983/solr/nexustiles', 1)
+        acquired = threading.Event()
+
+        def use_connection():
+            with pool.connection():
+                acquired.set()
+
+        with pool.connection():
+            thread = threading.Thread(target=use_connection)
+            thread.start()
+            self.assertFalse(acquired.wait(0.2))
+
+        thread.join()
+        self.assertTrue(acquired.is_set())
+
+
+if __name__ == '__main__':
+    unittest.main()
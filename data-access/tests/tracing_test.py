@@ -0,0 +1,117 @@
+"""
+Copyright (c) 2016 Jet Propulsion Laboratory,
+California Institute of Technology.  All rights reserved
+"""
+import threading
+import unittest
+
+from nexustiles.tracing import Counter, Histogram, add_count, attach, current_trace, end_trace, span, start_trace, \
+    traced, traced_methods
+
+
+class TestTrace(unittest.TestCase):
+    def tearDown(self):
+        end_trace()
+
+    def test_spans_and_counts(self):
+        trace = start_trace('/test')
+        with span('solr.query'):
+            pass
+        with span('solr.query'):
+            pass
+        with span('decode'):
+            pass
+        add_count('tiles_fetched', 3)
+
+        self.assertEquals(['solr.query', 'decode'], [name for name, _, _ in trace.spans()])
+        self.assertEquals(2, trace.spans()[0][1])
+        self.assertEquals({'tiles_fetched': 3}, trace.counts())
+        self.assertIn('solr.query;dur=', trace.server_timing())
+
+    def test_end_trace_detaches(self):
+        trace = start_trace('/test')
+
+        self.assertIs(trace, end_trace())
+        self.assertIsNone(current_trace())
+
+        with span('decode'):
+            pass
+        self.assertEquals([], trace.spans())
+
+    def test_attached_thread(self):
+        trace = start_trace('/test')
+
+        def work():
+            attach(trace)
+            with span('cassandra.fetch'):
+                pass
+
+        thread = threading.Thread(target=work)
+        thread.start()
+        thread.join()
+
+        self.assertEquals(['cassandra.fetch'], [name for name, _, _ in trace.spans()])
+
+    def test_traced_methods(self):
+        @traced_methods('service')
+        class Service(object):
+            def find(self):
+                return 1
+
+            def find_generator(self):
+                return iter([1])
+
+            def generate(self):
+                yield 1
+
+            def _private(self):
+                return 1
+
+        trace = start_trace('/test')
+        service = Service()
+        service.find()
+        service.find_generator()
+        list(service.generate())
+        service._private()
+
+        self.assertEquals([('service.find', 1)], [(name, calls) for name, calls, _ in trace.spans()])
+
+    def test_traced_raises(self):
+        @traced('failing')
+        def fail():
+            raise ValueError()
+
+        trace = start_trace('/test')
+        with self.assertRaises(ValueError):
+            fail()
+
+        self.assertEquals(['failing'], [name for name, _, _ in trace.spans()])
+
+
+class TestMetrics(unittest.TestCase):
+    def test_histogram(self):
+        histogram = Histogram('test_seconds', "Test", 'span', buckets=(0.1, 1.0))
+        histogram.observe('a', 0.05)
+        histogram.observe('a', 0.5)
+        histogram.observe('a', 5)
+
+        lines = histogram.render()
+        self.assertIn('test_seconds_bucket{span="a",le="0.1"} 1', lines)
+        self.assertIn('test_seconds_bucket{span="a",le="1.0"} 2', lines)
+        self.assertIn('test_seconds_bucket{span="a",le="+Inf"} 3', lines)
+        self.assertIn('test_seconds_count{span="a"} 3', lines)
+        self.assertIn('test_seconds_sum{span="a"} 5.55', lines)
+
+    def test_counter(self):
+        counter = Counter('test_total', "Test", 'name')
+        counter.add('tiles')
+        counter.add('tiles', 2)
+        counter.add('say "hi"')
+
+        lines = counter.render()
+        self.assertIn('test_total{name="tiles"} 3', lines)
+        self.assertIn('test_total{name="say \\"hi\\""} 1', lines)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -3,15 +3,86 @@ Copyright (c) 2016 Jet Propulsion Laboratory,
 California Institute of Technology.  All rights reserved
 """
 import StringIO
+import zlib
 
 import numpy
 
 import nexusproto.NexusContent_pb2 as nexusproto
 
+try:
+    import lz4.block as lz4
+except ImportError:
+    lz4 = None
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+
+def _require(module, name):
+    if module is None:
+        raise ImportError("The %s module is required to read or write %s compressed arrays" % (name, name))
+    return module
+
+
+def _compress(compression, array_data):
+    if compression == nexusproto.ShapedArray.NONE:
+        return array_data
+    elif compression == nexusproto.ShapedArray.DEFLATE:
+        return zlib.compress(array_data)
+    elif compression == nexusproto.ShapedArray.LZ4:
+        return _require(lz4, 'lz4').compress(array_data, store_size=True)
+    elif compression == nexusproto.ShapedArray.ZSTD:
+        return _require(zstandard, 'zstandard').ZstdCompressor().compress(array_data)
+
+    raise NotImplementedError("Unsupported compression %s" % compression)
+
+
+def _decompress(compression, array_data):
+    if compression == nexusproto.ShapedArray.NONE:
+        return array_data
+    elif compression == nexusproto.ShapedArray.DEFLATE:
+        return zlib.decompress(array_data)
+    elif compression == nexusproto.ShapedArray.LZ4:
+        return _require(lz4, 'lz4').decompress(array_data)
+    elif compression == nexusproto.ShapedArray.ZSTD:
+        return _require(zstandard, 'zstandard').ZstdDecompressor().decompress(array_data)
+
+    raise NotImplementedError("Unsupported compression %s" % compression)
+
+
+def compression_from_name(name):
+    """
+    Look up a ShapedArray.Compression value by name (NONE, DEFLATE, LZ4 or ZSTD), ignoring case.
+    """
+    return nexusproto.ShapedArray.Compression.Value(name.strip().upper())
+
 
 def from_shaped_array(shaped_array):
+    """
+    Decode a ShapedArray into a numpy array.
+
+    Arrays written as raw bytes are returned as a read-only view over the bytes of shaped_array.array_data, after
+    they have been decompressed if shaped_array.compression is set.
+    Arrays written by older versions of to_shaped_array are stored in the .npy format and are read with numpy.load.
+    Callers that need to modify the data must copy it first.
+    """
+    dtype = numpy.dtype(shaped_array.dtype)
+    shape = tuple(shaped_array.shape)
+    array_data = _decompress(shaped_array.compression, shaped_array.array_data)
+
+    if len(array_data) == int(numpy.prod(shape)) * dtype.itemsize:
+        if len(array_data) == 0:
+            return numpy.empty(shape, dtype=dtype)
+        return numpy.frombuffer(array_data, dtype=dtype).reshape(shape)
+
+    return _from_npy_bytes(array_data)
+
+
+def _from_npy_bytes(array_data):
     memfile = StringIO.StringIO()
-    memfile.write(shaped_array.array_data)
+    memfile.write(array_data)
     memfile.seek(0)
     data_array = numpy.load(memfile)
     memfile.close()
@@ -19,22 +90,30 @@ def from_shaped_array(shaped_array):
     return data_array
 
 
-def to_shaped_array(data_array):
+def to_shaped_array(data_array, compression=nexusproto.ShapedArray.NONE):
+    """
+    Encode a numpy array as a ShapedArray holding the raw, C-ordered, native byte order array data, compressed with
+    the given ShapedArray.Compression.
+    Masked values are written with their underlying data, the same as numpy.save did previously.
+    """
+    data_array = numpy.ascontiguousarray(numpy.ma.getdata(data_array))
+    if not data_array.dtype.isnative:
+        data_array = data_array.astype(data_array.dtype.newbyteorder('='))
+
     shaped_array = nexusproto.ShapedArray()
 
     shaped_array.shape.extend([dimension_size for dimension_size in data_array.shape])
     shaped_array.dtype = str(data_array.dtype)
-
-    memfile = StringIO.StringIO()
-    numpy.save(memfile, data_array)
-    shaped_array.array_data = memfile.getvalue()
-    memfile.close()
+    shaped_array.array_data = _compress(compression, data_array.tobytes())
+    if compression != nexusproto.ShapedArray.NONE:
+        shaped_array.compression = compression
 
     return shaped_array
 
-def to_metadata(name, data_array):
+
+def to_metadata(name, data_array, compression=nexusproto.ShapedArray.NONE):
     metadata = nexusproto.MetaData()
     metadata.name = name
-    metadata.meta_data.CopyFrom(to_shaped_array(data_array))
+    metadata.meta_data.CopyFrom(to_shaped_array(data_array, compression))
 
     return metadata
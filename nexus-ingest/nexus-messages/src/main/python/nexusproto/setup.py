@@ -19,9 +19,16 @@ setup(
     platforms='any',
 
     install_requires=[
-        'protobuf'
+        'protobuf',
+        'numpy'
     ],
 
+    # Needed only to read or write arrays compressed with these codecs
+    extras_require={
+        'lz4': ['lz4'],
+        'zstd': ['zstandard']
+    },
+
     classifiers=[
         'Development Status :: 1 - Pre-Alpha',
         'Intended Audience :: Developers',
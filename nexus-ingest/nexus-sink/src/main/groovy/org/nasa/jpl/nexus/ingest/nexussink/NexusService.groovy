@@ -95,6 +95,11 @@ class NexusService {
                 "tile_count_i"    : stats.count
         ]
 
+        if (stats.hasSum() && stats.hasSumOfSquares()) {
+            doc["tile_sum_val_d"] = stats.sum
+            doc["tile_sum_sq_val_d"] = stats.sumOfSquares
+        }
+
         summary.globalAttributesList.forEach { attribute ->
             doc["${attribute.name}"] = attribute.valuesCount==1?attribute.getValues(0):attribute.getValuesList().toList()
         }
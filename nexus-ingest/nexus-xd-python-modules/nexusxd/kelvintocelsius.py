@@ -17,7 +17,7 @@ def transform(self, tile_data):
 
     var_data = from_shaped_array(the_tile_data.variable_data) - 273.15
 
-    the_tile_data.variable_data.CopyFrom(to_shaped_array(var_data))
+    the_tile_data.variable_data.CopyFrom(to_shaped_array(var_data, the_tile_data.variable_data.compression))
 
     yield nexus_tile.SerializeToString()
 
@@ -17,7 +17,7 @@ def transform(self, tile_data):
 
     longitudes = from_shaped_array(the_tile_data.longitude) - 180
 
-    the_tile_data.longitude.CopyFrom(to_shaped_array(longitudes))
+    the_tile_data.longitude.CopyFrom(to_shaped_array(longitudes, the_tile_data.longitude.compression))
 
     yield nexus_tile.SerializeToString()
 
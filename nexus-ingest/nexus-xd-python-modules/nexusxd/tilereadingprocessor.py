@@ -11,7 +11,7 @@ from os import environ, sep, path, remove
 import nexusproto.NexusContent_pb2 as nexusproto
 import numpy
 from netCDF4 import Dataset, num2date
-from nexusproto.serialization import to_shaped_array, to_metadata
+from nexusproto.serialization import to_shaped_array, to_metadata, compression_from_name
 from pytz import timezone
 
 from springxd.tcpstream import LengthHeaderTcpProcessor, start_server
@@ -34,6 +34,12 @@ try:
 except KeyError:
     metadata = None
 
+# Compression used for every array in the tiles: NONE (default), DEFLATE, LZ4 or ZSTD
+try:
+    compression = compression_from_name(environ['COMPRESSION'])
+except KeyError:
+    compression = nexusproto.ShapedArray.NONE
+
 try:
     start_of_day = environ['GLBLATTR_DAY']
     start_of_day_pattern = environ['GLBLATTR_DAY_FORMAT']
@@ -134,9 +140,11 @@ def read_grid_data(self, section_spec_dataset):
         for section_spec, dimtoslice in tile_specifications:
             tile = nexusproto.GridTile()
 
-            tile.latitude.CopyFrom(to_shaped_array(numpy.ma.filled(ds[latitude][dimtoslice[latitude]], numpy.NaN)))
+            tile.latitude.CopyFrom(
+                to_shaped_array(numpy.ma.filled(ds[latitude][dimtoslice[latitude]], numpy.NaN), compression))
 
-            tile.longitude.CopyFrom(to_shaped_array(numpy.ma.filled(ds[longitude][dimtoslice[longitude]], numpy.NaN)))
+            tile.longitude.CopyFrom(
+                to_shaped_array(numpy.ma.filled(ds[longitude][dimtoslice[longitude]], numpy.NaN), compression))
 
             # Before we read the data we need to make sure the dimensions are in the proper order so we don't have any
             #  indexing issues
@@ -144,10 +152,11 @@ def read_grid_data(self, section_spec_dataset):
             # Read data using the ordered slices, replacing masked values with NaN
             data_array = numpy.ma.filled(ds[variable_to_read][tuple(ordered_slices.itervalues())], numpy.NaN)
 
-            tile.variable_data.CopyFrom(to_shaped_array(data_array))
+            tile.variable_data.CopyFrom(to_shaped_array(data_array, compression))
 
             if metadata is not None:
-                tile.meta_data.add().CopyFrom(to_metadata(metadata, ds[metadata][tuple(ordered_slices.itervalues())]))
+                tile.meta_data.add().CopyFrom(
+                    to_metadata(metadata, ds[metadata][tuple(ordered_slices.itervalues())], compression))
 
             if time is not None:
                 timevar = ds[time]
@@ -175,10 +184,12 @@ def read_swath_data(self, section_spec_dataset):
             # Time Lat Long Data and metadata should all be indexed by the same dimensions, order the incoming spec once using the data variable
             ordered_slices = get_ordered_slices(ds, variable_to_read, dimtoslice)
             tile.latitude.CopyFrom(
-                to_shaped_array(numpy.ma.filled(ds[latitude][tuple(ordered_slices.itervalues())], numpy.NaN)))
+                to_shaped_array(numpy.ma.filled(ds[latitude][tuple(ordered_slices.itervalues())], numpy.NaN),
+                                compression))
 
             tile.longitude.CopyFrom(
-                to_shaped_array(numpy.ma.filled(ds[longitude][tuple(ordered_slices.itervalues())], numpy.NaN)))
+                to_shaped_array(numpy.ma.filled(ds[longitude][tuple(ordered_slices.itervalues())], numpy.NaN),
+                                compression))
 
             timetile = ds[time][tuple([ordered_slices[time_dim] for time_dim in ds[time].dimensions])].astype('float64',
                                                                                                               casting='same_kind',
@@ -193,14 +204,15 @@ def read_swath_data(self, section_spec_dataset):
                 timetile[index] = to_seconds_from_epoch(timetile[index].item(), timeunits=timeunits,
                                                         start_day=start_of_day_date)
 
-            tile.time.CopyFrom(to_shaped_array(timetile))
+            tile.time.CopyFrom(to_shaped_array(timetile, compression))
 
             # Read the data converting masked values to NaN
             data_array = numpy.ma.filled(ds[variable_to_read][tuple(ordered_slices.itervalues())], numpy.NaN)
-            tile.variable_data.CopyFrom(to_shaped_array(data_array))
+            tile.variable_data.CopyFrom(to_shaped_array(data_array, compression))
 
             if metadata is not None:
-                tile.meta_data.add().CopyFrom(to_metadata(metadata, ds[metadata][tuple(ordered_slices.itervalues())]))
+                tile.meta_data.add().CopyFrom(
+                    to_metadata(metadata, ds[metadata][tuple(ordered_slices.itervalues())], compression))
 
             nexus_tile = new_nexus_tile(file_path, section_spec)
             nexus_tile.tile.swath_tile.CopyFrom(tile)
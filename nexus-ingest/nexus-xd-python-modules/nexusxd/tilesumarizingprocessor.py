@@ -7,7 +7,7 @@ from springxd.tcpstream import start_server, LengthHeaderTcpProcessor
 
 import nexusproto.NexusContent_pb2 as nexusproto
 import numpy
-from nexusproto.serialization import from_shaped_array
+from nexusproto.serialization import from_shaped_array, to_metadata
 
 try:
     var_name = os.environ["STORED_VAR_NAME"]
@@ -15,6 +15,17 @@ except KeyError:
     # STORED_VAR_NAME is optional
     pass
 
+try:
+    # SUMMED_AREA_TABLES=true stores the summed-area tables of grid tiles in their meta data
+    summed_area_tables = os.environ["SUMMED_AREA_TABLES"].strip().lower() == "true"
+except KeyError:
+    summed_area_tables = False
+
+# Names of the summed-area tables of the sum, the sum of squares and the count of the valid data
+SUMMED_AREA_SUM = "summed_area_sum"
+SUMMED_AREA_SUM_OF_SQUARES = "summed_area_sum_of_squares"
+SUMMED_AREA_COUNT = "summed_area_count"
+
 
 class NoTimeException(Exception):
     pass
@@ -49,6 +60,8 @@ def summarize_nexustile(self, tiledata):
     tilesummary.stats.max = numpy.nanmax(data).item()
     tilesummary.stats.mean = numpy.nanmean(data).item()
     tilesummary.stats.count = data.size - numpy.count_nonzero(numpy.isnan(data))
+    tilesummary.stats.sum = numpy.nansum(data, dtype=numpy.float64).item()
+    tilesummary.stats.sum_of_squares = numpy.nansum(numpy.square(data, dtype=numpy.float64)).item()
 
     try:
         min_time, max_time = find_time_min_max(the_tile_data)
@@ -57,6 +70,9 @@ def summarize_nexustile(self, tiledata):
     except NoTimeException:
         pass
 
+    if summed_area_tables and the_tile_type == "grid_tile":
+        add_summed_area_tables(the_tile_data, data)
+
     try:
         tilesummary.data_var_name = var_name
     except NameError:
@@ -66,6 +82,46 @@ def summarize_nexustile(self, tiledata):
     yield nexus_tile.SerializeToString()
 
 
+def to_summed_area_tables(data):
+    """
+    Summed-area tables of the sum, sum of squares and count of the valid (not NaN) cells of 2-d grid data. Each table
+    has a leading row and column of zeros so that the sum over data[r0:r1, c0:c1] is
+    table[r1, c1] - table[r0, c1] - table[r1, c0] + table[r0, c0].
+
+    :return: Tuple of the sum and sum of squares tables as float64 and the count table as the smallest unsigned int
+             type that holds the number of cells
+    """
+    valid = ~numpy.isnan(data)
+    values = numpy.where(valid, data, 0).astype(numpy.float64)
+
+    def summed_area(array, dtype):
+        table = numpy.zeros((array.shape[0] + 1, array.shape[1] + 1), dtype=dtype)
+        numpy.cumsum(numpy.cumsum(array, axis=0, dtype=dtype), axis=1, dtype=dtype, out=table[1:, 1:])
+        return table
+
+    return (summed_area(values, numpy.float64),
+            summed_area(numpy.square(values), numpy.float64),
+            summed_area(valid, numpy.min_scalar_type(data.size)))
+
+
+def add_summed_area_tables(grid_tile, data):
+    """
+    Replace the summed-area tables in the meta data of grid_tile with those of its data. Tiles with more than one time
+    are left without tables. The tables are stored uncompressed so readers get them without decompressing anything.
+    """
+    if data.ndim < 2 or any(size != 1 for size in data.shape[:-2]):
+        return
+
+    tables = to_summed_area_tables(data.reshape(data.shape[-2:]))
+    names = (SUMMED_AREA_SUM, SUMMED_AREA_SUM_OF_SQUARES, SUMMED_AREA_COUNT)
+
+    meta_data = [meta for meta in grid_tile.meta_data if meta.name not in names]
+    del grid_tile.meta_data[:]
+    grid_tile.meta_data.extend(meta_data)
+    for name, table in zip(names, tables):
+        grid_tile.meta_data.add().CopyFrom(to_metadata(name, table))
+
+
 def find_time_min_max(tile_data):
     # Only try to grab min/max time if it exists as a ShapedArray
     if tile_data.HasField("time") and isinstance(tile_data.time, nexusproto.ShapedArray):
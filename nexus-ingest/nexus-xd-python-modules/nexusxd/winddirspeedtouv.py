@@ -49,6 +49,9 @@ def transform(self, tile_data):
 
     assert wind_speed.shape == wind_dir.shape
 
+    # Write the new arrays with the same compression as the incoming data
+    compression = the_tile_data.variable_data.compression
+
     wind_u_component = numpy.ma.empty(wind_speed.shape, dtype=float)
     wind_v_component = numpy.ma.empty(wind_speed.shape, dtype=float)
     wind_speed_iter = numpy.nditer(wind_speed, flags=['multi_index'])
@@ -69,20 +72,20 @@ def transform(self, tile_data):
     # Stick the original data into the meta data
     wind_speed_meta = the_tile_data.meta_data.add()
     wind_speed_meta.name = 'wind_speed'
-    wind_speed_meta.meta_data.CopyFrom(to_shaped_array(wind_speed))
+    wind_speed_meta.meta_data.CopyFrom(to_shaped_array(wind_speed, compression))
 
     # The u_or_v variable specifies which component variable is the 'data variable' for this tile
     # Replace data with the appropriate component value and put the other component in metadata
     if u_or_v == U_OR_V_ENUM.U:
-        the_tile_data.variable_data.CopyFrom(to_shaped_array(wind_u_component))
+        the_tile_data.variable_data.CopyFrom(to_shaped_array(wind_u_component, compression))
         wind_component_meta = the_tile_data.meta_data.add()
         wind_component_meta.name = 'wind_v'
-        wind_component_meta.meta_data.CopyFrom(to_shaped_array(wind_v_component))
+        wind_component_meta.meta_data.CopyFrom(to_shaped_array(wind_v_component, compression))
     elif u_or_v == U_OR_V_ENUM.V:
-        the_tile_data.variable_data.CopyFrom(to_shaped_array(wind_v_component))
+        the_tile_data.variable_data.CopyFrom(to_shaped_array(wind_v_component, compression))
         wind_component_meta = the_tile_data.meta_data.add()
         wind_component_meta.name = 'wind_u'
-        wind_component_meta.meta_data.CopyFrom(to_shaped_array(wind_u_component))
+        wind_component_meta.meta_data.CopyFrom(to_shaped_array(wind_u_component, compression))
 
     yield nexus_tile.SerializeToString()
 
@@ -0,0 +1,69 @@
+"""
+Copyright (c) 2016 Jet Propulsion Laboratory,
+California Institute of Technology.  All rights reserved
+"""
+
+# Reports the compression ratio and decode throughput of every ShapedArray compression codec
+# on the variable data of tiles read from the granules in tests/datafiles.
+# Codecs whose module (lz4, zstandard) is not installed are skipped.
+#
+# python compressionbenchmark.py [iterations]
+
+import importlib
+import sys
+import timeit
+from os import environ, path
+
+import nexusproto.NexusContent_pb2 as nexusproto
+from nexusproto.serialization import from_shaped_array, to_shaped_array
+
+GRANULES = [
+    ('not_empty_mur.nc4', 'read_grid_data', "time:0:1,lat:0:51,lon:0:51",
+     {'READER': 'GRIDTILE', 'VARIABLE': 'analysed_sst', 'LATITUDE': 'lat', 'LONGITUDE': 'lon', 'TIME': 'time'}),
+    ('partial_empty_mur.nc4', 'read_grid_data', "time:0:1,lat:0:499,lon:0:11",
+     {'READER': 'GRIDTILE', 'VARIABLE': 'analysed_sst', 'LATITUDE': 'lat', 'LONGITUDE': 'lon', 'TIME': 'time'}),
+    ('not_empty_ascatb.nc4', 'read_swath_data', "NUMROWS:0:2,NUMCELLS:0:82",
+     {'READER': 'SWATHTILE', 'VARIABLE': 'wind_speed', 'LATITUDE': 'lat', 'LONGITUDE': 'lon', 'TIME': 'time'}),
+    ('not_empty_smap.h5', 'read_swath_data', "phony_dim_0:0:76,phony_dim_1:0:2",
+     {'READER': 'SWATHTILE', 'VARIABLE': 'smap_sss', 'LATITUDE': 'lat', 'LONGITUDE': 'lon', 'TIME': 'row_time',
+      'GLBLATTR_DAY': 'REV_START_TIME', 'GLBLATTR_DAY_FORMAT': '%Y-%jT%H:%M:%S.%f'})
+]
+
+
+def read_tile_data(granule, reader, section_spec, env):
+    environ.update(env)
+    module = importlib.import_module('nexusxd.tilereadingprocessor')
+    reload(module)
+
+    test_file = path.join(path.dirname(__file__), 'datafiles', granule)
+    nexus_tile = nexusproto.NexusTile.FromString(
+        next(getattr(module, reader)(None, "%s;file://%s" % (section_spec, test_file))))
+
+    for key in env.iterkeys():
+        del environ[key]
+
+    the_tile_type = nexus_tile.tile.WhichOneof("tile_type")
+    return from_shaped_array(getattr(nexus_tile.tile, the_tile_type).variable_data)
+
+
+def run(iterations):
+    print '%-22s %-8s %10s %10s %8s %14s' % ('granule', 'codec', 'raw bytes', 'stored', 'ratio', 'decode MB/s')
+    for granule, reader, section_spec, env in GRANULES:
+        data = read_tile_data(granule, reader, section_spec, env)
+
+        for name, compression in sorted(nexusproto.ShapedArray.Compression.items(), key=lambda item: item[1]):
+            try:
+                shaped_array = to_shaped_array(data, compression)
+            except ImportError as e:
+                print '%-22s %-8s skipped: %s' % (granule, name, e)
+                continue
+
+            decode_time = timeit.timeit(lambda: from_shaped_array(shaped_array), number=iterations) / iterations
+
+            print '%-22s %-8s %10d %10d %8.2f %14.1f' % (
+                granule, name, data.nbytes, len(shaped_array.array_data),
+                float(data.nbytes) / len(shaped_array.array_data), data.nbytes / decode_time / 1e6)
+
+
+if __name__ == '__main__':
+    run(int(sys.argv[1]) if len(sys.argv) > 1 else 1000)
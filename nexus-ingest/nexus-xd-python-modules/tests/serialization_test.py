@@ -0,0 +1,143 @@
+"""
+Copyright (c) 2016 Jet Propulsion Laboratory,
+California Institute of Technology.  All rights reserved
+"""
+import StringIO
+import unittest
+from os import path
+
+import nexusproto.NexusContent_pb2 as nexusproto
+import numpy as np
+from nexusproto.serialization import from_shaped_array, to_shaped_array, compression_from_name
+
+try:
+    import lz4.block
+except ImportError:
+    lz4 = None
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+
+def to_npy_shaped_array(data_array):
+    # The way to_shaped_array encoded arrays before raw bytes were used
+    shaped_array = nexusproto.ShapedArray()
+    shaped_array.shape.extend([dimension_size for dimension_size in data_array.shape])
+    shaped_array.dtype = str(data_array.dtype)
+
+    memfile = StringIO.StringIO()
+    np.save(memfile, data_array)
+    shaped_array.array_data = memfile.getvalue()
+    memfile.close()
+
+    return shaped_array
+
+
+class TestShapedArray(unittest.TestCase):
+    def test_round_trip(self):
+        data = np.random.rand(1, 25, 50).astype(np.float32)
+        data[0, 3:7, 10:20] = np.nan
+
+        shaped_array = nexusproto.ShapedArray.FromString(to_shaped_array(data).SerializeToString())
+        result = from_shaped_array(shaped_array)
+
+        self.assertEquals(data.shape, result.shape)
+        self.assertEquals(data.dtype, result.dtype)
+        np.testing.assert_array_equal(data, result)
+
+    def test_raw_bytes_written(self):
+        data = np.arange(12, dtype=np.int64).reshape(3, 4)
+
+        shaped_array = to_shaped_array(data)
+
+        self.assertEquals(data.nbytes, len(shaped_array.array_data))
+        self.assertEquals([3, 4], list(shaped_array.shape))
+        self.assertEquals('int64', shaped_array.dtype)
+
+    def test_decoded_array_is_read_only(self):
+        result = from_shaped_array(to_shaped_array(np.arange(10, dtype=np.float64)))
+
+        self.assertFalse(result.flags.writeable)
+
+    def test_fortran_ordered_input(self):
+        data = np.asfortranarray(np.arange(20, dtype=np.float32).reshape(4, 5))
+
+        np.testing.assert_array_equal(data, from_shaped_array(to_shaped_array(data)))
+
+    def test_big_endian_input(self):
+        data = np.arange(6, dtype='>f8').reshape(2, 3)
+
+        result = from_shaped_array(to_shaped_array(data))
+
+        self.assertTrue(result.dtype.isnative)
+        np.testing.assert_array_equal(data, result)
+
+    def test_masked_input_keeps_underlying_data(self):
+        data = np.ma.masked_greater(np.arange(5, dtype=np.float32), 2)
+
+        np.testing.assert_array_equal(data.data, from_shaped_array(to_shaped_array(data)))
+
+    def test_empty_array(self):
+        result = from_shaped_array(to_shaped_array(np.empty((0, 10), dtype=np.float32)))
+
+        self.assertEquals((0, 10), result.shape)
+
+    def test_legacy_npy_encoded(self):
+        data = np.asfortranarray(np.random.rand(1, 10, 10))
+
+        result = from_shaped_array(to_npy_shaped_array(data))
+
+        np.testing.assert_array_equal(data, result)
+
+    def test_legacy_dumped_tile(self):
+        test_file = path.join(path.dirname(__file__), 'dumped_nexustiles', 'ascatb_nonempty_nexustile.bin')
+
+        with open(test_file, 'r') as f:
+            nexus_tile = nexusproto.NexusTile.FromString(f.read())
+
+        tile_data = np.ma.masked_invalid(from_shaped_array(nexus_tile.tile.swath_tile.variable_data))
+
+        self.assertEquals(82, np.ma.count(tile_data))
+        np.testing.assert_array_equal(tile_data, from_shaped_array(to_shaped_array(tile_data)))
+
+
+class TestShapedArrayCompression(unittest.TestCase):
+    def setUp(self):
+        self.data = np.full((1, 50, 50), np.nan, dtype=np.float32)
+        self.data[0, 10:20, 10:20] = np.random.rand(10, 10)
+
+    def assert_round_trip(self, compression):
+        shaped_array = nexusproto.ShapedArray.FromString(
+            to_shaped_array(self.data, compression).SerializeToString())
+
+        self.assertEquals(compression, shaped_array.compression)
+        self.assertLess(len(shaped_array.array_data), self.data.nbytes)
+        np.testing.assert_array_equal(self.data, from_shaped_array(shaped_array))
+
+    def test_uncompressed_by_default(self):
+        shaped_array = to_shaped_array(self.data)
+
+        self.assertFalse(shaped_array.HasField('compression'))
+        self.assertEquals(nexusproto.ShapedArray.NONE, shaped_array.compression)
+
+    def test_deflate(self):
+        self.assert_round_trip(nexusproto.ShapedArray.DEFLATE)
+
+    @unittest.skipIf(lz4 is None, "lz4 is not installed")
+    def test_lz4(self):
+        self.assert_round_trip(nexusproto.ShapedArray.LZ4)
+
+    @unittest.skipIf(zstandard is None, "zstandard is not installed")
+    def test_zstd(self):
+        self.assert_round_trip(nexusproto.ShapedArray.ZSTD)
+
+    def test_compression_from_name(self):
+        self.assertEquals(nexusproto.ShapedArray.DEFLATE, compression_from_name('deflate'))
+        self.assertEquals(nexusproto.ShapedArray.ZSTD, compression_from_name(' ZSTD'))
+        self.assertRaises(ValueError, compression_from_name, 'gzip')
+
+
+if __name__ == '__main__':
+    unittest.main()
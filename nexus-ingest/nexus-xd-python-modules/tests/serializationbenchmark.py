@@ -0,0 +1,69 @@
+"""
+Copyright (c) 2016 Jet Propulsion Laboratory,
+California Institute of Technology.  All rights reserved
+"""
+
+# Compares decoding ShapedArrays written as raw bytes against the older .npy encoding
+# on tiles the size of a MUR tile (1 x 250 x 500).
+#
+# python serializationbenchmark.py [iterations]
+
+import StringIO
+import sys
+import timeit
+
+import nexusproto.NexusContent_pb2 as nexusproto
+import numpy as np
+from nexusproto.serialization import from_shaped_array, to_shaped_array
+
+MUR_TILE_SHAPE = (1, 250, 500)
+
+
+def to_npy_shaped_array(data_array):
+    shaped_array = nexusproto.ShapedArray()
+    shaped_array.shape.extend([dimension_size for dimension_size in data_array.shape])
+    shaped_array.dtype = str(data_array.dtype)
+
+    memfile = StringIO.StringIO()
+    np.save(memfile, data_array)
+    shaped_array.array_data = memfile.getvalue()
+    memfile.close()
+
+    return shaped_array
+
+
+def npy_from_shaped_array(shaped_array):
+    memfile = StringIO.StringIO()
+    memfile.write(shaped_array.array_data)
+    memfile.seek(0)
+    data_array = np.load(memfile)
+    memfile.close()
+
+    return data_array
+
+
+def mur_tile(dtype):
+    data = (np.random.rand(*MUR_TILE_SHAPE) * 30 + 273).astype(dtype)
+    # Roughly a third of a MUR tile near the coast is land
+    data[0, :, 0:MUR_TILE_SHAPE[2] / 3] = np.nan
+    return data
+
+
+def run(iterations):
+    print '%-10s %-8s %12s %12s %12s %8s' % ('dtype', 'bytes', 'npy load', 'frombuffer', 'raw encode', 'speedup')
+    for dtype in (np.float32, np.float64):
+        data = mur_tile(dtype)
+
+        npy_array = nexusproto.ShapedArray.FromString(to_npy_shaped_array(data).SerializeToString())
+        raw_array = nexusproto.ShapedArray.FromString(to_shaped_array(data).SerializeToString())
+
+        npy_time = timeit.timeit(lambda: npy_from_shaped_array(npy_array), number=iterations) / iterations
+        raw_time = timeit.timeit(lambda: from_shaped_array(raw_array), number=iterations) / iterations
+        encode_time = timeit.timeit(lambda: to_shaped_array(data), number=iterations) / iterations
+
+        print '%-10s %-8d %10.1fus %10.1fus %10.1fus %7.1fx' % (
+            np.dtype(dtype).name, data.nbytes, npy_time * 1e6, raw_time * 1e6, encode_time * 1e6, npy_time / raw_time)
+
+
+if __name__ == '__main__':
+    run(int(sys.argv[1]) if len(sys.argv) > 1 else 1000)
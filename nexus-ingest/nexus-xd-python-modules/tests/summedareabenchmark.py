@@ -0,0 +1,92 @@
+"""
+Copyright (c) 2016 Jet Propulsion Laboratory,
+California Institute of Technology.  All rights reserved
+"""
+
+# Reports how much the summed-area tables of the tile summarizer add to the stored size of grid tiles read from the
+# granules in tests/datafiles, for every compression codec of the tile arrays, and the time to sum a sub-box from the
+# four corners of the tables against decoding the data and reducing the masked sub-box.
+# Codecs whose module (lz4, zstandard) is not installed are skipped.
+#
+# python summedareabenchmark.py [iterations]
+
+import importlib
+import sys
+import timeit
+from os import environ, path
+
+import nexusproto.NexusContent_pb2 as nexusproto
+import numpy
+from nexusproto.serialization import from_shaped_array
+
+GRANULES = [
+    ('not_empty_mur.nc4', "time:0:1,lat:0:51,lon:0:51"),
+    ('partial_empty_mur.nc4', "time:0:1,lat:0:499,lon:0:11")
+]
+
+ENV = {'READER': 'GRIDTILE', 'VARIABLE': 'analysed_sst', 'LATITUDE': 'lat', 'LONGITUDE': 'lon', 'TIME': 'time'}
+
+
+def summarize_tile(granule, section_spec, compression, summed_area_tables):
+    env = dict(ENV, COMPRESSION=compression, SUMMED_AREA_TABLES=str(summed_area_tables).lower())
+    environ.update(env)
+    reader = importlib.import_module('nexusxd.tilereadingprocessor')
+    reload(reader)
+    summarizer = importlib.import_module('nexusxd.tilesumarizingprocessor')
+    reload(summarizer)
+
+    test_file = path.join(path.dirname(__file__), 'datafiles', granule)
+    tile_data = next(reader.read_grid_data(None, "%s;file://%s" % (section_spec, test_file)))
+    nexus_tile = nexusproto.NexusTile.FromString(next(summarizer.summarize_nexustile(None, tile_data)))
+
+    for key in env.iterkeys():
+        del environ[key]
+
+    return nexus_tile.tile
+
+
+def reduce_box(tile_blob, r0, r1, c0, c1):
+    grid_tile = nexusproto.TileData.FromString(tile_blob).grid_tile
+    data = numpy.ma.masked_invalid(from_shaped_array(grid_tile.variable_data))
+    box = data[..., r0:r1, c0:c1].astype(numpy.float64)
+    return box.count(), box.sum(), (box ** 2).sum()
+
+
+def corner_box(tile_blob, r0, r1, c0, c1):
+    grid_tile = nexusproto.TileData.FromString(tile_blob).grid_tile
+    sums = []
+    for meta_data in grid_tile.meta_data:
+        table = from_shaped_array(meta_data.meta_data)
+        sums.append(table[r1, c1].item() - table[r0, c1].item() - table[r1, c0].item() + table[r0, c0].item())
+    return sums
+
+
+def run(iterations):
+    print '%-22s %-8s %10s %10s %8s %12s %12s' % ('granule', 'codec', 'stored', 'with SAT', 'growth', 'reduce us',
+                                                  'corners us')
+    for granule, section_spec in GRANULES:
+        for name, compression in sorted(nexusproto.ShapedArray.Compression.items(), key=lambda item: item[1]):
+            try:
+                plain = summarize_tile(granule, section_spec, name, False)
+                with_tables = summarize_tile(granule, section_spec, name, True)
+            except ImportError as e:
+                print '%-22s %-8s skipped: %s' % (granule, name, e)
+                continue
+
+            plain_blob = plain.SerializeToString()
+            tables_blob = with_tables.SerializeToString()
+
+            # The middle half of the tile in both directions
+            rows, columns = from_shaped_array(plain.grid_tile.variable_data).shape[-2:]
+            box = (rows / 4, rows - rows / 4, columns / 4, columns - columns / 4)
+
+            reduce_time = timeit.timeit(lambda: reduce_box(plain_blob, *box), number=iterations) / iterations
+            corners_time = timeit.timeit(lambda: corner_box(tables_blob, *box), number=iterations) / iterations
+
+            print '%-22s %-8s %10d %10d %7.2fx %12.1f %12.1f' % (
+                granule, name, len(plain_blob), len(tables_blob), float(len(tables_blob)) / len(plain_blob),
+                reduce_time * 1e6, corners_time * 1e6)
+
+
+if __name__ == '__main__':
+    run(int(sys.argv[1]) if len(sys.argv) > 1 else 1000)
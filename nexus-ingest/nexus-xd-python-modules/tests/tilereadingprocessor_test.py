@@ -140,6 +140,26 @@ class TestReadMurData(unittest.TestCase):
 
         self.assertFalse(np.allclose(tile1_data, tile2_data, equal_nan=True), "Both tiles contain identical data")
 
+    def test_read_compressed_mur(self):
+        environ['COMPRESSION'] = 'DEFLATE'
+        try:
+            reload(self.module)
+            test_file = path.join(path.dirname(__file__), 'datafiles', 'not_empty_mur.nc4')
+
+            results = list(self.module.read_grid_data(None, "time:0:1,lat:0:10,lon:0:10;file://%s" % test_file))
+        finally:
+            del environ['COMPRESSION']
+
+        tile = nexusproto.NexusTile.FromString(results[0]).tile.grid_tile
+
+        self.assertEquals(nexusproto.ShapedArray.DEFLATE, tile.variable_data.compression)
+        self.assertEquals(nexusproto.ShapedArray.DEFLATE, tile.latitude.compression)
+        self.assertEquals(nexusproto.ShapedArray.DEFLATE, tile.longitude.compression)
+
+        tile_data = np.ma.masked_invalid(from_shaped_array(tile.variable_data))
+        self.assertEquals((1, 10, 10), tile_data.shape)
+        self.assertEquals(100, np.ma.count(tile_data))
+
 
 class TestReadAscatbData(unittest.TestCase):
     def setUp(self):
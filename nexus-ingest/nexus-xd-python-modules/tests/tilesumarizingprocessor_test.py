@@ -50,9 +50,90 @@ class TestSmapData(unittest.TestCase):
         self.assertEquals(40, tile_summary.stats.max)
         self.assertAlmostEquals(36.651, tile_summary.stats.mean, places=3)
         self.assertEquals(43, tile_summary.stats.count)
+        self.assertAlmostEquals(36.651 * 43, tile_summary.stats.sum, places=0)
+
+        data = np.ma.masked_invalid(from_shaped_array(nexus_tile.tile.swath_tile.variable_data)).astype(np.float64)
+        self.assertAlmostEquals(np.ma.sum(data), tile_summary.stats.sum, places=6)
+        self.assertAlmostEquals(np.ma.sum(data ** 2), tile_summary.stats.sum_of_squares, places=4)
 
         self.assertEquals(1427820162, tile_summary.stats.min_time)
         self.assertEquals(1427820162, tile_summary.stats.max_time)
 
+    def test_no_summed_area_tables_for_swath(self):
+        environ['SUMMED_AREA_TABLES'] = 'true'
+        try:
+            reload(self.module)
+            test_file = path.join(path.dirname(__file__), 'dumped_nexustiles', 'smap_nonempty_nexustile.bin')
+
+            with open(test_file, 'r') as f:
+                nexus_tile = nexusproto.NexusTile.FromString(next(self.module.summarize_nexustile(None, f.read())))
+
+            self.assertEquals(0, len(nexus_tile.tile.swath_tile.meta_data))
+        finally:
+            del environ['SUMMED_AREA_TABLES']
+
+
+class TestSummedAreaTables(unittest.TestCase):
+    def setUp(self):
+        environ.update({'INBOUND_PORT': '7890', 'OUTBOUND_PORT': '7891', 'SUMMED_AREA_TABLES': 'true',
+                        'READER': 'GRIDTILE', 'VARIABLE': 'analysed_sst', 'LATITUDE': 'lat', 'LONGITUDE': 'lon',
+                        'TIME': 'time'})
+
+        reader = importlib.import_module('nexusxd.tilereadingprocessor')
+        reload(reader)
+        self.module = importlib.import_module('nexusxd.tilesumarizingprocessor')
+        reload(self.module)
+
+        test_file = path.join(path.dirname(__file__), 'datafiles', 'partial_empty_mur.nc4')
+        self.tile_data = next(reader.read_grid_data(None, "time:0:1,lat:0:499,lon:0:11;file://%s" % test_file))
+
+    def tearDown(self):
+        for key in ('INBOUND_PORT', 'OUTBOUND_PORT', 'SUMMED_AREA_TABLES', 'READER', 'VARIABLE', 'LATITUDE',
+                    'LONGITUDE', 'TIME'):
+            del environ[key]
+
+    def summarize(self, tile_data):
+        return nexusproto.NexusTile.FromString(next(self.module.summarize_nexustile(None, tile_data)))
+
+    def test_corner_sums_match_data(self):
+        grid_tile = self.summarize(self.tile_data).tile.grid_tile
+
+        tables = {meta.name: from_shaped_array(meta.meta_data) for meta in grid_tile.meta_data}
+        data = from_shaped_array(grid_tile.variable_data)[0].astype(np.float64)
+        self.assertTrue(np.any(np.isnan(data)))
+
+        def corners(table, r0, r1, c0, c1):
+            return table[r1, c1] - table[r0, c1] - table[r1, c0] + table[r0, c0]
+
+        random = np.random.RandomState(0)
+        for _ in xrange(0, 100):
+            r0, r1 = sorted(random.randint(0, data.shape[0] + 1, 2))
+            c0, c1 = sorted(random.randint(0, data.shape[1] + 1, 2))
+            box = data[r0:r1, c0:c1]
+
+            self.assertEquals(np.count_nonzero(~np.isnan(box)),
+                              corners(tables[self.module.SUMMED_AREA_COUNT], r0, r1, c0, c1))
+            self.assertAlmostEquals(np.nansum(box), corners(tables[self.module.SUMMED_AREA_SUM], r0, r1, c0, c1),
+                                    places=6)
+            self.assertAlmostEquals(np.nansum(box ** 2),
+                                    corners(tables[self.module.SUMMED_AREA_SUM_OF_SQUARES], r0, r1, c0, c1),
+                                    places=3)
+
+    def test_summarize_again_replaces_tables(self):
+        grid_tile = self.summarize(self.summarize(self.tile_data).SerializeToString()).tile.grid_tile
+
+        self.assertEquals([self.module.SUMMED_AREA_SUM, self.module.SUMMED_AREA_SUM_OF_SQUARES,
+                           self.module.SUMMED_AREA_COUNT], [meta.name for meta in grid_tile.meta_data])
+        self.assertEquals([500, 12], list(grid_tile.meta_data[0].meta_data.shape))
+
+    def test_disabled(self):
+        del environ['SUMMED_AREA_TABLES']
+        try:
+            reload(self.module)
+            self.assertEquals(0, len(self.summarize(self.tile_data).tile.grid_tile.meta_data))
+        finally:
+            environ['SUMMED_AREA_TABLES'] = 'true'
+
+
 if __name__ == '__main__':
     unittest.main()